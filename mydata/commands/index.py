@@ -3,13 +3,18 @@ Commands for indexing data
 """
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 
 from ..indexing.settings import validate_settings
 from ..indexing.settings import check_folder_locations
-from ..tasks.indexing import scan_folder_and_upload
+from ..indexing.settings import get_int_setting
+from ..tasks.indexing import IndexingPipeline, scan_folder_and_upload
 from ..indexing.models.lookup import LookupStatus
 from ..indexing.models.datafile import DataFileCreationStatus
+from ..indexing.manifest import close_index_manifests
+from ..utils.file_states import close_file_state_indexes
 
 
 @click.command(name="index")
@@ -37,7 +42,6 @@ def index_cmd(dirs):
     validate_settings()
     check_folder_locations(dirs)
 
-    num_files = 0
     lookups = dict()
     for status in (
         LookupStatus.NOT_FOUND,
@@ -57,11 +61,25 @@ def index_cmd(dirs):
     def datafile_creation_callback(datafile_creation):
         datafile_creations[datafile_creation.status].append(datafile_creation)
 
-    for folder_path in dirs:
+    def index_folder(folder_path):
         folder = os.path.basename(folder_path)
         click.echo("Indexing folder: %s\n" % folder)
-        scan_folder_and_upload(folder, lookup_callback, datafile_creation_callback)
-        num_files += sum([len(files) for r, d, files in os.walk(folder_path)])
+        return scan_folder_and_upload(
+            folder, lookup_callback, datafile_creation_callback, pipeline
+        )
+
+    # Folders are indexed concurrently, sharing one pipeline's threads:
+    pipeline = IndexingPipeline()
+    try:
+        with ThreadPoolExecutor(
+            max_workers=get_int_setting("MYDATA_INDEX_FOLDER_THREADS"),
+            thread_name_prefix="IndexFolderThread",
+        ) as executor:
+            num_files = sum(executor.map(index_folder, dirs))
+    finally:
+        pipeline.shutdown()
+        close_file_state_indexes()
+        close_index_manifests()
 
     num_files_indexed = (
         len(lookups[LookupStatus.FOUND_VERIFIED])
@@ -54,7 +54,7 @@ def scan():
     return users, groups, exps, folders
 
 
-def display_scan_summary(users, groups, exps, folders):
+def display_scan_summary(users, groups, exps, num_folders):
     """Display summary of scan
     """
     data_directory = "%s/" % settings.data_directory.rstrip("/")
@@ -84,7 +84,7 @@ def display_scan_summary(users, groups, exps, folders):
     ):
         click.echo("")
 
-    click.echo("Found %s dataset folders in %s\n" % (len(folders), data_directory))
+    click.echo("Found %s dataset folders in %s\n" % (num_folders, data_directory))
 
     # exps will only be populated if MyData is configured to use a folder structure
     # which includes experiment folders:
@@ -109,4 +109,4 @@ def scan_cmd(verbose):
 
     users, groups, exps, folders = scan()
 
-    display_scan_summary(users, groups, exps, folders)
+    display_scan_summary(users, groups, exps, len(folders))
@@ -2,23 +2,35 @@
 Commands for uploading data
 """
 import sys
-import time
+import threading
 
 import click
 import requests
 
-from mydata.commands.scan import scan, display_scan_summary
-from mydata.tasks.uploads import upload_folder
+from mydata.commands.scan import display_scan_summary
+from mydata.tasks.folders import iter_folders
+from mydata.tasks.uploads import upload_folder, flush_tar_bundles
 from mydata.conf import settings
 from mydata.models.lookup import LookupStatus
 from mydata.models.upload import UploadMethod, UploadStatus, UPLOAD_STATUS
-
-
-def display_default_upload_summary(folders, datasets, lookups, uploads):
+from mydata.utils.openssh import clean_up_scp_and_ssh_processes
+from mydata.utils.sftp import close_sftp_connections
+from mydata.utils.file_states import close_file_state_indexes
+from mydata.utils import bytes_to_human
+from mydata.utils.hashing import get_hashing_throughput, shutdown_hashing_threads
+from mydata.utils.queues import (
+    wait_for_lookups,
+    wait_for_uploads,
+    shutdown_lookup_threads,
+    shutdown_upload_threads,
+)
+
+
+def display_default_upload_summary(totals, datasets, lookups, uploads):
     """Display default summary, displayed irrespective of verbosity
     """
-    num_files = sum([folder.num_files for folder in folders])
-    num_files_uploaded = sum([folder.num_files_uploaded for folder in folders])
+    num_files = totals["num_files"]
+    num_files_uploaded = totals["num_files_uploaded"]
 
     for folder_name in sorted(datasets):
         dataset_id = datasets[folder_name]
@@ -33,7 +45,7 @@ def display_default_upload_summary(folders, datasets, lookups, uploads):
         "%s of %s files have been uploaded to MyTardis."
         % (num_files_uploaded, num_files)
     )
-    num_verified = len(lookups["found_verified"])
+    num_verified = totals["num_verified"]
     click.echo(
         "%s of %s files have been verified by MyTardis." % (num_verified, num_files)
     )
@@ -56,7 +68,7 @@ def display_default_upload_summary(folders, datasets, lookups, uploads):
             % (len(uploads["failed"]), num_files)
         )
 
-    num_cache_hits = sum([folder.num_cache_hits for folder in folders])
+    num_cache_hits = totals["num_cache_hits"]
     click.echo(
         "%s of %s file lookups were found in the local cache."
         % (num_cache_hits, num_files)
@@ -102,6 +114,20 @@ def display_verbose_upload_summary(lookups, uploads, verbosity):
         for upload in sorted(uploads["completed"], key=lambda upload: upload.filename):
             click.echo("%s [%s]" % (upload.filename, UPLOAD_STATUS[upload.status]))
 
+    if verbosity >= 3:
+        throughput = get_hashing_throughput()
+        if throughput:
+            click.echo("\nHashing throughput:")
+            for algorithm, (num_bytes, bytes_per_sec) in sorted(throughput.items()):
+                click.echo(
+                    "%s: %s hashed at %s/s"
+                    % (
+                        algorithm,
+                        bytes_to_human(num_bytes),
+                        bytes_to_human(int(bytes_per_sec)),
+                    )
+                )
+
     click.echo("")
 
 
@@ -127,14 +153,34 @@ def get_approved_upload_method():
         sys.exit(1)
 
     if upload_via_staging_request.approved:
-        upload_method = UploadMethod.SCP
-        click.echo("Using SCP upload method.\n")
+        if settings.miscellaneous.use_sftp and sftp_is_available():
+            upload_method = UploadMethod.SFTP
+            click.echo("Using SFTP upload method.\n")
+        else:
+            upload_method = UploadMethod.SCP
+            click.echo("Using SCP upload method.\n")
     else:
         upload_method = UploadMethod.MULTIPART_POST
         click.echo("Using Multipart POST upload method.\n")
     return upload_method
 
 
+def sftp_is_available():
+    """The SFTP upload method requires paramiko, which is an optional dependency
+    """
+    try:
+        import paramiko  # pylint: disable=import-outside-toplevel,unused-import
+
+        return True
+    except ImportError:
+        click.echo(
+            "The use_sftp setting requires paramiko, which isn't installed, "
+            "so falling back to SCP.\n",
+            err=True,
+        )
+        return False
+
+
 @click.command(name="upload")
 @click.option("-v", "--verbose", count=True)
 def upload_cmd(verbose):
@@ -164,15 +210,29 @@ def upload_cmd(verbose):
             sys.exit(1)
         click.echo()
 
-    users, groups, exps, folders = scan()
+    users = []
+    groups = []
+    exps = []
+
+    # Running totals for the summaries, so that each folder (and its list
+    # of files) can be released once its files have been looked up and
+    # uploaded.  num_files is the number of files found so far, also used
+    # to display progress, because each folder's files are looked up and
+    # uploaded as soon as the folder is found, before the rest of the data
+    # directory is scanned:
+    totals = dict(
+        num_folders=0,
+        num_files=0,
+        num_files_uploaded=0,
+        num_cache_hits=0,
+        num_verified=0,
+    )
+    totals_lock = threading.Lock()
 
-    display_scan_summary(users, groups, exps, folders)
+    # Folders whose files are still being looked up or uploaded:
+    folders_in_progress = set()
 
-    num_files = sum([folder.num_files for folder in folders])
-
-    lookups = dict(
-        not_found=[], found_verified=[], unverified=[], unverified_no_dfos=[], failed=[]
-    )
+    lookups = dict(not_found=[], unverified=[], unverified_no_dfos=[], failed=[])
 
     uploads = dict(completed=[], failed=[])
 
@@ -184,7 +244,8 @@ def upload_cmd(verbose):
         if lookup.status == LookupStatus.NOT_FOUND:
             lookups["not_found"].append(lookup)
         elif lookup.status == LookupStatus.FOUND_VERIFIED:
-            lookups["found_verified"].append(lookup)
+            with totals_lock:
+                totals["num_verified"] += 1
         elif lookup.status in (
             LookupStatus.FOUND_UNVERIFIED_UNSTAGED,
             LookupStatus.FOUND_UNVERIFIED_ON_STAGING,
@@ -196,11 +257,13 @@ def upload_cmd(verbose):
         elif lookup.status == LookupStatus.FAILED:
             lookups["failed"].append(lookup)
 
-        total_lookups = sum([len(lookups[lookup_status]) for lookup_status in lookups])
+        total_lookups = totals["num_verified"] + sum(
+            [len(lookups[lookup_status]) for lookup_status in lookups]
+        )
 
         if not uploads["completed"] and sys.stdout.isatty():
             print(
-                "Looked up %s of %s files..." % (total_lookups, num_files),
+                "Looked up %s of %s files..." % (total_lookups, totals["num_files"]),
                 end="\r",
                 flush=True,
             )
@@ -212,41 +275,67 @@ def upload_cmd(verbose):
             uploads["failed"].append(upload)
 
         # Only display upload progress after lookups have completed:
-        if (uploads["completed"] or len(lookups) == num_files) and sys.stdout.isatty():
+        if (
+            uploads["completed"] or len(lookups) == totals["num_files"]
+        ) and sys.stdout.isatty():
             print(
                 "Uploaded %s of %s files...        "
-                % (len(uploads["completed"]), num_files),
+                % (len(uploads["completed"]), totals["num_files"]),
                 end="\r",
                 flush=True,
             )
 
-    def check_lookup_completion():
-        """When running in multi-threaded mode, we need to check if we have finished
-        """
-        total_lookups = sum([len(lookups[lookup_status]) for lookup_status in lookups])
-        return total_lookups == num_files
-
-    def check_upload_completion():
-        """When running in multi-threaded mode, we need to check if we have finished
-        """
-        uploads_expected = (
-            len(lookups[LookupStatus.NOT_FOUND])
-            + len(lookups[LookupStatus.FOUND_UNVERIFIED_ON_STAGING])
-            + len(lookups[LookupStatus.FOUND_UNVERIFIED_NO_DFOS])
+    def add_folder_counts(folder):
+        with totals_lock:
+            totals["num_files_uploaded"] += folder.num_files_uploaded
+            totals["num_cache_hits"] += folder.num_cache_hits
+
+    def folder_done_callback(folder):
+        add_folder_counts(folder)
+        folders_in_progress.discard(folder)
+
+    for folder in iter_folders(users.append, groups.append, exps.append):
+        folders_in_progress.add(folder)
+        with totals_lock:
+            totals["num_folders"] += 1
+            totals["num_files"] += folder.num_files
+        upload_folder(
+            folder,
+            lookup_callback,
+            upload_callback,
+            upload_method,
+            folder_done_callback=folder_done_callback,
         )
-        return uploads_expected == len(uploads["completed"]) + len(uploads["failed"])
 
-    for folder in folders:
-        upload_folder(folder, lookup_callback, upload_callback, upload_method)
-
-    if settings.advanced.max_lookup_threads > 1:
-        while not check_lookup_completion() or not check_upload_completion():
-            time.sleep(0.1)
+    # When running in multi-threaded mode, lookups (and the uploads they
+    # trigger) are still running in worker threads, so we need to wait for
+    # them to finish before displaying the summary.  Then any small files
+    # still waiting to be bundled together can be uploaded:
+    wait_for_lookups()
+    wait_for_uploads()
+    flush_tar_bundles()
+    shutdown_lookup_threads()
+    shutdown_upload_threads()
+    shutdown_hashing_threads()
+
+    if upload_method == UploadMethod.SCP:
+        clean_up_scp_and_ssh_processes()
+    elif upload_method == UploadMethod.SFTP:
+        close_sftp_connections()
 
     if settings.miscellaneous.cache_datafile_lookups:
         settings.save_verified_datafiles_cache()
 
-    display_default_upload_summary(folders, datasets, lookups, uploads)
+    close_file_state_indexes()
+
+    # Include the counts from any folders which didn't finish, e.g. because
+    # an unexpected error interrupted a lookup:
+    for folder in folders_in_progress:
+        add_folder_counts(folder)
+
+    display_scan_summary(users, groups, exps, totals["num_folders"])
+
+    display_default_upload_summary(totals, datasets, lookups, uploads)
 
     if verbose >= 1:
         display_verbose_upload_summary(lookups, uploads, verbose)
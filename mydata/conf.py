@@ -10,9 +10,14 @@ import os
 
 from mydata.models.settings import Settings
 from mydata.models.settings.serialize import load_settings
-from mydata.utils.queues import init_lookup_threads
+from mydata.utils.queues import init_lookup_threads, init_upload_threads
+from mydata.utils.hashing import init_hashing_threads
 
 settings = Settings(config_path=os.environ.get("MYDATA_CONFIG_PATH"))
 load_settings()
 if settings.advanced.max_lookup_threads > 1:
     init_lookup_threads()
+if settings.advanced.max_upload_threads > 1:
+    init_upload_threads()
+if settings.advanced.max_hashing_threads > 0:
+    init_hashing_threads()
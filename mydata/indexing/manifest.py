@@ -0,0 +1,110 @@
+"""
+mydata/indexing/manifest.py
+
+Persistent manifest of the files which "mydata index" has found to be
+indexed and verified by MyTardis, used to skip unchanged files when
+a folder is indexed again.
+
+The manifest is an SQLite database, recording each verified file's path
+relative to its dataset folder, size, modification time (in nanoseconds)
+and DataFile ID, keyed by dataset ID, so a dataset which is recreated on
+MyTardis (with a new ID) won't match the old entries.  A file whose size
+or modification time has changed since it was recorded is indexed as
+usual, and recorded again once it's verified.
+"""
+import sqlite3
+import threading
+
+from ..logs import logger
+from ..threads.locks import LOCKS
+
+# Open manifests, keyed by database path:
+INDEX_MANIFESTS = dict()
+
+
+class IndexManifest:
+    """
+    Persistent manifest of (dataset_id, relpath, size, mtime_ns, datafile_id)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS indexed_files ("
+            "dataset_id INTEGER, relpath TEXT, size INTEGER, mtime_ns INTEGER, "
+            "datafile_id INTEGER, PRIMARY KEY (dataset_id, relpath)) WITHOUT ROWID"
+        )
+
+    def is_unchanged(self, dataset_id, relpath, stat_result):
+        """
+        Return True if the file at relpath (within the dataset's folder) was
+        recorded as verified with the same size and mtime as stat_result
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns FROM indexed_files "
+                "WHERE dataset_id = ? AND relpath = ?",
+                (int(dataset_id), relpath),
+            ).fetchone()
+        return row is not None and tuple(row) == (
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+        )
+
+    def record(self, dataset_id, entries):
+        """
+        Record verified files, given a list of
+        (relpath, size, mtime_ns, datafile_id) tuples
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO indexed_files VALUES (?, ?, ?, ?, ?)",
+                ((int(dataset_id),) + tuple(entry) for entry in entries),
+            )
+            self.connection.execute("COMMIT")
+
+    def close(self):
+        """
+        Checkpoint the write-ahead log and close the manifest
+        """
+        with self.lock:
+            try:
+                self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as err:
+                logger.warning("Couldn't checkpoint %s: %s" % (self.path, err))
+            self.connection.close()
+
+
+def get_index_manifest(path):
+    """
+    Return the index manifest stored at path, opening it if necessary.
+
+    Return None if the manifest can't be opened, in which case
+    every file will be indexed.
+    """
+    with LOCKS.index_manifests:  # pylint: disable=no-member
+        if path not in INDEX_MANIFESTS:
+            try:
+                INDEX_MANIFESTS[path] = IndexManifest(path)
+            except sqlite3.Error as err:
+                logger.warning("Couldn't open index manifest %s: %s" % (path, err))
+                INDEX_MANIFESTS[path] = None
+        return INDEX_MANIFESTS[path]
+
+
+def close_index_manifests():
+    """
+    Close any open index manifests
+    """
+    with LOCKS.index_manifests:  # pylint: disable=no-member
+        for manifest in INDEX_MANIFESTS.values():
+            if manifest:
+                manifest.close()
+        INDEX_MANIFESTS.clear()
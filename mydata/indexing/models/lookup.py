@@ -31,8 +31,10 @@ class Lookup:
     to see if a file needs indexing.
     """
 
-    def __init__(self, dataset_id, directory, filename, status):
+    def __init__(self, dataset_id, directory, filename, status, datafile_id=None):
         self.dataset_id = dataset_id
         self.directory = directory
         self.filename = filename
         self.status = status
+        # The ID of the matching DataFile record, if one was found:
+        self.datafile_id = datafile_id
@@ -12,6 +12,21 @@ from requests.exceptions import HTTPError
 
 load_dotenv()
 
+# Optional settings for the number of threads used by each stage of
+# the indexing pipeline (see mydata.tasks.indexing.IndexingPipeline),
+# and the number of folders which can be indexed concurrently:
+THREAD_SETTINGS = dict(
+    MYDATA_INDEX_LOOKUP_THREADS=8,
+    MYDATA_INDEX_HASHING_THREADS=4,
+    MYDATA_INDEX_CREATION_THREADS=4,
+    MYDATA_INDEX_FOLDER_THREADS=4,
+)
+
+# Optional integer settings, with their defaults, including the number of
+# DataFile records created per request when the MyTardis server supports
+# creating them in bulk:
+INT_SETTINGS = dict(THREAD_SETTINGS, MYDATA_INDEX_BATCH_SIZE=100)
+
 
 def default_headers():
     return {
@@ -48,6 +63,16 @@ def validate_settings():
         click.echo(msg)
         sys.exit(1)
 
+    for name in INT_SETTINGS:
+        try:
+            assert get_int_setting(name) > 0
+        except (ValueError, AssertionError):
+            msg += "%s should be a positive integer\n" % name
+    if msg:
+        msg = "Invalid parameter(s):\n" + msg.strip()
+        click.echo(msg)
+        sys.exit(1)
+
     try:
         check_credentials()
     except (HTTPError, AssertionError):
@@ -57,6 +82,14 @@ def validate_settings():
     click.echo("Validated MyTardis settings.\n")
 
 
+def get_int_setting(name):
+    """
+    Return the value of an integer setting listed in INT_SETTINGS,
+    set with an environment variable, or its default
+    """
+    return int(os.getenv(name) or INT_SETTINGS[name])
+
+
 def check_credentials():
     """
     Check MyTardis credentials supplied in environment variables
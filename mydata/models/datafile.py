@@ -6,15 +6,19 @@ import io
 import json
 import urllib.parse
 
-import requests
 from requests_toolbelt.multipart import encoder
 
 from ..conf import settings
 from ..logs import logger
 from ..utils.exceptions import MultipleObjectsReturned
-from ..utils.retries import requests_retry_session
+from ..utils.hashing import CHECKSUM_FIELDS, Hashers
+from ..utils.sessions import get_session
 from .replica import Replica
 
+# Number of datafile records to request per page when
+# building a datafiles index for a dataset:
+DATAFILES_PAGE_SIZE = 1000
+
 
 class DataFile:
     """
@@ -61,9 +65,7 @@ class DataFile:
             + "&directory="
             + urllib.parse.quote(directory.encode("utf-8"))
         )
-        response = requests_retry_session().get(
-            url=url, headers=settings.default_headers
-        )
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         datafiles_dict = response.json()
         num_datafiles_found = datafiles_dict["meta"]["total_count"]
@@ -77,6 +79,43 @@ class DataFile:
             )
         return DataFile(dataset=dataset, datafile_dict=datafiles_dict["objects"][0])
 
+    @staticmethod
+    def get_datafiles_index(dataset, page_size=DATAFILES_PAGE_SIZE):
+        """
+        Page through all of the datafiles in a dataset, following the
+        "next" links in the API's "meta" section, and build an index
+        which can be used instead of calling get_datafile for each file.
+
+        Return a dict mapping (directory, filename) tuples to lists of
+        DataFile instances.  A list with more than one DataFile means
+        that multiple matching datafiles were found in MyTardis.
+
+        :raises requests.exceptions.HTTPError:
+        """
+        mytardis_url = settings.general.mytardis_url
+        url = (
+            mytardis_url
+            + "/api/v1/mydata_dataset_file/?format=json"
+            + "&dataset__id="
+            + str(dataset.dataset_id)
+            + "&limit="
+            + str(page_size)
+        )
+        datafiles_index = dict()
+        while url:
+            response = get_session().get(url=url, headers=settings.default_headers)
+            response.raise_for_status()
+            datafiles_dict = response.json()
+            for datafile_dict in datafiles_dict["objects"]:
+                datafile = DataFile(dataset=dataset, datafile_dict=datafile_dict)
+                key = (datafile.directory or "", datafile.filename)
+                datafiles_index.setdefault(key, []).append(datafile)
+            # The "next" link is an absolute path, which already includes
+            # any path prefix in mytardis_url:
+            next_url = datafiles_dict["meta"]["next"]
+            url = urllib.parse.urljoin(mytardis_url, next_url) if next_url else None
+        return datafiles_index
+
     @staticmethod
     def get_datafile_from_id(datafile_id):
         """
@@ -89,9 +128,7 @@ class DataFile:
             mytardis_url,
             datafile_id,
         )
-        response = requests_retry_session().get(
-            url=url, headers=settings.default_headers
-        )
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         datafile_dict = response.json()
         return DataFile(dataset=None, datafile_dict=datafile_dict)
@@ -103,9 +140,7 @@ class DataFile:
         """
         mytardis_url = settings.general.mytardis_url
         url = mytardis_url + "/api/v1/dataset_file/%s/verify/" % datafile_id
-        response = requests_retry_session().get(
-            url=url, headers=settings.default_headers
-        )
+        response = get_session().get(url=url, headers=settings.default_headers)
         if response.status_code < 200 or response.status_code >= 300:
             logger.warning('Failed to verify datafile id "%s" ' % datafile_id)
             logger.warning(response.text)
@@ -124,7 +159,7 @@ class DataFile:
         """
         url = "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
         datafile_json = json.dumps(datafile_dict)
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers, url=url, data=datafile_json.encode()
         )
         return response
@@ -134,19 +169,39 @@ class DataFile:
         """
         Upload a file to the MyTardis API via POST, creating a new
         DataFile record.
+
+        If any of datafile_dict's checksums (md5sum or sha512sum) are None,
+        they are calculated while the file is being streamed, and the JSON
+        data (including the checksums) is sent after the file content,
+        so the file only needs to be read from disk once.
         """
         url = "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
         upload.buffered_reader = io.open(datafile_path, "rb")
 
+        deferred_algorithms = [
+            algorithm
+            for algorithm, field in CHECKSUM_FIELDS.items()
+            if field in datafile_dict and datafile_dict[field] is None
+        ]
+        if deferred_algorithms:
+            attached_file = ChecksumsReader(
+                upload.buffered_reader, upload.file_size, deferred_algorithms
+            )
+            json_data = DeferredJsonData(datafile_dict, attached_file)
+        else:
+            attached_file = upload.buffered_reader
+            json_data = json.dumps(datafile_dict)
+
+        # The order of the fields is preserved, so the attached file
+        # is read (and its checksums calculated) before the JSON data:
         encoded = encoder.MultipartEncoder(
-            fields={
-                "json_data": json.dumps(datafile_dict),
-                "attached_file": (
-                    upload.filename,
-                    upload.buffered_reader,
-                    "application/octet-stream",
+            fields=[
+                (
+                    "attached_file",
+                    (upload.filename, attached_file, "application/octet-stream"),
                 ),
-            }
+                ("json_data", json_data),
+            ]
         )
         # Workaround for issue with httplib's hard-coded read size
         # of 8192 bytes which can lead to slow uploads, see:
@@ -159,5 +214,79 @@ class DataFile:
 
         headers = settings.default_headers
         headers["Content-Type"] = multipart.content_type
-        response = requests.post(url, data=multipart, headers=headers)
+        response = get_session().post(url, data=multipart, headers=headers)
         return response
+
+
+class ChecksumsReader:
+    """
+    Wraps a file, updating its checksums with each chunk read.
+
+    The "len" attribute (the number of bytes remaining) is used by
+    requests_toolbelt's MultipartEncoder.
+    """
+
+    def __init__(self, file_object, file_size, algorithms):
+        self.file_object = file_object
+        self.hashers = Hashers(algorithms)
+        self.len = file_size
+
+    def read(self, size=-1):
+        """
+        Read a chunk from the file, and add it to the checksums
+        """
+        chunk = self.file_object.read(size)
+        if not chunk and self.len > 0:
+            raise IOError(
+                "%s was truncated while it was being uploaded" % self.file_object.name
+            )
+        self.hashers.update(chunk)
+        self.len = max(self.len - len(chunk), 0)
+        return chunk
+
+
+class DeferredJsonData:
+    """
+    JSON data for a DataFile POST, whose checksums are filled in from a
+    ChecksumsReader after the file content has been read.
+
+    Each algorithm's hex digests have a fixed length, so the length of
+    the JSON data is known before the checksums are.
+    """
+
+    def __init__(self, datafile_dict, checksums_reader):
+        self.datafile_dict = datafile_dict
+        self.checksums_reader = checksums_reader
+        self.buffer = None
+        placeholders = {
+            CHECKSUM_FIELDS[algorithm]: "0" * (2 * hasher.digest_size)
+            for algorithm, hasher in checksums_reader.hashers.hashers.items()
+        }
+        self._len = len(self.encode(placeholders))
+
+    def encode(self, checksums):
+        """
+        Return the JSON-encoded datafile dictionary, including checksums
+        """
+        return json.dumps(dict(self.datafile_dict, **checksums)).encode()
+
+    @property
+    def len(self):
+        """
+        The number of bytes remaining to be read
+        """
+        if self.buffer is None:
+            return self._len
+        return self._len - self.buffer.tell()
+
+    def read(self, size=-1):
+        """
+        Read a chunk of the JSON data
+        """
+        if self.buffer is None:
+            if self.checksums_reader.len > 0:
+                raise IOError("JSON data was read before the file content")
+            checksums = self.checksums_reader.hashers.checksums()
+            self.datafile_dict.update(checksums)
+            self.buffer = io.BytesIO(self.encode(checksums))
+        return self.buffer.read(size)
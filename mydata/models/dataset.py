@@ -5,11 +5,10 @@ import json
 
 from urllib.parse import quote
 
-import requests
-
 from ..conf import settings
 from ..threads.flags import FLAGS
 from ..logs import logger
+from ..utils.sessions import get_session
 
 
 class Dataset:
@@ -97,7 +96,7 @@ class Dataset:
         }
         data = json.dumps(dataset_dict)
         url = "%s/api/v1/dataset/" % mytardis_url
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers, url=url, data=data.encode()
         )
         response.raise_for_status()
@@ -130,12 +129,12 @@ class Dataset:
             url,
             settings.general.instrument.instrument_id,
         )
-        response = requests.get(
+        response = get_session().get(
             headers=settings.default_headers, url=url_with_instrument
         )
         if response.status_code == 400:
             logger.debug("MyTardis doesn't support filtering datasets by instrument")
-            response = requests.get(headers=settings.default_headers, url=url)
+            response = get_session().get(headers=settings.default_headers, url=url)
         response.raise_for_status()
         datasets_dict = response.json()
         num_datasets = datasets_dict["meta"]["total_count"]
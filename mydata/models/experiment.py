@@ -6,11 +6,10 @@ import json
 
 from urllib.parse import quote
 
-import requests
-
 from ..conf import settings
 from ..threads.flags import FLAGS
 from ..logs import logger
+from ..utils.sessions import get_session
 from .objectacl import ObjectACL
 
 
@@ -76,7 +75,7 @@ class Experiment:
             )
 
         logger.debug(url)
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         experiments_dict = response.json()
         num_exps_found = experiments_dict["meta"]["total_count"]
@@ -172,7 +171,7 @@ class Experiment:
             )
         url = "%s/api/v1/mydata_experiment/" % settings.general.mytardis_url
         logger.debug(url)
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers,
             url=url,
             data=json.dumps(exp_dict).encode(),
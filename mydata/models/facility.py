@@ -2,9 +2,8 @@
 Model class for MyTardis API v1's FacilityResource.
 """
 
-import requests
-
 from ..conf import settings
+from ..utils.sessions import get_session
 from .group import Group
 
 
@@ -42,7 +41,7 @@ class Facility:
         """
         facilities = []
         url = "%s/api/v1/facility/?format=json" % settings.general.mytardis_url
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         facilities_dict = response.json()
         for facility_dict in facilities_dict["objects"]:
@@ -4,17 +4,25 @@ have a corresponding dataset record in MyTardis.
 """
 # pylint: disable=bare-except
 import os
+import re
+import threading
 import time
 from datetime import datetime
 import hashlib
 import traceback
-from fnmatch import fnmatch
+from fnmatch import translate
 
 from ..conf import settings
 from ..logs import logger
+from ..utils.file_states import calculate_checksums_with_index
+from ..utils.hashing import CHECKSUM_FIELDS, calculate_checksums
 
 from .localfile import LocalFile
 
+# Compiled includes / excludes patterns, keyed by the patterns file's path,
+# along with the file's modification time when they were compiled:
+PATTERN_MATCHERS = dict()
+
 
 class Folder:
     """
@@ -39,7 +47,6 @@ class Folder:
             location=location,
             created="",
             experiment_title="",
-            status="0 of 0 files uploaded",
             owner=owner,
             group=group,
         )
@@ -49,8 +56,10 @@ class Folder:
         # collect these files:
         self.is_exp_files_folder = is_exp_files_folder
 
-        self.local_files = []
-        self.populate_local_files()
+        # The folder's files are listed on demand (see local_files below),
+        # so scanning can move on to the next folder without walking
+        # this folder's whole directory tree:
+        self._local_files = None
 
         self.user_folder_name = user_folder_name
         self.group_folder_name = group_folder_name
@@ -58,57 +67,80 @@ class Folder:
         self.dataset = None
         self.experiment = None
 
+        # Counts are updated by lookup and upload threads, so they are
+        # maintained incrementally, under a lock:
+        self.counts_lock = threading.Lock()
         self.num_files_uploaded = 0
         self.num_cache_hits = 0
 
+    @property
+    def local_files(self):
+        """
+        Return the folder's files, listing them on first use
+        """
+        if self._local_files is None:
+            self.populate_local_files()
+        return self._local_files
+
     def populate_local_files(self):
         """
         Populate data file paths within folder object
         """
+        self._local_files = []
         if self.is_exp_files_folder:
             absolute_folder_path = self.location
         else:
             absolute_folder_path = os.path.join(self.location, self.name)
 
-        for dirname, _, files in os.walk(absolute_folder_path):
-            for filename in sorted(files):
+        if settings.filters.use_includes_file:
+            matches_includes = get_pattern_matcher(settings.filters.includes_file)
+        if settings.filters.use_excludes_file:
+            matches_excludes = get_pattern_matcher(settings.filters.excludes_file)
+
+        for dirname, file_entries in scan_dir_tree(
+            absolute_folder_path, recursive=not self.is_exp_files_folder
+        ):
+            directory = Folder.mytardis_subdir(
+                os.path.relpath(dirname, absolute_folder_path)
+            )
+            for file_entry in file_entries:
+                filename = file_entry.name
                 if (
                     settings.filters.use_includes_file
                     and not settings.filters.use_excludes_file
                 ):
-                    if not Folder.matches_includes(filename):
+                    if not matches_includes(filename):
                         logger.debug("Ignoring %s, not matching includes." % filename)
                         continue
                 elif (
                     not settings.filters.use_includes_file
                     and settings.filters.use_excludes_file
                 ):
-                    if Folder.matches_excludes(filename):
+                    if matches_excludes(filename):
                         logger.debug("Ignoring %s, matching excludes." % filename)
                         continue
                 elif (
                     settings.filters.use_includes_file
                     and settings.filters.use_excludes_file
                 ):
-                    if Folder.matches_excludes(
-                        filename
-                    ) and not Folder.matches_includes(filename):
+                    if matches_excludes(filename) and not matches_includes(filename):
                         logger.debug(
                             "Ignoring %s, matching excludes "
                             "and not matching includes." % filename
                         )
                         continue
-                self.local_files.append(
+                try:
+                    stat_result = file_entry.stat()
+                except OSError:
+                    stat_result = None
+                self._local_files.append(
                     LocalFile(
-                        filepath=os.path.join(dirname, filename),
-                        directory=os.path.relpath(dirname, absolute_folder_path),
+                        filepath=file_entry.path,
+                        directory=directory,
                         uploaded=False,
+                        stat_result=stat_result,
                     )
                 )
-            if self.is_exp_files_folder:
-                break
-        self.convert_subdirs_to_mytardis_format()
-        self.data_view_fields["status"] = "0 of %d files uploaded" % self.num_files
 
     def convert_subdirs_to_mytardis_format(self):
         """
@@ -118,9 +150,18 @@ class Folder:
         the dataset's top-level directory
         """
         for local_file in self.local_files:
-            if local_file.directory == ".":
-                local_file.directory = ""
-            local_file.directory = local_file.directory.replace("\\", "/")
+            local_file.directory = Folder.mytardis_subdir(local_file.directory)
+
+    @staticmethod
+    def mytardis_subdir(subdir):
+        """
+        Convert a subdirectory path to the format used in the directory
+        field of a MyTardis DataFile record
+        (see convert_subdirs_to_mytardis_format)
+        """
+        if subdir == ".":
+            return ""
+        return subdir.replace("\\", "/")
 
     def set_datafile_uploaded(self, datafile_index, uploaded):
         """
@@ -129,14 +170,62 @@ class Folder:
         Used to update the number of files uploaded per folder
         displayed in the Status column of the Folders view.
         """
-        self.local_files[datafile_index].uploaded = uploaded
-        self.num_files_uploaded = sum(
-            [local_file.uploaded for local_file in self.local_files]
-        )
-        self.data_view_fields["status"] = "%d of %d files uploaded" % (
-            self.num_files_uploaded,
-            self.num_files,
-        )
+        local_file = self.local_files[datafile_index]
+        with self.counts_lock:
+            if uploaded != local_file.uploaded:
+                local_file.uploaded = uploaded
+                self.num_files_uploaded += 1 if uploaded else -1
+
+    def set_all_datafiles_uploaded(self):
+        """
+        Mark all of the folder's files as uploaded, e.g. when the folder's
+        fingerprint shows that they have already been verified
+        """
+        with self.counts_lock:
+            for local_file in self.local_files:
+                local_file.uploaded = True
+            self.num_files_uploaded = self.num_files
+
+    def release_local_files(self):
+        """
+        Release the folder's list of files, once they have all been looked up
+        and uploaded, so a long upload run's memory use doesn't grow with the
+        total number of files.  They will be listed again if required.
+        """
+        self._local_files = None
+
+    def add_cache_hits(self, num_cache_hits=1):
+        """
+        Count file lookups which were found in the verified files cache
+        """
+        with self.counts_lock:
+            self.num_cache_hits += num_cache_hits
+
+    def fingerprint(self):
+        """
+        Return a digest of the sorted (relative path, size, modification time)
+        tuples of the folder's files, which will change if any file is added,
+        removed, renamed or modified.
+
+        Return None if any of the files can't be accessed.
+        """
+        file_states = []
+        for local_file in self.local_files:
+            try:
+                local_file.stat()
+            except OSError:
+                return None
+            file_states.append(
+                (
+                    os.path.join(local_file.directory, local_file.filename),
+                    local_file.size,
+                    local_file.mtime_ns,
+                )
+            )
+        digest = hashlib.blake2b(digest_size=16)
+        for file_state in sorted(file_states):
+            digest.update(("%s\0%d\0%d\n" % file_state).encode("utf-8"))
+        return digest.digest()
 
     def get_datafile_path(self, datafile_index):
         """
@@ -170,18 +259,23 @@ class Folder:
 
     def get_datafile_size(self, datafile_index):
         """
-        Return a file's size on disk
+        Return a file's current size on disk
+
+        The file is stat'ed again, rather than using the size recorded when
+        the folder was scanned, because it may have grown since, and the size
+        used for its upload must match the bytes hashed and sent.
         """
-        return os.stat(self.get_datafile_path(datafile_index)).st_size
+        local_file = self.local_files[datafile_index]
+        local_file.set_stat_result(os.stat(local_file.filepath))
+        return local_file.size
 
     def get_datafile_created_time(self, datafile_index):
         """
         Return a file's created time on disk
         """
-        absolute_file_path = self.get_datafile_path(datafile_index)
         try:
             created_time_iso_string = datetime.fromtimestamp(
-                os.stat(absolute_file_path).st_ctime
+                self.local_files[datafile_index].created_time
             ).isoformat()
             return created_time_iso_string
         except:
@@ -192,10 +286,9 @@ class Folder:
         """
         Return a file's modified time on disk
         """
-        absolute_file_path = self.get_datafile_path(datafile_index)
         try:
             modified_time_iso_string = datetime.fromtimestamp(
-                os.stat(absolute_file_path).st_mtime
+                self.local_files[datafile_index].modified_time
             ).isoformat()
             return modified_time_iso_string
         except:
@@ -255,18 +348,7 @@ class Folder:
         Return True if file matches at least one pattern in the includes
         or excludes file.
         """
-        match = False
-        with open(includes_or_excludes_file, "r") as patterns_file:
-            for glob in patterns_file.readlines():
-                glob = glob.strip()
-                if glob == "":
-                    continue
-                if glob.startswith(";"):
-                    continue
-                if glob.startswith("#"):
-                    continue
-                match = match or fnmatch(filename, glob)
-        return match
+        return get_pattern_matcher(includes_or_excludes_file)(filename)
 
     @staticmethod
     def matches_includes(filename):
@@ -291,50 +373,81 @@ class Folder:
         before its upload.
         """
         if settings.filters.ignore_new_files:
-            absolute_file_path = self.get_datafile_path(datafile_index)
-            too_new = (time.time() - os.path.getmtime(absolute_file_path)) <= (
+            modified_time = self.local_files[datafile_index].modified_time
+            too_new = (time.time() - modified_time) <= (
                 settings.filters.ignore_new_files_minutes * 60
             )
         else:
             too_new = False
         return too_new
 
+    def calculate_checksums(self, datafile_index, canceled_cb=None):
+        """
+        Calculate the checksums configured in
+        settings.miscellaneous.checksum_algorithms, in one pass over the file.
+
+        Return a dictionary of hex digests keyed by DataFile field,
+        e.g. dict(md5sum="..."), or None if canceled.
+
+        Callbacks can be used to update progress or to indicate
+        that the user canceled.
+
+        If settings.miscellaneous.cache_md5_sums is True, the checksums
+        are only calculated if the file has changed since it was last
+        hashed (see mydata.utils.file_states).
+        """
+        return self.calculate_checksums_with_algorithms(
+            datafile_index, settings.miscellaneous.checksum_algorithms, canceled_cb
+        )
+
     def calculate_md5_sum(self, datafile_index, canceled_cb=None):
         """
         Calculate MD5 checksum.
 
         Callbacks can be used to update progress or to indicate
         that the user canceled.
+
+        If settings.miscellaneous.cache_md5_sums is True, the checksum
+        is only calculated if the file has changed since it was last
+        hashed (see mydata.utils.file_states).
+        """
+        checksums = self.calculate_checksums_with_algorithms(
+            datafile_index, ["md5"], canceled_cb
+        )
+        return checksums["md5sum"] if checksums else None
+
+    def calculate_checksums_with_algorithms(
+        self, datafile_index, algorithms, canceled_cb=None
+    ):
+        """
+        Calculate checksums using each of the algorithms, e.g. ["md5"]
+        (see calculate_checksums)
         """
         absolute_file_path = self.get_datafile_path(datafile_index)
         file_size = self.get_datafile_size(datafile_index)
-        md5 = hashlib.md5()
-
-        default_chunk_size = 128 * 1024
-        max_chunk_size = 16 * 1024 * 1024
-        chunk_size = default_chunk_size
-        while (file_size / chunk_size) > 50 and chunk_size < max_chunk_size:
-            chunk_size *= 2
-        with open(absolute_file_path, "rb") as file_handle:
-            # Note that the iter() func needs an empty byte string
-            # for the returned iterator to halt at EOF, since read()
-            # returns b'' (not just '').
-            for chunk in iter(lambda: file_handle.read(chunk_size), b""):
-                if canceled_cb and canceled_cb():
-                    logger.debug(
-                        "Aborting MD5 calculation for " "%s" % absolute_file_path
-                    )
-                    return None
-                md5.update(chunk)
-                del chunk
-        return md5.hexdigest()
+
+        def calculate(file_path):
+            return calculate_checksums(file_path, algorithms, file_size, canceled_cb)
+
+        index_path = None
+        if settings.miscellaneous.cache_md5_sums:
+            index_path = settings.file_states_path
+        return calculate_checksums_with_index(
+            absolute_file_path,
+            calculate,
+            [CHECKSUM_FIELDS[algorithm] for algorithm in algorithms],
+            index_path,
+        )
 
     def reset_counts(self):
         """
         Reset counts of uploaded files etc.
         """
-        for local_file in self.local_files:
-            local_file.uploaded = False
+        with self.counts_lock:
+            for local_file in self.local_files:
+                local_file.uploaded = False
+            self.num_files_uploaded = 0
+            self.num_cache_hits = 0
 
     @property
     def name(self):
@@ -366,7 +479,7 @@ class Folder:
         The folder's upload status, displayed in the
         Status column of MyData's Folders view
         """
-        return self.data_view_fields["status"]
+        return "%d of %d files uploaded" % (self.num_files_uploaded, self.num_files)
 
     @property
     def owner(self):
@@ -385,3 +498,78 @@ class Folder:
         MyData's Folders view
         """
         return self.data_view_fields["group"]
+
+
+def get_pattern_matcher(includes_or_excludes_file):
+    """
+    Return a function which returns True if a filename matches at least
+    one pattern in the includes or excludes file.
+
+    The file's glob patterns are compiled into a single regular expression,
+    which is cached until the file's modification time changes, so the file
+    doesn't need to be read again for every filename.
+    """
+    mtime_ns = os.stat(includes_or_excludes_file).st_mtime_ns
+    cached = PATTERN_MATCHERS.get(includes_or_excludes_file)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    regexes = []
+    with open(includes_or_excludes_file, "r") as patterns_file:
+        for glob in patterns_file.readlines():
+            glob = glob.strip()
+            if glob == "":
+                continue
+            if glob.startswith(";"):
+                continue
+            if glob.startswith("#"):
+                continue
+            # Like fnmatch.fnmatch, match case-insensitively on Windows:
+            regexes.append(translate(os.path.normcase(glob)))
+    if regexes:
+        combined_regex = re.compile("|".join(regexes))
+
+        def matcher(filename):
+            return combined_regex.match(os.path.normcase(filename)) is not None
+
+    else:
+
+        def matcher(filename):  # pylint: disable=unused-argument
+            return False
+
+    PATTERN_MATCHERS[includes_or_excludes_file] = (mtime_ns, matcher)
+    return matcher
+
+
+def scan_dir_tree(path, recursive=True):
+    """
+    Walk the directory tree rooted at path using os.scandir, yielding a
+    (directory path, file entries) tuple for each directory, with the
+    os.DirEntry objects for the directory's files sorted by name.
+
+    Like os.walk, symbolic links to directories aren't followed,
+    and directories which can't be read are skipped.
+
+    If recursive is False, only the top-level directory is scanned.
+    """
+    dirs_to_scan = [path]
+    while dirs_to_scan:
+        dirname = dirs_to_scan.pop()
+        file_entries = []
+        subdirs = []
+        try:
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        file_entries.append(entry)
+                    elif recursive and not entry.is_symlink():
+                        subdirs.append(entry.path)
+        except OSError as err:
+            logger.warning("Couldn't scan %s: %s" % (dirname, err))
+            continue
+        file_entries.sort(key=lambda entry: entry.name)
+        yield dirname, file_entries
+        dirs_to_scan.extend(sorted(subdirs, reverse=True))
@@ -3,10 +3,9 @@ Model class for MyTardis API v1's GroupResource.
 """
 import urllib.parse
 
-import requests
-
 from ..conf import settings
 from ..logs import logger
+from ..utils.sessions import get_session
 
 
 class Group:
@@ -54,7 +53,7 @@ class Group:
             settings.general.mytardis_url,
             urllib.parse.quote(name.encode("utf-8")),
         )
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         groups_dict = response.json()
         num_groups_found = groups_dict["meta"]["total_count"]
@@ -2,26 +2,98 @@
 Model class for representing a local file
 """
 import os
+import sys
 
 
 class LocalFile:
     """
     Model class for representing a local file
+
+    A folder can contain millions of files, so instances use __slots__,
+    store the file's directory path (shared with the other files in the
+    same directory) separately from its filename, and only keep the parts
+    of the file's stat result which MyData uses.
     """
 
-    def __init__(self, filepath, directory, uploaded):
+    __slots__ = (
+        "dirname",
+        "filename",
+        "directory",
+        "uploaded",
+        "_size",
+        "_mtime_ns",
+        "_ctime_ns",
+    )
+
+    def __init__(self, filepath, directory, uploaded, stat_result=None):
+
+        dirname, filename = os.path.split(filepath)
 
-        # The file path, e.g. '/path/to/image.jpg':
-        self.filepath = filepath
+        # The directory containing the file, e.g. '/path/to':
+        self.dirname = sys.intern(dirname)
+
+        # The filename, e.g. 'image.jpg':
+        self.filename = filename
 
         # The relative directory within the dataset folder, e.g. '':
-        self.directory = directory
+        self.directory = sys.intern(directory)
 
         # Whether the file has been uploaded:
         self.uploaded = uploaded
 
+        # The file's size, modified time and created time, usually captured
+        # while scanning the folder, so the file doesn't need to be stat'ed
+        # again:
+        self._size = None
+        self._mtime_ns = None
+        self._ctime_ns = None
+        if stat_result is not None:
+            self.set_stat_result(stat_result)
+
+    @property
+    def filepath(self):
+        """Return the file path, e.g. '/path/to/image.jpg'
+        """
+        return os.path.join(self.dirname, self.filename)
+
+    def set_stat_result(self, stat_result):
+        """Record the parts of the file's os.stat result which MyData uses
+        """
+        self._size = stat_result.st_size
+        self._mtime_ns = stat_result.st_mtime_ns
+        self._ctime_ns = stat_result.st_ctime_ns
+
+    def stat(self):
+        """Call os.stat if the file's stat result wasn't captured
+        while scanning the folder
+        """
+        if self._size is None:
+            self.set_stat_result(os.stat(self.filepath))
+
+    @property
+    def size(self):
+        """Return the file's size in bytes
+        """
+        self.stat()
+        return self._size
+
+    @property
+    def mtime_ns(self):
+        """Return the file's modified time (st_mtime_ns) in nanoseconds
+        """
+        self.stat()
+        return self._mtime_ns
+
+    @property
+    def created_time(self):
+        """Return the file's created time (st_ctime) as a timestamp
+        """
+        self.stat()
+        return self._ctime_ns / 1e9
+
     @property
-    def filename(self):
-        """Return the filename, e.g. 'image.jpg'
+    def modified_time(self):
+        """Return the file's modified time (st_mtime) as a timestamp
         """
-        return os.path.basename(self.filepath)
+        self.stat()
+        return self._mtime_ns / 1e9
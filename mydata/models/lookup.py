@@ -53,3 +53,7 @@ class Lookup:
         # unverified DataFile exists on the server for this file,
         # its DataFileModel object will be recorded:
         self.existing_unverified_datafile = None
+
+        # If the file needs to be uploaded via staging, its checksums
+        # can be calculated ahead of the upload (see mydata.utils.hashing):
+        self.checksums_future = None
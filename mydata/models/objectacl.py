@@ -3,10 +3,10 @@ Model class for MyTardis API v1's ObjectACLResource.
 """
 
 import json
-import requests
 
 from ..conf import settings
 from ..logs import logger
+from ..utils.sessions import get_session
 
 
 class ObjectACL:
@@ -41,7 +41,7 @@ class ObjectACL:
         }
 
         url = mytardis_url + "/api/v1/objectacl/"
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers,
             url=url,
             data=json.dumps(object_acl_dict).encode(),
@@ -74,7 +74,7 @@ class ObjectACL:
         }
 
         url = mytardis_url + "/api/v1/objectacl/"
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers,
             url=url,
             data=json.dumps(object_acl_dict).encode(),
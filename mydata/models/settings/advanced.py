@@ -19,7 +19,11 @@ class AdvancedSettings:
             "group_prefix",
             "validate_folder_structure",
             "max_lookup_threads",
+            "max_upload_threads",
             "max_upload_retries",
+            "max_hashing_threads",
+            "max_bundled_file_size",
+            "max_files_per_bundle",
             "upload_invalid_user_or_group_folders",
         ]
 
@@ -87,6 +91,13 @@ class AdvancedSettings:
         """
         return int(self.mydata_config["max_lookup_threads"])
 
+    @property
+    def max_upload_threads(self):
+        """
+        Get the maximum number of upload threads
+        """
+        return int(self.mydata_config["max_upload_threads"])
+
     @property
     def max_upload_retries(self):
         """
@@ -94,6 +105,29 @@ class AdvancedSettings:
         """
         return int(self.mydata_config["max_upload_retries"])
 
+    @property
+    def max_hashing_threads(self):
+        """
+        Get the maximum number of threads for calculating checksums ahead
+        of uploads via staging.  Zero disables hashing ahead of uploads.
+        """
+        return int(self.mydata_config["max_hashing_threads"])
+
+    @property
+    def max_bundled_file_size(self):
+        """
+        Get the size (in bytes) below which files uploaded via staging are
+        bundled together into a single tar stream.  Zero disables bundling.
+        """
+        return int(self.mydata_config["max_bundled_file_size"])
+
+    @property
+    def max_files_per_bundle(self):
+        """
+        Get the maximum number of small files in each tar stream
+        """
+        return int(self.mydata_config["max_files_per_bundle"])
+
     def set_defaults(self):
         """
         Set default values for configuration parameters
@@ -104,5 +138,9 @@ class AdvancedSettings:
         self.mydata_config["group_prefix"] = ""
         self.mydata_config["validate_folder_structure"] = True
         self.mydata_config["max_lookup_threads"] = 1
+        self.mydata_config["max_upload_threads"] = 1
         self.mydata_config["max_upload_retries"] = 1
+        self.mydata_config["max_hashing_threads"] = 0
+        self.mydata_config["max_bundled_file_size"] = 0
+        self.mydata_config["max_files_per_bundle"] = 100
         self.mydata_config["upload_invalid_user_or_group_folders"] = True
@@ -32,6 +32,12 @@ class MiscellaneousSettings(BaseSettings):
             "cipher",
             "cache_datafile_lookups",
             "connection_timeout",
+            "bulk_datafile_lookups",
+            "use_ssh_control_master",
+            "use_sftp",
+            "resume_partial_uploads",
+            "cache_md5_sums",
+            "checksum_algorithms",
         ]
 
         self.default = dict(
@@ -40,6 +46,12 @@ class MiscellaneousSettings(BaseSettings):
             cipher="aes128-ctr",
             cache_datafile_lookups=True,
             connection_timeout=10.0,
+            bulk_datafile_lookups=False,
+            use_ssh_control_master=True,
+            use_sftp=False,
+            resume_partial_uploads=True,
+            cache_md5_sums=True,
+            checksum_algorithms="md5",
         )
 
     @property
@@ -117,6 +129,111 @@ class MiscellaneousSettings(BaseSettings):
         """
         self.mydata_config["connection_timeout"] = connection_timeout
 
+    @property
+    def bulk_datafile_lookups(self):
+        """
+        Returns True if MyData will look up a dataset's existing datafiles
+        with a small number of paged requests, rather than sending one
+        request per local file.
+        """
+        return self.mydata_config["bulk_datafile_lookups"]
+
+    @bulk_datafile_lookups.setter
+    def bulk_datafile_lookups(self, bulk_datafile_lookups):
+        """
+        Set this to True if MyData should look up a dataset's existing
+        datafiles with a small number of paged requests, rather than
+        sending one request per local file.
+        """
+        self.mydata_config["bulk_datafile_lookups"] = bulk_datafile_lookups
+
+    @property
+    def use_ssh_control_master(self):
+        """
+        Returns True if MyData will open one multiplexed SSH connection
+        (ControlMaster) per staging host, and reuse it for each remote
+        command and SCP upload, rather than connecting for each command.
+        """
+        return self.mydata_config["use_ssh_control_master"]
+
+    @use_ssh_control_master.setter
+    def use_ssh_control_master(self, use_ssh_control_master):
+        """
+        Set this to True if MyData should open one multiplexed SSH connection
+        (ControlMaster) per staging host, and reuse it for each remote
+        command and SCP upload, rather than connecting for each command.
+        """
+        self.mydata_config["use_ssh_control_master"] = use_ssh_control_master
+
+    @property
+    def use_sftp(self):
+        """
+        Returns True if MyData will upload to staging using its own SFTP
+        client (which requires paramiko), rather than running scp.
+        """
+        return self.mydata_config["use_sftp"]
+
+    @use_sftp.setter
+    def use_sftp(self, use_sftp):
+        """
+        Set this to True if MyData should upload to staging using its own SFTP
+        client (which requires paramiko), rather than running scp.
+        """
+        self.mydata_config["use_sftp"] = use_sftp
+
+    @property
+    def resume_partial_uploads(self):
+        """
+        Returns True if MyData should resume partial uploads to staging,
+        by appending the missing bytes to a partially uploaded file,
+        rather than uploading the whole file again.
+        """
+        return self.mydata_config["resume_partial_uploads"]
+
+    @resume_partial_uploads.setter
+    def resume_partial_uploads(self, resume_partial_uploads):
+        """
+        Set this to True if MyData should resume partial uploads to staging.
+        """
+        self.mydata_config["resume_partial_uploads"] = resume_partial_uploads
+
+    @property
+    def cache_md5_sums(self):
+        """
+        Returns True if MyData should cache local files' MD5 checksums,
+        so they are only recalculated if a file's size, modification time
+        or inode number changes.
+        """
+        return self.mydata_config["cache_md5_sums"]
+
+    @cache_md5_sums.setter
+    def cache_md5_sums(self, cache_md5_sums):
+        """
+        Set this to True if MyData should cache local files' MD5 checksums.
+        """
+        self.mydata_config["cache_md5_sums"] = cache_md5_sums
+
+    @property
+    def checksum_algorithms(self):
+        """
+        Returns the list of checksum algorithms ("md5" and/or "sha512")
+        used for the checksums included in each DataFile record, which are
+        configured as a comma-separated list in MyData.cfg
+        """
+        return [
+            algorithm.strip().lower()
+            for algorithm in self.mydata_config["checksum_algorithms"].split(",")
+            if algorithm.strip()
+        ]
+
+    @checksum_algorithms.setter
+    def checksum_algorithms(self, checksum_algorithms):
+        """
+        Set the comma-separated list of checksum algorithms
+        ("md5" and/or "sha512")
+        """
+        self.mydata_config["checksum_algorithms"] = checksum_algorithms
+
     def set_default_for_field(self, field):
         """
         Set default value for one field.
@@ -130,3 +247,9 @@ class MiscellaneousSettings(BaseSettings):
                 # just use the installed SSH version, which might
                 # be too old to support aes128-gcm@openssh.com
                 self.mydata_config["cipher"] = "aes128-ctr"
+        if field == "use_ssh_control_master":
+            # The Cygwin build of OpenSSH bundled with MyData on Windows
+            # can't reliably use Unix domain sockets for ControlPath:
+            self.mydata_config["use_ssh_control_master"] = not sys.platform.startswith(
+                "win"
+            )
@@ -5,7 +5,6 @@ and saved to disk in MyData.cfg
 # pylint: disable=import-outside-toplevel
 # pylint: disable=bare-except
 import os
-import pickle
 import traceback
 
 from urllib.parse import urlparse
@@ -14,6 +13,7 @@ from ...constants import APPNAME
 from ...logs import logger
 from ...threads.locks import LOCKS
 from ...utils import create_config_path_if_necessary
+from ...utils.verified_cache import VerifiedDatafilesCache
 from .general import GeneralSettings
 from .filters import FiltersSettings
 from .advanced import AdvancedSettings
@@ -196,42 +196,65 @@ class Settings:
     @property
     def verified_datafiles_cache_path(self):
         """
-        We use a serialized dictionary to cache DataFile lookup results.
+        We use an SQLite database to cache DataFile lookup results.
         We'll use a separate cache file for each MyTardis server we connect to.
         """
         parsed = urlparse(self.general.mytardis_url)
         return os.path.join(
             os.path.dirname(self.config_path),
-            "verified-files-%s-%s.pkl" % (parsed.scheme, parsed.netloc),
+            "verified-files-%s-%s.db" % (parsed.scheme, parsed.netloc),
         )
 
+    @property
+    def pickled_verified_datafiles_cache_path(self):
+        """
+        Previous versions of MyData used a serialized dictionary to cache
+        DataFile lookup results.  If found, it is imported into the
+        SQLite database.
+        """
+        return "%s.pkl" % os.path.splitext(self.verified_datafiles_cache_path)[0]
+
+    @property
+    def file_states_path(self):
+        """
+        We use an SQLite database to cache local files' MD5 checksums,
+        along with their sizes, modification times and inode numbers,
+        so unchanged files don't need to be hashed again.
+        """
+        return os.path.join(os.path.dirname(self.config_path), "file-states.db")
+
     def initialize_verified_datafiles_cache(self):
         """
-        We use a serialized dictionary to cache DataFile lookup results.
+        We use an SQLite database to cache DataFile lookup results.
         We'll use a separate cache file for each MyTardis server we connect to.
         """
         try:
-            if os.path.exists(self.verified_datafiles_cache_path):
-                with open(self.verified_datafiles_cache_path, "rb") as cache_file:
-                    self.verified_datafiles_cache = pickle.load(cache_file)
-            else:
-                self.verified_datafiles_cache = dict()
+            self.verified_datafiles_cache = VerifiedDatafilesCache(
+                self.verified_datafiles_cache_path
+            )
+            if os.path.exists(self.pickled_verified_datafiles_cache_path):
+                self.verified_datafiles_cache.import_pickled_cache(
+                    self.pickled_verified_datafiles_cache_path
+                )
         except:
             self.verified_datafiles_cache = dict()
             logger.warning(traceback.format_exc())
 
     def save_verified_datafiles_cache(self):
         """
-        We use a serialized dictionary to cache DataFile lookup results.
-        We'll use a separate cache file for each MyTardis server we connect to.
+        Each verified DataFile is written to the cache as soon as it is
+        found, so there's nothing left to save here, but we can compact
+        the cache and close it.
         """
         with LOCKS.close_cache:  # pylint: disable=no-member
+            if not isinstance(self.verified_datafiles_cache, VerifiedDatafilesCache):
+                return
             try:
-                with open(self.verified_datafiles_cache_path, "wb") as cache_file:
-                    pickle.dump(self.verified_datafiles_cache, cache_file)
+                self.verified_datafiles_cache.close()
             except:
-                logger.warning("Couldn't save verified datafiles cache.")
+                logger.warning("Couldn't close verified datafiles cache.")
                 logger.warning(traceback.format_exc())
+            self.verified_datafiles_cache = dict()
 
     @property
     def config_path(self):
@@ -135,7 +135,11 @@ def load_advanced_settings(config_parser):
         "folder_structure",
         "group_prefix",
         "max_lookup_threads",
+        "max_upload_threads",
         "max_upload_retries",
+        "max_hashing_threads",
+        "max_bundled_file_size",
+        "max_files_per_bundle",
         "validate_folder_structure",
         "upload_invalid_user_or_group_folders",
     ]
@@ -156,7 +160,14 @@ def load_advanced_settings(config_parser):
         settings["upload_invalid_user_or_group_folders"] = config_parser.getboolean(
             config_file_section, "upload_invalid_user_folders"
         )
-    int_fields = ["max_lookup_threads", "max_upload_retries"]
+    int_fields = [
+        "max_lookup_threads",
+        "max_upload_threads",
+        "max_upload_retries",
+        "max_hashing_threads",
+        "max_bundled_file_size",
+        "max_files_per_bundle",
+    ]
     for field in int_fields:
         if config_parser.has_option(config_file_section, field):
             settings[field] = config_parser.getint(config_file_section, field)
@@ -182,11 +193,24 @@ def load_miscellaneous_settings(config_parser):
         "verification_delay",
         "cache_datafile_lookups",
         "connection_timeout",
+        "bulk_datafile_lookups",
+        "use_ssh_control_master",
+        "use_sftp",
+        "resume_partial_uploads",
+        "cache_md5_sums",
+        "checksum_algorithms",
     ]
     for field in fields:
         if config_parser.has_option(config_file_section, field):
             settings[field] = config_parser.get(config_file_section, field)
-    boolean_fields = ["cache_datafile_lookups"]
+    boolean_fields = [
+        "cache_datafile_lookups",
+        "bulk_datafile_lookups",
+        "use_ssh_control_master",
+        "use_sftp",
+        "resume_partial_uploads",
+        "cache_md5_sums",
+    ]
     for field in boolean_fields:
         if config_parser.has_option(config_file_section, field):
             settings[field] = config_parser.getboolean(config_file_section, field)
@@ -245,7 +269,11 @@ def save_settings_to_disk(config_path=None):
             "use_includes_file",
             "use_excludes_file",
             "max_lookup_threads",
+            "max_upload_threads",
             "max_upload_retries",
+            "max_hashing_threads",
+            "max_bundled_file_size",
+            "max_files_per_bundle",
             "validate_folder_structure",
             "cipher",
             "uuid",
@@ -253,6 +281,12 @@ def save_settings_to_disk(config_path=None):
             "cache_datafile_lookups",
             "upload_invalid_user_or_group_folders",
             "connection_timeout",
+            "bulk_datafile_lookups",
+            "use_ssh_control_master",
+            "use_sftp",
+            "resume_partial_uploads",
+            "cache_md5_sums",
+            "checksum_algorithms",
         ]
         settings_list = []
         for field in fields:
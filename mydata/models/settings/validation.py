@@ -19,6 +19,8 @@ from ...logs import logger
 from ...threads.flags import FLAGS
 from ...utils.exceptions import InvalidSettings
 from ...utils.exceptions import UserAborted
+from ...utils.hashing import CHECKSUM_FIELDS
+from ...utils.sessions import get_session
 from ..facility import Facility
 
 
@@ -41,6 +43,7 @@ def validate_settings(set_status_message=None):
         raise_exception_if_user_aborted(set_status_message)
         check_for_missing_required_fields()
         check_data_directory()
+        check_checksum_algorithms()
         log_if_test_run("Folder structure: %s" % settings.advanced.folder_structure)
         warn_if_ignoring_invalid_user_folders()
         check_filters(set_status_message)
@@ -87,6 +90,24 @@ def check_data_directory():
         raise InvalidSettings(message, "data_directory")
 
 
+def check_checksum_algorithms():
+    """Check that MyTardis accepts each of the checksum algorithms
+    """
+    from ...conf import settings
+
+    algorithms = settings.miscellaneous.checksum_algorithms
+    if not algorithms:
+        message = "Please specify at least one checksum algorithm."
+        raise InvalidSettings(message, "checksum_algorithms")
+    for algorithm in algorithms:
+        if algorithm not in CHECKSUM_FIELDS:
+            message = 'Unsupported checksum algorithm: "%s".  Please use %s.' % (
+                algorithm,
+                " and/or ".join(sorted(CHECKSUM_FIELDS)),
+            )
+            raise InvalidSettings(message, "checksum_algorithms")
+
+
 def check_for_missing_required_fields():
     """Check if a required field is missing
     """
@@ -273,7 +294,7 @@ def check_mytardis_url(set_status_message=None):
         logger.debug(message)
         if set_status_message:
             set_status_message(message)
-        response = requests.get(
+        response = get_session().get(
             settings.general.mytardis_api_url,
             timeout=settings.miscellaneous.connection_timeout,
         )
@@ -377,7 +398,7 @@ def check_mytardis_credentials(set_status_message=None):
         + "/api/v1/user/?format=json&username="
         + settings.general.username
     )
-    response = requests.get(headers=settings.default_headers, url=url)
+    response = get_session().get(headers=settings.default_headers, url=url)
     if response.status_code < 200 or response.status_code >= 300:
         message = (
             "Your MyTardis credentials are invalid.\n\n"
@@ -78,12 +78,12 @@ import uuid
 import urllib.parse
 
 import psutil
-import requests
 import netifaces
 
 from .. import __version__ as VERSION
 from ..logs import logger
 from ..utils.connectivity import get_default_interface_type
+from ..utils.sessions import get_session
 from ..utils.exceptions import (
     PrivateKeyDoesNotExist,
     NoApprovedStorageBox,
@@ -174,7 +174,7 @@ class Uploader:
             + "&uuid="
             + urllib.parse.quote(settings.miscellaneous.uuid)
         )
-        response = requests.get(
+        response = get_session().get(
             headers=settings.default_headers,
             url=url,
             timeout=settings.miscellaneous.connection_timeout,
@@ -225,14 +225,14 @@ class Uploader:
         data = json.dumps(uploader_dict, indent=4)
         logger.debug(data)
         if num_existing_uploader_records > 0:
-            response = requests.put(
+            response = get_session().put(
                 headers=settings.default_headers,
                 url=url,
                 data=data.encode(),
                 timeout=settings.miscellaneous.connection_timeout,
             )
         else:
-            response = requests.post(
+            response = get_session().post(
                 headers=settings.default_headers,
                 url=url,
                 data=data.encode(),
@@ -284,7 +284,7 @@ class Uploader:
         )
         logger.debug(url)
         headers = settings.default_headers
-        response = requests.get(headers=headers, url=url)
+        response = get_session().get(headers=headers, url=url)
         response.raise_for_status()
         logger.debug(response.text)
         uploaders_dict = response.json()
@@ -319,7 +319,7 @@ class Uploader:
             "requester_key_fingerprint": self.ssh_key_pair.fingerprint,
         }
         data = json.dumps(urr_dict)
-        response = requests.post(
+        response = get_session().post(
             headers=settings.default_headers, url=url, data=data.encode()
         )
         response.raise_for_status()
@@ -3,10 +3,9 @@ Model class for MyTardis API v1's UserResource.
 """
 from urllib.parse import quote
 
-import requests
-
 from ..conf import settings
 from ..logs import logger
+from ..utils.sessions import get_session
 from .group import Group
 
 
@@ -130,7 +129,7 @@ class User:
             settings.general.mytardis_url,
             username,
         )
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         user_dicts = response.json()
         num_user_records_found = user_dicts["meta"]["total_count"]
@@ -156,7 +155,7 @@ class User:
             settings.general.mytardis_url,
             quote(email.encode("utf-8")),
         )
-        response = requests.get(url=url, headers=settings.default_headers)
+        response = get_session().get(url=url, headers=settings.default_headers)
         response.raise_for_status()
         user_dicts = response.json()
         num_user_records_found = user_dicts["meta"]["total_count"]
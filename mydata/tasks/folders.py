@@ -5,7 +5,7 @@ import datetime
 import os
 import warnings
 from datetime import datetime
-from glob import glob
+from fnmatch import fnmatch
 
 from ..events.stop import raise_exception_if_user_aborted
 from ..logs import logger
@@ -30,27 +30,43 @@ def scan_folders(found_user_cb, found_group_cb, found_exp_folder_cb, found_datas
     For the experiment folder callback, the callback function
     should accept a string specifying the experiment folder name.
     """
+    for folder in iter_folders(found_user_cb, found_group_cb, found_exp_folder_cb):
+        found_dataset_cb(folder)
+
+
+def iter_folders(found_user_cb, found_group_cb, found_exp_folder_cb):
+    """
+    Scan dataset folders, yielding each dataset folder as soon as it is found,
+    so the caller can start looking up and uploading its files before the
+    rest of the data directory has been scanned.
+
+    Each folder's files are only listed when the folder's local_files are
+    first accessed.
+
+    The callback ("cb") functions are called when a user, group or
+    experiment folder is found, as described in scan_folders.
+    """
     data_dir = settings.general.data_directory
     default_owner = settings.general.default_owner
     folder_structure = settings.advanced.folder_structure
     logger.debug("FoldersModel.scan_folders(): Scanning " + data_dir + "...")
     if folder_structure.startswith("Username") or folder_structure.startswith("Email"):
-        scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb)
+        yield from scan_for_user_folders(found_user_cb, found_exp_folder_cb)
     elif folder_structure.startswith("User Group"):
-        scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb)
+        yield from scan_for_group_folders(found_group_cb, found_exp_folder_cb)
     elif folder_structure.startswith("Experiment"):
-        scan_for_experiment_folders(
-            found_exp_folder_cb, found_dataset_cb, data_dir, default_owner
+        yield from scan_for_experiment_folders(
+            found_exp_folder_cb, data_dir, default_owner
         )
     elif folder_structure.startswith("Dataset"):
-        scan_for_dataset_folders(found_dataset_cb, data_dir, default_owner)
+        yield from scan_for_dataset_folders(data_dir, default_owner)
     else:
         raise InvalidFolderStructure("Unknown folder structure.")
 
 
-def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
+def scan_for_user_folders(found_user_cb, found_exp_folder_cb):
     """
-    Scan for user folders.
+    Scan for user folders, yielding the dataset folders within them.
     """
     folder_structure = settings.advanced.folder_structure
     upload_invalid_user_or_group_folders = (
@@ -87,16 +103,15 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
         )
         logger.debug("Folder structure: " + folder_structure)
         if folder_structure in ("Username / Dataset", "Email / Dataset"):
-            scan_for_dataset_folders(
-                found_dataset_cb, user_folder_path, user, user_folder_name
+            yield from scan_for_dataset_folders(
+                user_folder_path, user, user_folder_name
             )
         elif folder_structure in (
             "Username / Experiment / Dataset",
             "Email / Experiment / Dataset",
         ):
-            scan_for_experiment_folders(
+            yield from scan_for_experiment_folders(
                 found_exp_folder_cb,
-                found_dataset_cb,
                 user_folder_path,
                 user,
                 user_folder_name,
@@ -112,9 +127,8 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
                 warnings.warn(message)
                 continue
             mytardis_folder_path = os.path.join(user_folder_path, mytardis_folder_name)
-            scan_for_experiment_folders(
+            yield from scan_for_experiment_folders(
                 found_exp_folder_cb,
-                found_dataset_cb,
                 mytardis_folder_path,
                 user,
                 user_folder_name,
@@ -122,9 +136,9 @@ def scan_for_user_folders(found_user_cb, found_exp_folder_cb, found_dataset_cb):
         raise_exception_if_user_aborted()
 
 
-def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb):
+def scan_for_group_folders(found_group_cb, found_exp_folder_cb):
     """
-    Scan for group folders.
+    Scan for group folders, yielding the dataset folders within them.
     """
     folder_structure = settings.advanced.folder_structure
     upload_invalid_user_or_group_folders = (
@@ -157,19 +171,17 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
         )
         default_owner = settings.general.default_owner
         if folder_structure == "User Group / Instrument / Full Name / Dataset":
-            import_group_folders(found_dataset_cb, group_folder_path, group)
+            yield from import_group_folders(group_folder_path, group)
         elif folder_structure == "User Group / Experiment / Dataset":
-            scan_for_experiment_folders(
+            yield from scan_for_experiment_folders(
                 found_exp_folder_cb,
-                found_dataset_cb,
                 group_folder_path,
                 default_owner,
                 group=group,
                 group_folder_name=group_folder_name,
             )
         elif folder_structure == "User Group / Dataset":
-            scan_for_dataset_folders(
-                found_dataset_cb,
+            yield from scan_for_dataset_folders(
                 group_folder_path,
                 owner=default_owner,
                 group=group,
@@ -182,7 +194,6 @@ def scan_for_group_folders(found_group_cb, found_exp_folder_cb, found_dataset_cb
 
 
 def scan_for_dataset_folders(
-    found_dataset_cb,
     path_to_scan,
     owner,
     user_folder_name=None,
@@ -190,7 +201,7 @@ def scan_for_dataset_folders(
     group_folder_name=None,
 ):
     """
-    Scan for dataset folders.
+    Scan for dataset folders, yielding each one as it is found.
     """
     if user_folder_name is None and group_folder_name is None:
         user_folder_name = owner.username
@@ -216,12 +227,11 @@ def scan_for_dataset_folders(
         raise_exception_if_user_aborted()
         folder.set_created_date()
         set_experiment_title(folder, owner, group_folder_name)
-        found_dataset_cb(folder)
+        yield folder
 
 
 def scan_for_experiment_folders(
     found_exp_folder_cb,
-    found_dataset_cb,
     path_to_scan,
     owner,
     user_folder_name=None,
@@ -229,7 +239,7 @@ def scan_for_experiment_folders(
     group_folder_name=None,
 ):
     """
-    Scans for experiment folders.
+    Scans for experiment folders, yielding the dataset folders within them.
 
     The MyTardis role account specified in the Settings dialog will
     automatically be given access (and ownership) to every experiment
@@ -276,7 +286,7 @@ def scan_for_experiment_folders(
             else:
                 raise InvalidFolderStructure("Unknown folder structure.")
             folder.set_created_date()
-            found_dataset_cb(folder)
+            yield folder
         files_depth1 = files_in_top_level(exp_folder_path)
         if files_depth1:
             logger.info(
@@ -295,11 +305,11 @@ def scan_for_experiment_folders(
             raise_exception_if_user_aborted()
             folder.experiment_title = exp_folder_name
             folder.set_created_date()
-            found_dataset_cb(folder)
+            yield folder
         found_exp_folder_cb(exp_folder_name)
 
 
-def import_group_folders(found_dataset_cb, group_folder_path, group):
+def import_group_folders(group_folder_path, group):
     """
     Imports folders structured according to the
     "User Group / Instrument / Researcher's Name / Dataset"
@@ -319,6 +329,8 @@ def import_group_folders(found_dataset_cb, group_folder_path, group):
     User Group.  The researcher's name in this folder structure is
     used to determine the default experiment name, but it is not
     used to determine access control.
+
+    Dataset folders are yielded as they are found.
     """
     logger.debug("Scanning " + group_folder_path + " for instrument folders...")
 
@@ -362,7 +374,7 @@ def import_group_folders(found_dataset_cb, group_folder_path, group):
                 settings.general.instrument_name,
                 user_folder_name,
             )
-            found_dataset_cb(folder)
+            yield folder
 
 
 def folder_names(path_to_scan, filter_pattern=""):
@@ -370,9 +382,11 @@ def folder_names(path_to_scan, filter_pattern=""):
     List of folder names in path matching the filter pattern
     (or all folders in the specified path if there is no filter).
     """
-    files_depth1 = glob(os.path.join(path_to_scan, "*%s*" % filter_pattern))
-    dirs_depth1 = [item for item in files_depth1 if os.path.isdir(item)]
-    return [os.path.basename(d) for d in dirs_depth1]
+    return [
+        entry.name
+        for entry in scan_top_level(path_to_scan, filter_pattern)
+        if entry_is_dir(entry)
+    ]
 
 
 def user_folder_names(path_to_scan):
@@ -417,10 +431,51 @@ def files_in_top_level(exp_folder_path):
     Return a list of file names in the specified experiment
     folder path, not within any specific dataset folder.
     """
-    glob_depth1 = glob(
-        os.path.join(exp_folder_path, "*%s*" % settings.filters.dataset_filter)
-    )
-    return [item for item in glob_depth1 if os.path.isfile(item)]
+    return [
+        entry.path
+        for entry in scan_top_level(exp_folder_path, settings.filters.dataset_filter)
+        if entry_is_file(entry)
+    ]
+
+
+def scan_top_level(path_to_scan, filter_pattern=""):
+    """
+    Return the os.DirEntry objects in path whose names match the filter pattern,
+    skipping hidden entries, like glob.glob(os.path.join(path, "*pattern*")).
+
+    Using os.scandir means the entries' types are usually known without
+    an extra os.stat call for each entry, which is slow on network shares.
+    """
+    pattern = "*%s*" % filter_pattern
+    try:
+        with os.scandir(path_to_scan) as entries:
+            return [
+                entry
+                for entry in entries
+                if not entry.name.startswith(".") and fnmatch(entry.name, pattern)
+            ]
+    except OSError:
+        return []
+
+
+def entry_is_dir(entry):
+    """
+    Return True if the os.DirEntry is a directory (or a link to one)
+    """
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def entry_is_file(entry):
+    """
+    Return True if the os.DirEntry is a file (or a link to one)
+    """
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
 
 
 def dataset_is_too_old(path_to_scan, dataset_folder_name):
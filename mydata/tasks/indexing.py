@@ -7,17 +7,27 @@ by mydata.commands.index.index_cmd to index files in a specified folder.
 Unlike the Multipart POST and SCP via Staging upload methods, the indexing
 doesn't use the settings in MyData.cfg.  Instead it expects its required
 settings to provided as environment variables or in a .env file.
+
+Each file is indexed in three stages, each with its own pool of threads
+(see IndexingPipeline): looking up its DataFile record, calculating its
+size, mimetype and checksum, and creating its DataFile record.  All API
+requests share one connection-pooled session (see get_index_session).
 """
 import json
 import mimetypes
 import os
-import re
-import subprocess
-import sys
+import threading
 
-from urllib.parse import quote
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import quote, urljoin
 
-from ..utils.retries import requests_retry_session
+from ..threads.locks import LOCKS
+from ..utils.file_states import calculate_checksums_with_index
+from ..utils.hashing import calculate_checksums
+from ..utils.sessions import get_session
+from ..indexing.manifest import get_index_manifest
+from ..indexing.settings import get_int_setting, THREAD_SETTINGS
 from ..indexing.models.lookup import Lookup, LookupStatus
 from ..indexing.models.datafile import DataFileCreation, DataFileCreationStatus
 
@@ -28,10 +38,32 @@ HEADERS = {
     % (os.getenv("MYTARDIS_USERNAME"), os.getenv("MYTARDIS_API_KEY")),
 }
 
+# How many verified files to record in the index manifest at a time:
+MANIFEST_BATCH_SIZE = 1000
+
+# How many DataFile records to request per page when listing a dataset's
+# existing DataFile records (see prefetch_datafiles):
+PREFETCH_PAGE_SIZE = 1000
+
+
+def get_index_session():
+    """Return the connection-pooled session shared by the indexing threads
+    """
+    return get_session(
+        os.getenv("MYTARDIS_URL"),
+        pool_maxsize=sum(get_int_setting(name) for name in THREAD_SETTINGS),
+    )
+
 
 def lookup_or_create_dataset(dataset_folder_name):
     """Lookup or create dataset and return Dataset ID.
     """
+    return lookup_dataset(dataset_folder_name) or create_dataset(dataset_folder_name)
+
+
+def lookup_dataset(dataset_folder_name):
+    """Lookup dataset and return Dataset ID, or None if it wasn't found.
+    """
     ds_lookup_url = (
         "%s/api/v1/dataset/?format=json&experiments__id=%s&description=%s"
         % (
@@ -40,7 +72,7 @@ def lookup_or_create_dataset(dataset_folder_name):
             quote(dataset_folder_name),
         )
     )
-    response = requests_retry_session().get(ds_lookup_url, headers=HEADERS)
+    response = get_index_session().get(ds_lookup_url, headers=HEADERS)
     response.raise_for_status()
     datasets = response.json()
     assert datasets["meta"]["total_count"] <= 1
@@ -51,11 +83,17 @@ def lookup_or_create_dataset(dataset_folder_name):
             % (dataset_folder_name, dataset_id)
         )
         return dataset_id
+    return None
+
+
+def create_dataset(dataset_folder_name):
+    """Create dataset and return Dataset ID.
+    """
     dataset_dict = {
         "description": dataset_folder_name,
         "experiments": ["/api/v1/experiment/%s/" % os.getenv("MYTARDIS_EXP_ID")],
     }
-    response = requests_retry_session().post(
+    response = get_index_session().post(
         "%s/api/v1/dataset/" % os.getenv("MYTARDIS_URL"),
         data=json.dumps(dataset_dict),
         headers=HEADERS,
@@ -76,7 +114,7 @@ def lookup_datafile(dataset_id, filename, directory):
         "%s/api/v1/dataset_file/?format=json&dataset__id=%s&filename=%s&directory=%s"
         % (os.getenv("MYTARDIS_URL"), dataset_id, quote(filename), quote(directory),)
     )
-    response = requests_retry_session().get(df_lookup_url, headers=HEADERS)
+    response = get_index_session().get(df_lookup_url, headers=HEADERS)
     if not response.ok:
         return Lookup(dataset_id, directory, filename, LookupStatus.FAILED)
     datafiles_dict = response.json()
@@ -84,31 +122,64 @@ def lookup_datafile(dataset_id, filename, directory):
     matches = datafiles_dict["meta"]["total_count"]
     if not matches:
         return Lookup(dataset_id, directory, filename, LookupStatus.NOT_FOUND)
-    dfos = datafiles_dict["objects"][0]["replicas"]
+    datafile = datafiles_dict["objects"][0]
+    return Lookup(
+        dataset_id, directory, filename, datafile_status(datafile), datafile["id"]
+    )
+
+
+def datafile_status(datafile):
+    """Return the LookupStatus for a DataFile record found on MyTardis,
+    depending on whether it has any verified DataFileObjects (replicas)
+    """
+    dfos = datafile["replicas"]
     if not dfos:
-        return Lookup(
-            dataset_id, directory, filename, LookupStatus.FOUND_UNVERIFIED_NO_DFOS
-        )
+        return LookupStatus.FOUND_UNVERIFIED_NO_DFOS
     verified = any(dfo["verified"] for dfo in dfos)
     if verified:
-        return Lookup(dataset_id, directory, filename, LookupStatus.FOUND_VERIFIED)
-    return Lookup(dataset_id, directory, filename, LookupStatus.FOUND_UNVERIFIED)
+        return LookupStatus.FOUND_VERIFIED
+    return LookupStatus.FOUND_UNVERIFIED
 
 
-def create_datafile(dataset_id, filename, directory, filepath, uri):
-    """Create DataFile record via MyTardis API.
+def prefetch_datafiles(dataset_id):
+    """Page through all of a dataset's DataFile records on MyTardis.
+
+    Return a dictionary of (LookupStatus, DataFile ID) tuples, keyed by
+    (directory, filename), so files which already have DataFile records
+    don't need to be looked up one at a time, or None if the records
+    couldn't be listed.
+    """
+    url = "%s/api/v1/dataset_file/?format=json&dataset__id=%s&limit=%s" % (
+        os.getenv("MYTARDIS_URL"),
+        dataset_id,
+        PREFETCH_PAGE_SIZE,
+    )
+    statuses = dict()
+    while url:
+        response = get_index_session().get(url, headers=HEADERS)
+        if not response.ok:
+            return None
+        datafiles_dict = response.json()
+        for datafile in datafiles_dict["objects"]:
+            key = (datafile["directory"] or "", datafile["filename"])
+            statuses[key] = (datafile_status(datafile), datafile["id"])
+        url = datafiles_dict["meta"]["next"]
+        if url:
+            url = urljoin(os.getenv("MYTARDIS_URL"), url)
+    return statuses
+
+
+def build_datafile_dict(dataset_id, filename, directory, filepath, uri):
+    """Calculate a file's size, mimetype and checksum, and return the
+    dictionary used to create its DataFile record via the MyTardis API.
     """
     size = os.path.getsize(filepath)
-    print("size: %s" % size)
     mimetype = mimetypes.guess_type(filepath, strict=False)[0]
     if not mimetype:
         mimetype = "application/octet-stream"
-    print("mimetype: %s" % mimetype)
     md5sum = calculate_md5sum(filepath)
-    print("md5sum: %s" % md5sum)
-    print()
 
-    datafile_post_data = {
+    return {
         "dataset": "/api/v1/dataset/%s/" % dataset_id,
         "filename": filename,
         "directory": directory,
@@ -124,9 +195,15 @@ def create_datafile(dataset_id, filename, directory, filepath, uri):
         ],
     }
 
-    response = requests_retry_session().post(
+
+def create_datafile(dataset_id, datafile_dict):
+    """Create DataFile record via MyTardis API.
+    """
+    directory = datafile_dict["directory"]
+    filename = datafile_dict["filename"]
+    response = get_index_session().post(
         "%s/api/v1/dataset_file/" % os.getenv("MYTARDIS_URL"),
-        data=json.dumps(datafile_post_data),
+        data=json.dumps(datafile_dict),
         headers=HEADERS,
     )
     resource_uri = None
@@ -144,8 +221,297 @@ def create_datafile(dataset_id, filename, directory, filepath, uri):
     )
 
 
+def create_datafiles(datafiles):
+    """Create DataFile records in bulk via MyTardis API.
+
+    datafiles is a list of (dataset_id, datafile_dict) tuples.
+
+    The records are created with one PATCH request to the DataFile list
+    endpoint (see bulk_create_supported), and a DataFileCreation is returned
+    for each of them, in order.  If the request fails, None is returned,
+    so the records can be created individually, rather than one invalid
+    record preventing the others from being created.
+    """
+    response = get_index_session().patch(
+        "%s/api/v1/dataset_file/" % os.getenv("MYTARDIS_URL"),
+        data=json.dumps({"objects": [datafile_dict for _, datafile_dict in datafiles]}),
+        headers=HEADERS,
+    )
+    if not response.ok:
+        return None
+    resource_uris = [None] * len(datafiles)
+    # The created records are only returned if the server's DataFile
+    # resource is configured with always_return_data:
+    if response.content:
+        objects = response.json().get("objects", [])
+        if len(objects) == len(datafiles):
+            resource_uris = [obj.get("resource_uri") for obj in objects]
+    return [
+        DataFileCreation(
+            dataset_id,
+            datafile_dict["directory"],
+            datafile_dict["filename"],
+            resource_uri,
+            DataFileCreationStatus.COMPLETED,
+        )
+        for (dataset_id, datafile_dict), resource_uri in zip(datafiles, resource_uris)
+    ]
+
+
+def bulk_create_supported():
+    """Check whether the MyTardis server allows DataFile records to be
+    created in bulk, i.e. whether the schema of its DataFile resource
+    allows PATCH requests to the list endpoint.
+    """
+    response = get_index_session().get(
+        "%s/api/v1/dataset_file/schema/?format=json" % os.getenv("MYTARDIS_URL"),
+        headers=HEADERS,
+    )
+    if not response.ok:
+        return False
+    return "patch" in response.json().get("allowed_list_http_methods", [])
+
+
+class IndexingPipeline:
+    """
+    Thread pools for each stage of indexing a file: looking up its DataFile
+    record, building its DataFile dictionary (which requires reading the
+    file to calculate its checksum), and creating its DataFile record.
+
+    Files are submitted in the order they are found, and each file moves on
+    to the next stage as soon as its previous stage completes, so lookups,
+    hashing and DataFile creation all run concurrently.  One pipeline can be
+    shared by several folders being indexed concurrently.
+
+    If the MyTardis server supports it, DataFile records are created in
+    batches of up to MYDATA_INDEX_BATCH_SIZE records.  A partial batch is
+    submitted as soon as no more files are being looked up or hashed, so
+    files never wait for a batch which isn't going to fill up.  Otherwise,
+    each DataFile record is created with its own POST request.
+    """
+
+    def __init__(self):
+        self.lookup_pool = ThreadPoolExecutor(
+            max_workers=get_int_setting("MYDATA_INDEX_LOOKUP_THREADS"),
+            thread_name_prefix="IndexLookupThread",
+        )
+        self.hashing_pool = ThreadPoolExecutor(
+            max_workers=get_int_setting("MYDATA_INDEX_HASHING_THREADS"),
+            thread_name_prefix="IndexHashingThread",
+        )
+        self.creation_pool = ThreadPoolExecutor(
+            max_workers=get_int_setting("MYDATA_INDEX_CREATION_THREADS"),
+            thread_name_prefix="IndexCreationThread",
+        )
+        # How many files each folder can have in the pipeline at once,
+        # so walking a large folder blocks instead of queueing up every
+        # file in it:
+        self.max_pending = 100 * get_int_setting("MYDATA_INDEX_LOOKUP_THREADS")
+
+        self.batch_size = get_int_setting("MYDATA_INDEX_BATCH_SIZE")
+        # Whether DataFile records can be created in bulk, which is only
+        # checked when the first DataFile record needs to be created:
+        self._bulk_create = None
+        # DataFile dictionaries waiting to be created in bulk, and the
+        # number of files still being looked up or hashed:
+        self.batch = []
+        self.num_upstream = 0
+        self.batch_lock = threading.Lock()
+        self.bulk_create_lock = threading.Lock()
+
+    @property
+    def bulk_create(self):
+        """Return True if DataFile records should be created in bulk
+        """
+        if self._bulk_create is None:
+            # The schema is requested without holding batch_lock, so
+            # threads finishing lookups or hashing don't wait for it:
+            with self.bulk_create_lock:
+                if self._bulk_create is None:
+                    self._bulk_create = self.batch_size > 1 and bulk_create_supported()
+        return self._bulk_create
+
+    def submit(self, dataset_id, file_info, lookup=None):
+        """Submit a file for indexing
+
+        file_info is a (filename, directory, filepath, uri) tuple
+        (see iter_files).
+
+        If the file's lookup result is already known (see
+        prefetch_datafiles), the lookup stage is skipped.
+
+        Return a Future whose result is a (lookup, datafile_dict,
+        datafile_creation) tuple, where datafile_dict and
+        datafile_creation are None unless a DataFile record was created.
+        """
+        result = Future()
+        filename, directory, _, _ = file_info
+        with self.batch_lock:
+            self.num_upstream += 1
+        if lookup:
+            self.lookup_done(result, lookup, dataset_id, file_info)
+            return result
+        self.chain(
+            result,
+            self.lookup_pool.submit(lookup_datafile, dataset_id, filename, directory),
+            self.lookup_done,
+            dataset_id,
+            file_info,
+            upstream=True,
+        )
+        return result
+
+    def chain(self, result, future, callback, *args, upstream=False):
+        """Call callback(result, future's result, *args) when future is done,
+        or pass future's exception on to result
+
+        upstream should be True if future is a lookup or hashing stage,
+        whose callback will call upstream_done.
+        """
+
+        def done(future):
+            try:
+                value = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                result.set_exception(err)
+                if upstream:
+                    self.upstream_done()
+                return
+            try:
+                callback(result, value, *args)
+            except Exception as err:  # pylint: disable=broad-except
+                result.set_exception(err)
+
+        future.add_done_callback(done)
+
+    def lookup_done(self, result, lookup, dataset_id, file_info):
+        """Build the DataFile dictionary if the file needs indexing
+        """
+        if lookup.status not in (
+            LookupStatus.NOT_FOUND,
+            LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
+        ):
+            result.set_result((lookup, None, None))
+            self.upstream_done()
+            return
+        self.chain(
+            result,
+            self.hashing_pool.submit(build_datafile_dict, dataset_id, *file_info),
+            self.hashing_done,
+            dataset_id,
+            lookup,
+            upstream=True,
+        )
+
+    def hashing_done(self, result, datafile_dict, dataset_id, lookup):
+        """Create the DataFile record, or add it to the next batch
+        """
+        try:
+            if self.bulk_create:
+                with self.batch_lock:
+                    self.batch.append((result, lookup, dataset_id, datafile_dict))
+                    batch_is_full = len(self.batch) >= self.batch_size
+                if batch_is_full:
+                    self.flush()
+                return
+            self.create_individually(result, lookup, dataset_id, datafile_dict)
+        finally:
+            self.upstream_done()
+
+    def upstream_done(self):
+        """Record that a file has finished being looked up and hashed,
+        and submit the current batch if no other files are
+        """
+        with self.batch_lock:
+            self.num_upstream -= 1
+            flush = self.num_upstream == 0
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Submit the current batch of DataFile records for creation
+        """
+        with self.batch_lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            self.creation_pool.submit(self.create_batch, batch)
+
+    def create_individually(self, result, lookup, dataset_id, datafile_dict):
+        """Create a DataFile record with its own POST request
+        """
+        self.chain(
+            result,
+            self.creation_pool.submit(create_datafile, dataset_id, datafile_dict),
+            lambda result, datafile_creation: result.set_result(
+                (lookup, datafile_dict, datafile_creation)
+            ),
+        )
+
+    def recheck_and_create(self, result, lookup, dataset_id, datafile_dict):
+        """Look a file up again, then create its DataFile record with its own
+        POST request, unless its lookup result has changed, e.g. because
+        a failed bulk request created its record before failing
+        """
+        self.chain(
+            result,
+            self.creation_pool.submit(
+                lookup_datafile,
+                dataset_id,
+                datafile_dict["filename"],
+                datafile_dict["directory"],
+            ),
+            self.recheck_done,
+            lookup,
+            dataset_id,
+            datafile_dict,
+        )
+
+    def recheck_done(self, result, new_lookup, lookup, dataset_id, datafile_dict):
+        """Create the DataFile record if the file still needs one
+        """
+        if new_lookup.status != lookup.status:
+            result.set_result((new_lookup, None, None))
+            return
+        self.create_individually(result, lookup, dataset_id, datafile_dict)
+
+    def create_batch(self, batch):
+        """Create a batch of DataFile records, and set each file's result
+
+        If the batch can't be created in bulk, each of its records is
+        created individually, so each file gets its own status.  Tastypie's
+        bulk requests aren't transactional, so a failed request may have
+        created some of the records, which is why each file is looked up
+        again first.
+        """
+        try:
+            datafile_creations = create_datafiles(
+                [
+                    (dataset_id, datafile_dict)
+                    for _, _, dataset_id, datafile_dict in batch
+                ]
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            for result, _, _, _ in batch:
+                result.set_exception(err)
+            return
+        if datafile_creations is None:
+            for result, lookup, dataset_id, datafile_dict in batch:
+                self.recheck_and_create(result, lookup, dataset_id, datafile_dict)
+            return
+        for (result, lookup, _, datafile_dict), datafile_creation in zip(
+            batch, datafile_creations
+        ):
+            result.set_result((lookup, datafile_dict, datafile_creation))
+
+    def shutdown(self):
+        """Wait for any files being indexed, and stop the threads
+        """
+        for pool in (self.lookup_pool, self.hashing_pool, self.creation_pool):
+            pool.shutdown(wait=True)
+
+
 def scan_folder_and_upload(
-    dataset_folder_name, lookup_callback, datafile_creation_callback
+    dataset_folder_name, lookup_callback, datafile_creation_callback, pipeline=None
 ):
     """Scan folder, create a Dataset record for it, and create DataFile records for its files.
 
@@ -154,70 +520,183 @@ def scan_folder_and_upload(
 
     datafile_creation_callback should be a function which will be called after each
     DataFile creation.
+
+    Files are indexed concurrently by pipeline (an IndexingPipeline,
+    created for this folder if not supplied), but their results are
+    reported in the order the files were found.
+
+    If the dataset already exists, its DataFile records are listed first,
+    so only files which aren't found in the list need to be looked up.
+
+    If the MYDATA_INDEX_MANIFEST_PATH environment variable is set, files
+    which have been verified are recorded in a manifest (see
+    mydata.indexing.manifest) at that path, and files which haven't changed
+    since they were recorded are skipped (and reported as verified lookups)
+    without any API requests.
+
+    Return the number of files found in the folder.
     """
-    dataset_id = lookup_or_create_dataset(dataset_folder_name)
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = IndexingPipeline()
+    manifest = None
+    if os.getenv("MYDATA_INDEX_MANIFEST_PATH"):
+        manifest = get_index_manifest(os.getenv("MYDATA_INDEX_MANIFEST_PATH"))
+    dataset_id = lookup_dataset(dataset_folder_name)
+    # The dataset's existing DataFile records are only listed when the first
+    # file which isn't in the manifest is found:
+    existing = dict()
+    if dataset_id:
+        existing = None
+    else:
+        dataset_id = create_dataset(dataset_folder_name)
     dataset_root_dir = "%s/%s/" % (
         os.getenv("MYTARDIS_STORAGE_BOX_PATH"),
         dataset_folder_name,
     )
-    for dirname, _, files in os.walk(dataset_root_dir):
-        relpath = os.path.relpath(dirname, os.getenv("MYTARDIS_STORAGE_BOX_PATH"))
-        for filename in sorted(files):
-            uri = os.path.join(relpath, filename)
-            filepath = os.path.join(os.getenv("MYTARDIS_SRC_PATH"), uri)
-            print("File path: %s" % filepath)
-            directory = os.path.relpath(dirname, dataset_root_dir)
-            if directory == ".":
-                directory = ""
-
-            lookup = lookup_datafile(dataset_id, filename, directory)
-            if lookup.status == LookupStatus.FAILED:
-                print(
-                    "Failed to check for existing DataFile record on MyTardis.  Skipping for now."
-                )
-                print()
-                lookup_callback(lookup)
-                continue
-            if lookup.status in (
-                LookupStatus.FOUND_VERIFIED,
-                LookupStatus.FOUND_UNVERIFIED,
-            ):
-                print(
-                    "DataFile record was found, so we won't create another record for this file."
+    num_files = 0
+    pending = deque()
+    verified = []
+
+    def report(file_info, future, stat_result):
+        lookup = report_result(
+            file_info, future, lookup_callback, datafile_creation_callback
+        )
+        if manifest and lookup.status == LookupStatus.FOUND_VERIFIED:
+            filename, directory, _, _ = file_info
+            verified.append(
+                (
+                    os.path.join(directory, filename),
+                    stat_result.st_size,
+                    stat_result.st_mtime_ns,
+                    lookup.datafile_id,
                 )
-                print()
-                lookup_callback(lookup)
-                continue
-            assert lookup.status in (
-                LookupStatus.NOT_FOUND,
-                LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
             )
-            lookup_callback(lookup)
+            if len(verified) >= MANIFEST_BATCH_SIZE:
+                manifest.record(dataset_id, verified)
+                del verified[:]
 
-            datafile_creation = create_datafile(
-                dataset_id, filename, directory, filepath, uri
+    try:
+        for file_info in iter_files(dataset_root_dir):
+            num_files += 1
+            filename, directory, _, uri = file_info
+            stat_result = None
+            if manifest:
+                stat_result = os.stat(
+                    os.path.join(os.getenv("MYTARDIS_STORAGE_BOX_PATH"), uri)
+                )
+                relpath = os.path.join(directory, filename)
+                if manifest.is_unchanged(dataset_id, relpath, stat_result):
+                    lookup_callback(
+                        Lookup(
+                            dataset_id, directory, filename, LookupStatus.FOUND_VERIFIED
+                        )
+                    )
+                    continue
+            if existing is None:
+                existing = prefetch_datafiles(dataset_id) or dict()
+            lookup = None
+            if (directory, filename) in existing:
+                status, datafile_id = existing[(directory, filename)]
+                lookup = Lookup(dataset_id, directory, filename, status, datafile_id)
+            pending.append(
+                (file_info, pipeline.submit(dataset_id, file_info, lookup), stat_result)
             )
-            if datafile_creation.status == DataFileCreationStatus.FAILED:
-                print("Failed to create DataFile record.  Skipping for now.")
-                print()
-                datafile_creation_callback(datafile_creation)
-                continue
+            if len(pending) >= pipeline.max_pending:
+                report(*pending.popleft())
+        while pending:
+            report(*pending.popleft())
+        if verified:
+            manifest.record(dataset_id, verified)
+    finally:
+        if own_pipeline:
+            pipeline.shutdown()
+    return num_files
 
-            print("Created DataFile record: %s" % datafile_creation.resource_uri)
+
+def report_result(file_info, future, lookup_callback, datafile_creation_callback):
+    """Wait for a file to be indexed, then report the result
+
+    Return the file's lookup.
+    """
+    _, _, filepath, _ = file_info
+    lookup, datafile_dict, datafile_creation = future.result()
+    with LOCKS.index_output:  # pylint: disable=no-member
+        print("File path: %s" % filepath)
+        if lookup.status == LookupStatus.FAILED:
+            print(
+                "Failed to check for existing DataFile record on MyTardis.  Skipping for now."
+            )
             print()
+            lookup_callback(lookup)
+            return lookup
+        if lookup.status in (
+            LookupStatus.FOUND_VERIFIED,
+            LookupStatus.FOUND_UNVERIFIED,
+        ):
+            print(
+                "DataFile record was found, so we won't create another record for this file."
+            )
+            print()
+            lookup_callback(lookup)
+            return lookup
+        lookup_callback(lookup)
+
+        print("size: %s" % datafile_dict["size"])
+        print("mimetype: %s" % datafile_dict["mimetype"])
+        print("md5sum: %s" % datafile_dict["md5sum"])
+        print()
+        if datafile_creation.status == DataFileCreationStatus.FAILED:
+            print("Failed to create DataFile record.  Skipping for now.")
             print()
             datafile_creation_callback(datafile_creation)
+            return lookup
+
+        if datafile_creation.resource_uri:
+            print("Created DataFile record: %s" % datafile_creation.resource_uri)
+        else:
+            print("Created DataFile record.")
+        print()
+        print()
+        datafile_creation_callback(datafile_creation)
+        return lookup
+
+
+def iter_files(dataset_root_dir):
+    """Walk a dataset folder in the storage box, yielding a
+    (filename, directory, filepath, uri) tuple for each file, where
+    directory is relative to the dataset folder, uri is relative to the
+    storage box and filepath is in MYTARDIS_SRC_PATH.
+    """
+    for dirname, _, files in os.walk(dataset_root_dir):
+        relpath = os.path.relpath(dirname, os.getenv("MYTARDIS_STORAGE_BOX_PATH"))
+        directory = os.path.relpath(dirname, dataset_root_dir)
+        if directory == ".":
+            directory = ""
+        for filename in sorted(files):
+            uri = os.path.join(relpath, filename)
+            filepath = os.path.join(os.getenv("MYTARDIS_SRC_PATH"), uri)
+            yield filename, directory, filepath, uri
 
 
 def calculate_md5sum(filepath):
     """
     Calculate MD5 sum for filepath
+
+    The file is hashed in-process (see mydata.utils.hashing), and
+    memory-mapped if the MYDATA_HASH_WITH_MMAP environment variable is set.
+
+    If the MYDATA_FILE_STATES_PATH environment variable is set, checksums
+    are cached in an SQLite database at that path, so files which haven't
+    changed since they were last indexed don't need to be hashed again.
     """
-    md5sum_binary = ["md5sum"]
-    if sys.platform == "darwin":
-        md5sum_binary = ["md5", "-r"]
-    proc = subprocess.Popen(
-        [*md5sum_binary, filepath], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+
+    def calculate(file_path):
+        return calculate_checksums(
+            file_path, ["md5"], use_mmap=bool(os.getenv("MYDATA_HASH_WITH_MMAP"))
+        )
+
+    checksums = calculate_checksums_with_index(
+        filepath, calculate, ["md5sum"], os.getenv("MYDATA_FILE_STATES_PATH")
     )
-    stdout, _ = proc.communicate()
-    return re.match(r"\w+", stdout.decode()).group(0)
+    return checksums["md5sum"]
@@ -2,6 +2,7 @@
 mydata/tasks/lookups.py
 """
 import os
+import threading
 
 import requests.exceptions
 
@@ -9,7 +10,14 @@ from ..models.datafile import DataFile
 from ..models.lookup import Lookup, LookupStatus
 from ..models.upload import UploadMethod
 from ..conf import settings
+from ..logs import logger
 from ..threads.locks import LOCKS
+from ..utils.exceptions import MultipleObjectsReturned
+from ..utils.queues import LOOKUPS_QUEUE, LOOKUP_THREADS
+from ..utils.verified_cache import (
+    VerifiedDatafilesCache,
+    verified_datafile_cache_key,
+)
 
 
 class FolderLookup:
@@ -25,13 +33,131 @@ class FolderLookup:
         self.lookup_done_cb = lookup_done_cb
         self.upload_method = upload_method
 
+        # Used when settings.miscellaneous.bulk_datafile_lookups is True:
+        self.datafiles_index = None
+        self.datafiles_index_lock = threading.Lock()
+        self.datafiles_index_failed = False
+
+        # Used when settings.miscellaneous.cache_datafile_lookups is True,
+        # to record the folder's fingerprint once all of its files are verified:
+        self.fingerprint = None
+        self.num_verified = 0
+        self.num_verified_lock = threading.Lock()
+
     def lookup_datafiles(self):
         """Look up a folder's files on MyTardis
         and report whether they exist on the server and whether they are verified.
+
+        If lookup worker threads are running, each file lookup is added to
+        the Lookups queue and this method returns without waiting for the
+        lookups to complete.  Use mydata.utils.queues.wait_for_lookups to
+        wait for them.  Otherwise, files are looked up in the calling thread.
+
+        If the folder's fingerprint matches the one recorded in the verified
+        files cache when all of its files were last found to be verified,
+        all of its files are marked as uploaded without looking them up.
         """
+        if self.folder_is_verified():
+            self.folder.add_cache_hits(self.folder.num_files)
+            self.folder.set_all_datafiles_uploaded()
+            for dfi in range(0, self.folder.num_files):
+                lookup = Lookup(self.folder, dfi)
+                lookup.message = "Found folder fingerprint in verified files cache."
+                lookup.status = LookupStatus.FOUND_VERIFIED
+                self.lookup_done_cb(lookup)
+            return
         for dfi in range(0, self.folder.num_files):
             lookup_runnable = LookupRunnable(self, dfi)
-            lookup_runnable.lookup_datafile()
+            if LOOKUP_THREADS:
+                LOOKUPS_QUEUE.put(lookup_runnable)
+            else:
+                lookup_runnable.lookup_datafile()
+
+    def folder_is_verified(self):
+        """
+        Return True if the folder hasn't changed since all of its files
+        were found to be verified.
+
+        Also calculates the folder's fingerprint, so it can be recorded
+        if all of its files are found to be verified this time.
+        """
+        if not settings.miscellaneous.cache_datafile_lookups:
+            return False
+        cache = settings.verified_datafiles_cache
+        if not isinstance(cache, VerifiedDatafilesCache) or not self.folder.num_files:
+            return False
+        self.fingerprint = self.folder.fingerprint()
+        if self.fingerprint is None:
+            return False
+        return cache.folder_is_verified(
+            self.folder.dataset.dataset_id, self.fingerprint
+        )
+
+    def datafile_verified(self):
+        """
+        Called when a file is found to be verified.  When all of the
+        folder's files have been verified, the folder's fingerprint
+        is recorded in the verified files cache.
+        """
+        with self.num_verified_lock:
+            self.num_verified += 1
+            all_verified = self.num_verified == self.folder.num_files
+        cache = settings.verified_datafiles_cache
+        if (
+            all_verified
+            and self.fingerprint is not None
+            and isinstance(cache, VerifiedDatafilesCache)
+        ):
+            cache.set_folder_verified(self.folder.dataset.dataset_id, self.fingerprint)
+
+    def get_datafiles_index(self):
+        """Return an index of the existing datafiles in the folder's dataset,
+        keyed by (directory, filename), fetching it on first use.
+
+        Return None if bulk lookups are disabled or if the index couldn't
+        be retrieved, in which case each file should be looked up
+        individually.
+        """
+        if not settings.miscellaneous.bulk_datafile_lookups:
+            return None
+        with self.datafiles_index_lock:
+            if self.datafiles_index is None and not self.datafiles_index_failed:
+                try:
+                    self.datafiles_index = DataFile.get_datafiles_index(
+                        self.folder.dataset
+                    )
+                except requests.exceptions.RequestException as err:
+                    logger.warning(
+                        "Couldn't retrieve datafiles for dataset %s, "
+                        "falling back to individual lookups: %s"
+                        % (self.folder.dataset.dataset_id, str(err))
+                    )
+                    self.datafiles_index_failed = True
+        return self.datafiles_index
+
+    def get_datafile(self, filename, directory):
+        """Look up a datafile in the folder's dataset by filename and directory
+
+        Uses the datafiles index if bulk lookups are enabled, otherwise
+        queries the MyTardis API for this file.
+
+        Return DataFile instance if found.
+        Return None if not found.
+        Raise MultipleObjectsReturned if multiple matches found.
+
+        :raises requests.exceptions.HTTPError:
+        """
+        datafiles_index = self.get_datafiles_index()
+        if datafiles_index is None:
+            return DataFile.get_datafile(
+                dataset=self.folder.dataset, filename=filename, directory=directory
+            )
+        datafiles = datafiles_index.get((directory, filename), [])
+        if len(datafiles) > 1:
+            raise MultipleObjectsReturned(
+                "Multiple datafiles matching %s were found in MyTardis" % filename
+            )
+        return datafiles[0] if datafiles else None
 
 
 class LookupRunnable:
@@ -64,23 +190,24 @@ class LookupRunnable:
         try:
 
             lookup.message = "Looking for matching file in verified files cache..."
-            cache_key = "%s,%s" % (folder.dataset.dataset_id, datafile_path)
+            cache_key = verified_datafile_cache_key(
+                folder.dataset.dataset_id, datafile_path
+            )
             if (
                 settings.miscellaneous.cache_datafile_lookups
                 and cache_key in settings.verified_datafiles_cache
             ):
-                folder.num_cache_hits += 1
+                folder.add_cache_hits()
                 folder.set_datafile_uploaded(self.dfi, True)
                 lookup.status = LookupStatus.FOUND_VERIFIED
+                self.folder_lookup.datafile_verified()
                 self.folder_lookup.lookup_done_cb(lookup)
                 return
 
             lookup.message = "Looking for matching file on MyTardis server..."
             lookup.status = LookupStatus.IN_PROGRESS
-            existing_datafile = DataFile.get_datafile(
-                dataset=folder.dataset,
-                filename=lookup.filename,
-                directory=datafile_dir,
+            existing_datafile = self.folder_lookup.get_datafile(
+                filename=lookup.filename, directory=datafile_dir
             )
             if existing_datafile:
                 self.handle_existing_datafile(lookup, existing_datafile)
@@ -116,10 +243,13 @@ class LookupRunnable:
         """
         folder = self.folder_lookup.folder
         datafile_path = os.path.join(lookup.subdirectory, lookup.filename)
-        cache_key = "%s,%s" % (folder.dataset.dataset_id, datafile_path)
+        cache_key = verified_datafile_cache_key(
+            folder.dataset.dataset_id, datafile_path
+        )
         if settings.miscellaneous.cache_datafile_lookups:
             with LOCKS.update_cache:  # pylint: disable=no-member
                 settings.verified_datafiles_cache[cache_key] = True
+            self.folder_lookup.datafile_verified()
         folder.set_datafile_uploaded(lookup.datafile_index, True)
         self.folder_lookup.lookup_done_cb(lookup)
 
@@ -131,14 +261,15 @@ class LookupRunnable:
         """
         lookup.message = "Found unverified datafile record on MyTardis."
 
-        if self.folder_lookup.upload_method == UploadMethod.SCP:
+        if self.folder_lookup.upload_method in (UploadMethod.SCP, UploadMethod.SFTP):
             self.handle_unverified_file_on_staging(lookup, existing_datafile)
         else:
             self.handle_unverified_unstaged_upload(lookup, existing_datafile)
 
     def handle_unverified_file_on_staging(self, lookup, existing_datafile):
         """
-        Re-upload file (resuming partial uploads is not supported).
+        Re-upload file, or resume a partial upload if the file is partially
+        uploaded on staging (see settings.miscellaneous.resume_partial_uploads).
         """
         folder = self.folder_lookup.folder
         lookup.message = "Found unverified file while using upload-via-staging."
@@ -3,6 +3,7 @@ mydata/tasks/uploads.py
 """
 import mimetypes
 import os
+import threading
 import traceback
 
 from datetime import datetime
@@ -17,12 +18,28 @@ from ..models.upload import Upload, UploadStatus, UploadMethod
 from ..models.upload import add_uploader_info
 from ..conf import settings
 from ..utils.exceptions import StorageBoxAttributeNotFound, SshException
-from ..utils.openssh import upload_with_scp
+from ..utils.openssh import (
+    upload_with_scp,
+    upload_tar_bundle_with_ssh,
+    resume_upload_with_ssh,
+)
+from ..utils.sftp import upload_with_sftp, resume_upload_with_sftp
+from ..utils.hashing import CHECKSUM_FIELDS, prefetch_checksums
+from ..utils.queues import UPLOADS_QUEUE, UPLOAD_THREADS, LOOKUP_THREADS
+from ..threads.locks import LOCKS
 from ..logs import logger
 
+# Small files waiting to be uploaded together in a tar stream,
+# keyed by folder:
+TAR_BUNDLES = dict()
+
 
 def upload_folder(
-    folder, lookup_callback, upload_callback, upload_method=UploadMethod.SCP
+    folder,
+    lookup_callback,
+    upload_callback,
+    upload_method=UploadMethod.SCP,
+    folder_done_callback=None,
 ):
     """
     Create required MyTardis records and upload
@@ -36,9 +53,20 @@ def upload_folder(
     function is called, passing the upload instance of class
     mydata.models.upload.Upload as an argument.
 
+    If upload worker threads are running, each file upload is added to
+    the Uploads queue, otherwise files are uploaded in the thread which
+    looked them up.  Use mydata.utils.queues.wait_for_lookups followed by
+    mydata.utils.queues.wait_for_uploads to wait for them to complete,
+    followed by flush_tar_bundles to upload any remaining small files.
+
     upload_method (if specified) should be a value from the
     mydata.models.upload.UploadMethod enumerated data type.
     If not specified, the SCP upload method is used.
+
+    Once all of the folder's files have been looked up and uploaded (where
+    required), the folder_done_callback function (if specified) is called,
+    passing the folder as an argument, and then the folder's list of files
+    is released.
     """
     folder.experiment = Experiment.get_or_create_exp_for_folder(folder)
     folder.dataset = Dataset.create_dataset_if_necessary(folder)
@@ -46,6 +74,22 @@ def upload_folder(
     if upload_method in (UploadMethod.SCP, UploadMethod.SFTP):
         settings.uploader.request_staging_access()
 
+    # The number of the folder's files which haven't finished being
+    # looked up and uploaded (where required):
+    pending = dict(num_files=folder.num_files)
+    pending_lock = threading.Lock()
+
+    def file_done():
+        with pending_lock:
+            pending["num_files"] -= 1
+            folder_done = pending["num_files"] == 0
+        if folder_done:
+            finalize_folder(folder, folder_done_callback)
+
+    def upload_cb(upload):
+        upload_callback(upload)
+        file_done()
+
     def lookup_cb(lookup):
         lookup_callback(lookup)
         if lookup.status in (
@@ -53,10 +97,58 @@ def upload_folder(
             LookupStatus.FOUND_UNVERIFIED_NO_DFOS,
             LookupStatus.FOUND_UNVERIFIED_ON_STAGING,
         ):
-            upload_file(folder, lookup, upload_callback, upload_method)
+            upload_runnable = UploadRunnable(folder, lookup, upload_cb, upload_method)
+            if UPLOAD_THREADS:
+                if upload_method in (UploadMethod.SCP, UploadMethod.SFTP):
+                    lookup.checksums_future = prefetch_checksums(
+                        folder, lookup.datafile_index
+                    )
+                UPLOADS_QUEUE.put(upload_runnable)
+            else:
+                upload_runnable.upload_file()
+        else:
+            file_done()
+
+    if not pending["num_files"]:
+        finalize_folder(folder, folder_done_callback)
+        return
 
     FolderLookup(folder, lookup_cb, upload_method).lookup_datafiles()
 
+    if not LOOKUP_THREADS and not UPLOAD_THREADS:
+        flush_tar_bundles(folder)
+
+
+def finalize_folder(folder, folder_done_callback=None):
+    """
+    Called once all of the folder's files have been looked up and uploaded
+    (where required), to report the folder's counts and release its list
+    of files
+    """
+    if folder_done_callback:
+        folder_done_callback(folder)
+    folder.release_local_files()
+
+
+class UploadRunnable:
+    """Upload a single file which was found to need uploading by a lookup
+
+    Instances of this class can be added to a Queue consumed by multiple
+    worker threads, with each thread calling the upload_file method
+    of the supplied UploadRunnable instance.
+    """
+
+    def __init__(self, folder, lookup, upload_callback, upload_method):
+        self.folder = folder
+        self.lookup = lookup
+        self.upload_callback = upload_callback
+        self.upload_method = upload_method
+
+    def upload_file(self):
+        """Upload the file
+        """
+        upload_file(self.folder, self.lookup, self.upload_callback, self.upload_method)
+
 
 def upload_file(folder, lookup, upload_callback, upload_method=UploadMethod.SCP):
     """
@@ -77,7 +169,14 @@ def upload_file(folder, lookup, upload_callback, upload_method=UploadMethod.SCP)
         return
 
     upload.message = "Defining JSON data for POST..."
-    datafile_dict = construct_datafile_post_body(folder, upload)
+    # When uploading via POST, the checksums are calculated
+    # while the file is being uploaded:
+    datafile_dict = construct_datafile_post_body(
+        folder,
+        upload,
+        calculate_checksums=upload_method != UploadMethod.MULTIPART_POST,
+        checksums_future=lookup.checksums_future,
+    )
 
     if upload_method == UploadMethod.MULTIPART_POST:
         response = DataFile.upload_datafile_with_post(
@@ -97,7 +196,7 @@ def upload_file(folder, lookup, upload_callback, upload_method=UploadMethod.SCP)
             upload_callback=upload_callback,
         )
         return
-    if upload_method == UploadMethod.SCP:
+    if upload_method in (UploadMethod.SCP, UploadMethod.SFTP):
         datafile_dict = add_uploader_info(datafile_dict)
         df_post_response = None
         if not lookup.existing_unverified_datafile:
@@ -121,15 +220,28 @@ def upload_file(folder, lookup, upload_callback, upload_method=UploadMethod.SCP)
         remote_file_path = get_remote_file_path(location, lookup, df_post_response)
         upload.datafile_id = get_datafile_id(lookup, df_post_response)
 
+        if upload_method == UploadMethod.SCP and add_to_tar_bundle(
+            folder, upload, datafile_path, remote_file_path, upload_callback
+        ):
+            return
+
+        if upload_method == UploadMethod.SFTP:
+            upload_with_method = upload_with_sftp
+            resume_with_method = resume_upload_with_sftp
+        else:
+            upload_with_method = upload_with_scp
+            resume_with_method = resume_upload_with_ssh
         try:
-            upload_via_scp_with_retries(
+            upload_to_staging_with_retries(
+                upload_with_method,
+                resume_with_method,
+                lookup,
                 datafile_path,
                 username,
                 host,
                 port,
                 remote_file_path,
                 upload,
-                upload_callback,
             )
         except SshException as err:
             logger.error(traceback.format_exc())
@@ -142,27 +254,115 @@ def upload_file(folder, lookup, upload_callback, upload_method=UploadMethod.SCP)
             )
             return
 
-        success = check_if_all_bytes_uploaded(upload)
-        if success:
-            # Request verification via MyTardis API:
-            DataFile.verify(upload.datafile_id)
-            finalize_upload(folder, upload, success, upload_callback=upload_callback)
-        else:
-            message = (
-                "Marking upload as failed, because only %s of %s bytes were uploaded."
-                % (upload.bytes_uploaded, upload.file_size)
-            )
-            finalize_upload(
-                folder,
-                upload,
-                success,
-                message=message,
-                upload_callback=upload_callback,
-            )
+        finalize_staging_upload(folder, upload, upload_callback)
         return
     raise NotImplementedError("upload_file received unimplemented upload method")
 
 
+def finalize_staging_upload(folder, upload, upload_callback):
+    """
+    Request verification and finalize an upload to staging, once the upload
+    method has finished streaming the file's content.
+    """
+    success = check_if_all_bytes_uploaded(upload)
+    if success:
+        # Request verification via MyTardis API:
+        DataFile.verify(upload.datafile_id)
+        finalize_upload(folder, upload, success, upload_callback=upload_callback)
+    else:
+        message = (
+            "Marking upload as failed, because only %s of %s bytes were uploaded."
+            % (upload.bytes_uploaded, upload.file_size)
+        )
+        finalize_upload(
+            folder, upload, success, message=message, upload_callback=upload_callback,
+        )
+
+
+class TarBundle:
+    """Small files from one folder, waiting to be uploaded to staging
+    together in a single tar stream (see upload_tar_bundle_with_ssh)
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        # List of (upload, datafile_path, remote_file_path, upload_callback):
+        self.entries = []
+
+    def upload(self):
+        """Upload the bundle and finalize each file's upload
+        """
+        uploads = [entry[0] for entry in self.entries]
+        files = [(entry[1], entry[2]) for entry in self.entries]
+        start_time = datetime.now()
+        for upload in uploads:
+            upload.message = "Uploading in a bundle of %s small files..." % len(uploads)
+            upload.start_time = start_time
+
+        def progress_callback(index):
+            uploads[index].bytes_uploaded = uploads[index].file_size
+            uploads[index].set_latest_time(datetime.now())
+
+        try:
+            host, port, _, username = get_sbox_attrs(uploads[0])
+            upload_tar_bundle_with_retries(
+                files, username, host, port, uploads, progress_callback
+            )
+        except (SshException, StorageBoxAttributeNotFound) as err:
+            logger.error(traceback.format_exc())
+            for upload, _, _, upload_callback in self.entries:
+                finalize_upload(
+                    self.folder,
+                    upload,
+                    success=False,
+                    message=str(err),
+                    upload_callback=upload_callback,
+                )
+            return
+
+        for upload, _, _, upload_callback in self.entries:
+            finalize_staging_upload(self.folder, upload, upload_callback)
+
+
+def add_to_tar_bundle(folder, upload, datafile_path, remote_file_path, upload_callback):
+    """If the file is small enough to be bundled with other small files
+    from the same folder (see settings.advanced.max_bundled_file_size),
+    add it to the folder's tar bundle and return True.
+
+    The bundle is uploaded (by the current thread) when it is full,
+    or by flush_tar_bundles.
+    """
+    if upload.file_size >= settings.advanced.max_bundled_file_size:
+        return False
+    upload.message = "Waiting to be uploaded with other small files..."
+    full_bundle = None
+    with LOCKS.tar_bundles:  # pylint: disable=no-member
+        bundle = TAR_BUNDLES.setdefault(folder, TarBundle(folder))
+        bundle.entries.append(
+            (upload, datafile_path, remote_file_path, upload_callback)
+        )
+        if len(bundle.entries) >= settings.advanced.max_files_per_bundle:
+            full_bundle = TAR_BUNDLES.pop(folder)
+    if full_bundle:
+        full_bundle.upload()
+    return True
+
+
+def flush_tar_bundles(folder=None):
+    """Upload the remaining small files waiting to be bundled, for one folder,
+    or for all folders if folder is None
+    """
+    with LOCKS.tar_bundles:  # pylint: disable=no-member
+        if folder is None:
+            bundles = list(TAR_BUNDLES.values())
+            TAR_BUNDLES.clear()
+        else:
+            bundle = TAR_BUNDLES.pop(folder, None)
+            bundles = [bundle] if bundle else []
+    for bundle in bundles:
+        bundle.upload()
+
+
 def finalize_upload(folder, upload, success, message=None, upload_callback=None):
     """
     Finalize upload
@@ -185,16 +385,39 @@ def finalize_upload(folder, upload, success, message=None, upload_callback=None)
         upload_callback(upload)
 
 
-def construct_datafile_post_body(folder, upload):
+def construct_datafile_post_body(
+    folder, upload, calculate_checksums=True, checksums_future=None
+):
     """Construct DataFile dictionary to be JSON-encoded for POSTing to the API
+
+    The dictionary includes a checksum field (md5sum and/or sha512sum) for
+    each of the algorithms in settings.miscellaneous.checksum_algorithms.
+
+    If calculate_checksums is False, the checksums are None, to be filled in
+    while uploading (see DataFile.upload_datafile_with_post).
+
+    If the checksums have been calculated (or are being calculated) ahead
+    of the upload in a hashing thread, checksums_future should be supplied
+    (see mydata.utils.hashing.prefetch_checksums).
     """
     datafile_path = folder.get_datafile_path(upload.datafile_index)
 
     upload.message = "Getting data file size..."
     upload.file_size = folder.get_datafile_size(upload.datafile_index)
 
-    upload.message = "Calculating MD5 checksum..."
-    md5sum = folder.calculate_md5_sum(upload.datafile_index, canceled_cb=None)
+    if calculate_checksums:
+        upload.message = "Calculating checksums..."
+        if checksums_future:
+            checksums = checksums_future.result()
+        else:
+            checksums = folder.calculate_checksums(
+                upload.datafile_index, canceled_cb=None
+            )
+    else:
+        checksums = {
+            CHECKSUM_FIELDS[algorithm]: None
+            for algorithm in settings.miscellaneous.checksum_algorithms
+        }
 
     upload.message = "Checking MIME type..."
     mime_type = mimetypes.guess_type(datafile_path)[0]
@@ -204,16 +427,21 @@ def construct_datafile_post_body(folder, upload):
     dataset_uri = folder.dataset.resource_uri
     created_time = folder.get_datafile_created_time(upload.datafile_index)
     modified_time = folder.get_datafile_modified_time(upload.datafile_index)
-    return {
+    datafile_dict = {
         "dataset": dataset_uri,
         "filename": os.path.basename(datafile_path),
         "directory": folder.get_datafile_directory(upload.datafile_index),
-        "md5sum": md5sum,
-        "size": upload.file_size,
-        "mimetype": mime_type,
-        "created_time": created_time,
-        "modification_time": modified_time,
     }
+    datafile_dict.update(checksums)
+    datafile_dict.update(
+        {
+            "size": upload.file_size,
+            "mimetype": mime_type,
+            "created_time": created_time,
+            "modification_time": modified_time,
+        }
+    )
+    return datafile_dict
 
 
 def get_sbox_attrs(upload):
@@ -247,15 +475,33 @@ def check_if_all_bytes_uploaded(upload):
     )
 
 
-def upload_via_scp_with_retries(
-    datafile_path, username, host, port, remote_file_path, upload, upload_callback
+def upload_to_staging_with_retries(
+    upload_with_method,
+    resume_with_method,
+    lookup,
+    datafile_path,
+    username,
+    host,
+    port,
+    remote_file_path,
+    upload,
 ):
-    """Upload via SCP with retries
+    """Upload to staging with retries, using upload_with_method
+    (upload_with_scp or upload_with_sftp)
+
+    If the file was found partially uploaded on staging, or a previous
+    attempt failed, resume_with_method (resume_upload_with_ssh or
+    resume_upload_with_sftp) is tried first, so only the missing bytes
+    need to be uploaded.
     """
+    # pylint: disable=too-many-arguments
     while True:
         # Upload retries loop:
         try:
-            upload_with_scp(
+            resume = settings.miscellaneous.resume_partial_uploads and (
+                lookup.existing_unverified_datafile or upload.retries > 0
+            )
+            args = (
                 datafile_path,
                 username,
                 settings.uploader.ssh_key_pair.private_key_path,
@@ -264,6 +510,8 @@ def upload_via_scp_with_retries(
                 remote_file_path,
                 upload,
             )
+            if not resume or not resume_with_method(*args):
+                upload_with_method(*args)
             # Break out of upload retries loop.
             break
         except SshException as err:
@@ -277,6 +525,40 @@ def upload_via_scp_with_retries(
             raise
 
 
+def upload_tar_bundle_with_retries(
+    files, username, host, port, uploads, progress_callback
+):
+    """Upload a tar bundle of small files with retries
+    """
+    # pylint: disable=too-many-arguments
+    retries = 0
+    while True:
+        # Upload retries loop:
+        try:
+            upload_tar_bundle_with_ssh(
+                files,
+                username,
+                settings.uploader.ssh_key_pair.private_key_path,
+                host,
+                port,
+                progress_callback,
+            )
+            # Break out of upload retries loop.
+            break
+        except SshException as err:
+            for upload in uploads:
+                upload.traceback = traceback.format_exc()
+                upload.bytes_uploaded = 0
+            if retries < settings.advanced.max_upload_retries:
+                logger.warning(str(err))
+                retries += 1
+                for upload in uploads:
+                    upload.retries = retries
+                logger.debug("Restarting upload for bundle of %s files" % len(files))
+                continue
+            raise
+
+
 def check_if_file_is_missing(upload, datafile_path):
     """Check if file (to be uploaded) exists on disk.
 
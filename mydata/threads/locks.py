@@ -9,6 +9,13 @@ LOCK_NAMES = [
     "request_staging_access",
     "update_cache",
     "close_cache",
+    "create_session",
+    "ssh_control_masters",
+    "sftp_connections",
+    "tar_bundles",
+    "file_state_indexes",
+    "index_output",
+    "index_manifests",
 ]
 
 
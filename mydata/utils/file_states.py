@@ -0,0 +1,202 @@
+"""
+Persistent index of local files' states, used to avoid recalculating
+checksums for files which haven't changed since they were last hashed.
+
+The index is an SQLite database, keyed by absolute file path, which records
+each file's size, modification time (in nanoseconds) and inode number,
+along with its MD5 and/or SHA-512 checksums.  If any of these have changed,
+the cached checksums are ignored and the file is hashed again.  Comparing
+these stat fields doesn't require reading the file at all, so there's
+no need for a fast content hash to detect changed files.
+
+Entries which haven't been used for STALE_ENTRY_DAYS days (e.g. for files
+which have been deleted or moved) are removed when the index is closed.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from ..logs import logger
+from ..threads.locks import LOCKS
+
+# How long (in days) unused entries are kept in the index:
+STALE_ENTRY_DAYS = 30
+
+# Open indexes, keyed by database path:
+FILE_STATE_INDEXES = dict()
+
+# The checksum columns stored in the index:
+CHECKSUM_FIELDS = ("md5sum", "sha512sum")
+
+
+class FileStateIndex:
+    """
+    Persistent index of (path, size, mtime, inode, md5sum, sha512sum)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Paths whose cached checksums have been used, so their
+        # last_seen time can be updated when the index is closed:
+        self.paths_seen = set()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_states ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER, md5sum TEXT, last_seen REAL)"
+        )
+        # Indexes created by previous versions of MyData only stored
+        # MD5 checksums:
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(file_states)")
+        ]
+        if "sha512sum" not in columns:
+            self.connection.execute("ALTER TABLE file_states ADD COLUMN sha512sum TEXT")
+
+    def get_checksums(self, file_path, fields, stat_result=None):
+        """
+        Return a dictionary of the cached checksums for file_path, keyed by
+        field (e.g. "md5sum"), or None if the file has changed since it was
+        hashed, or if any of the requested checksums weren't calculated.
+        """
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, inode, md5sum, sha512sum FROM file_states "
+                "WHERE path = ?",
+                (file_path,),
+            ).fetchone()
+            if row is None or tuple(row[:3]) != file_state(stat_result):
+                return None
+            cached = dict(zip(CHECKSUM_FIELDS, row[3:]))
+            if any(not cached[field] for field in fields):
+                return None
+            self.paths_seen.add(file_path)
+            return {field: cached[field] for field in fields}
+
+    def set_checksums(self, file_path, checksums, stat_result):
+        """
+        Record a file's checksums (a dictionary keyed by field, e.g. "md5sum"),
+        along with the size, mtime and inode from stat_result, which should
+        be obtained before hashing the file.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_states "
+                "(path, size, mtime_ns, inode, md5sum, sha512sum, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path,)
+                + file_state(stat_result)
+                + tuple(checksums.get(field) for field in CHECKSUM_FIELDS)
+                + (time.time(),),
+            )
+
+    def get_md5_sum(self, file_path, stat_result=None):
+        """
+        Return the cached MD5 checksum for file_path,
+        or None if the file has changed since it was hashed.
+        """
+        checksums = self.get_checksums(file_path, ["md5sum"], stat_result)
+        return checksums["md5sum"] if checksums else None
+
+    def set_md5_sum(self, file_path, md5sum, stat_result):
+        """
+        Record a file's MD5 checksum, along with the size, mtime and inode
+        from stat_result, which should be obtained before hashing the file.
+        """
+        self.set_checksums(file_path, dict(md5sum=md5sum), stat_result)
+
+    def compact(self):
+        """
+        Update the last_seen time of the entries which have been used,
+        and remove entries which haven't been used for STALE_ENTRY_DAYS days
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "UPDATE file_states SET last_seen = ? WHERE path = ?",
+                ((now, path) for path in self.paths_seen),
+            )
+            self.connection.execute(
+                "DELETE FROM file_states WHERE last_seen < ?",
+                (now - STALE_ENTRY_DAYS * 24 * 60 * 60,),
+            )
+            self.connection.execute("COMMIT")
+            self.paths_seen.clear()
+
+    def close(self):
+        """
+        Compact and close the index
+        """
+        try:
+            self.compact()
+        except sqlite3.Error as err:
+            logger.warning("Couldn't compact %s: %s" % (self.path, err))
+        with self.lock:
+            self.connection.close()
+
+
+def file_state(stat_result):
+    """
+    Return the (size, mtime_ns, inode) tuple used to detect changed files
+    """
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def get_file_state_index(path):
+    """
+    Return the file state index stored at path, opening it if necessary.
+
+    Return None if the index can't be opened, in which case
+    checksums will be calculated without using the index.
+    """
+    with LOCKS.file_state_indexes:  # pylint: disable=no-member
+        if path not in FILE_STATE_INDEXES:
+            try:
+                FILE_STATE_INDEXES[path] = FileStateIndex(path)
+            except sqlite3.Error as err:
+                logger.warning("Couldn't open file state index %s: %s" % (path, err))
+                FILE_STATE_INDEXES[path] = None
+        return FILE_STATE_INDEXES[path]
+
+
+def calculate_checksums_with_index(file_path, calculate_checksums, fields, index_path):
+    """
+    Return file_path's checksums (a dictionary keyed by field, e.g. "md5sum")
+    from the file state index at index_path if the file hasn't changed since
+    it was hashed, otherwise calculate them with calculate_checksums(file_path)
+    and record them in the index.
+
+    If index_path is None, the index isn't used.
+    """
+    index = get_file_state_index(index_path) if index_path else None
+    if not index:
+        return calculate_checksums(file_path)
+    file_path = os.path.abspath(file_path)
+    stat_result = os.stat(file_path)
+    checksums = index.get_checksums(file_path, fields, stat_result)
+    if checksums:
+        return checksums
+    checksums = calculate_checksums(file_path)
+    if checksums:
+        index.set_checksums(file_path, checksums, stat_result)
+    return checksums
+
+
+def close_file_state_indexes():
+    """
+    Close any open file state indexes
+    """
+    with LOCKS.file_state_indexes:  # pylint: disable=no-member
+        for index in FILE_STATE_INDEXES.values():
+            if index:
+                index.close()
+        FILE_STATE_INDEXES.clear()
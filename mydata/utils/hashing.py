@@ -0,0 +1,180 @@
+"""
+Checksum calculation for DataFile records.
+
+MyTardis accepts MD5 and/or SHA-512 checksums for each DataFile (see the
+checksum_algorithms setting).  All of the configured checksums are calculated
+in a single pass over each file's data, and the time spent on each algorithm
+is recorded, so hashing throughput can be reported per algorithm.
+
+A pool of hashing threads can be used to calculate checksums ahead of the
+upload threads which need them, when uploading via staging.  hashlib releases
+the GIL while hashing each chunk of a file, and file reads release it too,
+so reading files in large chunks allows several files to be hashed
+concurrently in threads.  Each hashing thread only holds one chunk (up to
+16 MB) in memory at a time, and the number of checksums calculated ahead
+of the uploads is limited by the size of the Uploads queue.
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..logs import logger
+
+# The checksum algorithms accepted by MyTardis, and the DataFile field
+# used for each one:
+CHECKSUM_FIELDS = dict(md5="md5sum", sha512="sha512sum")
+
+# The ThreadPoolExecutor, if hashing threads are running:
+HASHING_POOL = []
+
+# The number of bytes hashed and the time (in seconds) spent hashing them,
+# for each algorithm:
+HASHING_STATS = dict()
+HASHING_STATS_LOCK = threading.Lock()
+
+
+class Hashers:
+    """
+    Calculates checksums using several algorithms in one pass over
+    a file's data, recording the time spent on each algorithm
+    """
+
+    def __init__(self, algorithms):
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def update(self, chunk):
+        """
+        Add a chunk of data to each of the checksums
+        """
+        for algorithm, hasher in self.hashers.items():
+            start_time = time.perf_counter()
+            hasher.update(chunk)
+            elapsed = time.perf_counter() - start_time
+            with HASHING_STATS_LOCK:
+                num_bytes, seconds = HASHING_STATS.get(algorithm, (0, 0.0))
+                HASHING_STATS[algorithm] = (num_bytes + len(chunk), seconds + elapsed)
+
+    def checksums(self):
+        """
+        Return a dictionary of hex digests keyed by DataFile field,
+        e.g. dict(md5sum="...")
+        """
+        return {
+            CHECKSUM_FIELDS[algorithm]: hasher.hexdigest()
+            for algorithm, hasher in self.hashers.items()
+        }
+
+
+def calculate_checksums(
+    file_path, algorithms, file_size=None, canceled_cb=None, use_mmap=False
+):
+    """
+    Calculate a file's checksums using each of the algorithms (e.g. ["md5"])
+    in one pass over the file, reading it in chunks of up to 16 MB.
+
+    Chunk sizes are powers of two (from 128 KB), so reads stay aligned
+    with the file system's blocks.  If use_mmap is True, the file is
+    memory-mapped and hashed in chunks of the mapping, avoiding copying
+    its data into a buffer for each read.
+
+    Return a dictionary of hex digests keyed by DataFile field,
+    e.g. dict(md5sum="..."), or None if canceled_cb returns True.
+    """
+    hashers = Hashers(algorithms)
+
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+    default_chunk_size = 128 * 1024
+    max_chunk_size = 16 * 1024 * 1024
+    chunk_size = default_chunk_size
+    while (file_size / chunk_size) > 50 and chunk_size < max_chunk_size:
+        chunk_size *= 2
+    with open(file_path, "rb") as file_handle:
+        if use_mmap and file_size > 0:
+            with mmap.mmap(
+                file_handle.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapping, memoryview(mapping) as view:
+                completed = hash_chunks(
+                    hashers,
+                    (
+                        view[offset : offset + chunk_size]
+                        for offset in range(0, len(view), chunk_size)
+                    ),
+                    canceled_cb,
+                )
+        else:
+            # Note that the iter() func needs an empty byte string
+            # for the returned iterator to halt at EOF, since read()
+            # returns b'' (not just '').
+            completed = hash_chunks(
+                hashers,
+                iter(lambda: file_handle.read(chunk_size), b""),
+                canceled_cb,
+            )
+    if not completed:
+        logger.debug("Aborting checksum calculation for %s" % file_path)
+        return None
+    return hashers.checksums()
+
+
+def hash_chunks(hashers, chunks, canceled_cb=None):
+    """
+    Add each chunk to the hashers, returning False if canceled_cb returns True
+    """
+    for chunk in chunks:
+        if canceled_cb and canceled_cb():
+            return False
+        hashers.update(chunk)
+        if isinstance(chunk, memoryview):
+            chunk.release()
+        del chunk
+    return True
+
+
+def get_hashing_throughput():
+    """
+    Return a dictionary of (bytes hashed, bytes per second) tuples,
+    keyed by algorithm, for the checksums calculated so far
+    """
+    with HASHING_STATS_LOCK:
+        return {
+            algorithm: (num_bytes, num_bytes / seconds if seconds else 0.0)
+            for algorithm, (num_bytes, seconds) in HASHING_STATS.items()
+        }
+
+
+def init_hashing_threads():
+    """Initialize hashing worker threads
+    """
+    from mydata.conf import settings
+
+    HASHING_POOL.append(
+        ThreadPoolExecutor(
+            max_workers=settings.advanced.max_hashing_threads,
+            thread_name_prefix="HashingThread",
+        )
+    )
+
+
+def prefetch_checksums(folder, datafile_index):
+    """Start calculating a file's checksums in a hashing thread
+
+    Return a Future whose result is the checksums dictionary returned by
+    folder.calculate_checksums, or None if no hashing threads are running.
+    """
+    if not HASHING_POOL:
+        return None
+    return HASHING_POOL[0].submit(folder.calculate_checksums, datafile_index)
+
+
+def shutdown_hashing_threads():
+    """Wait for any checksums being calculated, and stop the hashing threads
+
+    After shutting down, checksums will be calculated in the upload threads.
+    """
+    for executor in HASHING_POOL:
+        executor.shutdown(wait=True)
+    del HASHING_POOL[:]
@@ -6,9 +6,14 @@ On Windows, we bundle a Cygwin build of OpenSSH.
 import sys
 from datetime import datetime
 import os
+import posixpath
 import subprocess
 import re
 import getpass
+import hashlib
+import shutil
+import tarfile
+import tempfile
 import time
 import struct
 
@@ -16,6 +21,7 @@ import psutil
 
 from ..conf import settings
 from ..logs import logger
+from ..threads.locks import LOCKS
 from ..utils.exceptions import SshException
 from ..utils.exceptions import ScpException
 from ..utils.exceptions import PrivateKeyDoesNotExist
@@ -33,6 +39,22 @@ SLEEP_FACTOR = 0.01
 
 REMOTE_DIRS_CREATED = dict()
 
+# Size of the chunks read from local files when resuming partial uploads:
+RESUME_CHUNK_SIZE = 1024 * 1024
+
+# ControlPath for each SSH master connection, keyed by (username, host, port),
+# or None if the master connection couldn't be started:
+CONTROL_MASTERS = dict()
+
+# Directory containing ControlPath sockets:
+CONTROL_DIR = None
+
+# How long (in seconds) an idle master connection should remain open
+# in the background.  Master connections are closed explicitly by
+# clean_up_scp_and_ssh_processes, so this only matters if MyData
+# doesn't exit cleanly:
+CONTROL_PERSIST = 600
+
 
 class OpenSSH:
     """
@@ -352,7 +374,7 @@ def upload_with_scp(
     scp_command_list[2:2] = settings.miscellaneous.cipher_options
     scp_command_list[2:2] = OpenSSH.default_ssh_options(
         settings.miscellaneous.connection_timeout
-    )
+    ) + get_control_master_options(username, private_key_path, host, port)
 
     scp_upload(upload, scp_command_list)
 
@@ -364,6 +386,314 @@ def upload_with_scp(
     upload.bytes_uploaded = upload.file_size
 
 
+def resume_upload_with_ssh(
+    file_path, username, private_key_path, host, port, remote_file_path, upload,
+):
+    """
+    Resume a partial upload to staging, by appending the missing bytes to
+    the partially uploaded file, after checking that its MD5 checksum matches
+    the corresponding prefix of the local file.
+
+    Return True if the upload was resumed (or the file was already complete
+    on staging), or False if the file needs to be uploaded from the start.
+
+    :raises SshException:
+    """
+    if sys.platform.startswith("win"):
+        private_key_path = get_cygwin_path(private_key_path)
+
+    upload.start_time = datetime.now()
+
+    try:
+        remote_size, remote_md5 = get_remote_file_size_and_md5(
+            remote_file_path, username, private_key_path, host, port
+        )
+    except SshException as err:
+        # e.g. md5sum isn't available on the staging host, which only
+        # means that the upload can't be resumed:
+        logger.warning(
+            "Couldn't check partial upload of %s on staging, "
+            "so it will be uploaded from the start: %s" % (file_path, err)
+        )
+        return False
+    if not can_resume_upload(file_path, remote_size, remote_md5):
+        return False
+    logger.info(
+        "Resuming upload of %s from byte %s of %s"
+        % (file_path, remote_size, upload.file_size)
+    )
+    upload.bytes_uploaded = remote_size
+    if remote_size < upload.file_size:
+        append_with_ssh(
+            file_path,
+            remote_size,
+            username,
+            private_key_path,
+            host,
+            port,
+            remote_file_path,
+            upload,
+        )
+
+    # The upload may have been interrupted before its permissions were set,
+    # even if all of its bytes were uploaded:
+    set_remote_file_permissions(
+        remote_file_path, username, private_key_path, host, port
+    )
+
+    upload.set_latest_time(datetime.now())
+    upload.bytes_uploaded = upload.file_size
+    return True
+
+
+def get_remote_file_size_and_md5_command(remote_file_path):
+    """
+    Return a remote command which prints the size and MD5 checksum
+    of a file on staging, or nothing if the file doesn't exist
+    """
+    quoted_path = OpenSSH.double_quote_remote_path(remote_file_path)
+    return "if [ -f %s ]; then wc -c < %s && md5sum < %s; fi" % (
+        quoted_path,
+        quoted_path,
+        quoted_path,
+    )
+
+
+def parse_remote_file_size_and_md5(stdout):
+    """
+    Parse the output of get_remote_file_size_and_md5_command,
+    returning a (size, md5sum) tuple, or (0, None) if the file
+    doesn't exist on staging
+    """
+    fields = stdout.split()
+    if len(fields) < 2:
+        return 0, None
+    return int(fields[0]), fields[1]
+
+
+def get_remote_file_size_and_md5(
+    remote_file_path, username, private_key_path, host, port
+):
+    """
+    Return the size and MD5 checksum of a (partially uploaded) file on
+    staging, or (0, None) if the file doesn't exist.
+
+    The checksum is calculated on the staging host, so the file's content
+    doesn't need to be downloaded.
+    """
+    md5_cmd_and_args = [
+        OPENSSH.ssh,
+        "-p",
+        port,
+        "-n",
+        "-c",
+        settings.miscellaneous.cipher,
+        "-i",
+        private_key_path,
+        "-l",
+        username,
+        host,
+        get_remote_file_size_and_md5_command(remote_file_path),
+    ]
+    md5_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
+        settings.miscellaneous.connection_timeout
+    ) + get_control_master_options(username, private_key_path, host, port)
+    logger.debug(" ".join(md5_cmd_and_args))
+    md5_process = subprocess.Popen(
+        md5_cmd_and_args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        startupinfo=DEFAULT_STARTUP_INFO,
+        creationflags=DEFAULT_CREATION_FLAGS,
+    )
+    stdout, stderr = md5_process.communicate()
+    if md5_process.returncode != 0:
+        raise SshException(stderr.decode(), md5_process.returncode)
+    try:
+        return parse_remote_file_size_and_md5(stdout.decode())
+    except ValueError:
+        raise SshException(
+            "Unexpected output from remote command: %s" % stdout.decode()
+        )
+
+
+def can_resume_upload(file_path, remote_size, remote_md5):
+    """
+    Return True if the partially uploaded file on staging (with size
+    remote_size and MD5 checksum remote_md5) matches the start of the
+    local file, so the upload can be resumed.
+    """
+    if not remote_size or remote_size > os.path.getsize(file_path):
+        return False
+    md5 = hashlib.md5()
+    bytes_remaining = remote_size
+    with open(file_path, "rb") as file_handle:
+        while bytes_remaining > 0:
+            chunk = file_handle.read(min(RESUME_CHUNK_SIZE, bytes_remaining))
+            if not chunk:
+                return False
+            md5.update(chunk)
+            bytes_remaining -= len(chunk)
+    if md5.hexdigest() != remote_md5:
+        logger.warning(
+            "Partial upload of %s on staging doesn't match the local file, "
+            "so it will be uploaded again." % file_path
+        )
+        return False
+    return True
+
+
+def append_with_ssh(
+    file_path, offset, username, private_key_path, host, port, remote_file_path, upload
+):
+    """
+    Append the content of a local file, starting from offset, to a remote
+    file on staging, by streaming it to "cat" over SSH.
+    """
+    # pylint: disable=too-many-arguments
+    append_cmd_and_args = [
+        OPENSSH.ssh,
+        "-p",
+        port,
+        "-c",
+        settings.miscellaneous.cipher,
+        "-i",
+        private_key_path,
+        "-l",
+        username,
+        host,
+        "cat >> %s" % OpenSSH.double_quote_remote_path(remote_file_path),
+    ]
+    append_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
+        settings.miscellaneous.connection_timeout
+    ) + get_control_master_options(username, private_key_path, host, port)
+    logger.debug(" ".join(append_cmd_and_args))
+
+    with tempfile.TemporaryFile() as output:
+        append_process = subprocess.Popen(
+            append_cmd_and_args,
+            stdin=subprocess.PIPE,
+            stdout=output,
+            stderr=output,
+            startupinfo=DEFAULT_STARTUP_INFO,
+            creationflags=DEFAULT_CREATION_FLAGS,
+        )
+        error = None
+        try:
+            with open(file_path, "rb") as file_handle:
+                file_handle.seek(offset)
+                for chunk in iter(lambda: file_handle.read(RESUME_CHUNK_SIZE), b""):
+                    append_process.stdin.write(chunk)
+                    upload.bytes_uploaded += len(chunk)
+                    upload.set_latest_time(datetime.now())
+        except (IOError, OSError) as err:
+            # e.g. a broken pipe if the remote command failed:
+            error = err
+        try:
+            append_process.stdin.close()
+        except (IOError, OSError):
+            pass
+        append_process.wait()
+        if append_process.returncode != 0 or error:
+            output.seek(0)
+            message = output.read().decode()
+            if error:
+                message = "%s\n%s" % (error, message)
+            raise SshException(message, append_process.returncode)
+
+
+def upload_tar_bundle_with_ssh(
+    files, username, private_key_path, host, port, progress_callback=None,
+):
+    """
+    Upload multiple (small) files to staging as a single tar stream,
+    which is unpacked by running tar on the staging host, so that only one
+    SSH channel is needed, rather than running scp (and chmod) for each file.
+
+    :param files: a list of (file_path, remote_file_path) tuples
+    :param progress_callback: called with the index (in files) of each file
+        after it has been written to the tar stream
+    :raises SshException:
+    """
+    # pylint: disable=too-many-locals
+    if sys.platform.startswith("win"):
+        private_key_path = get_cygwin_path(private_key_path)
+
+    remote_dirs = sorted(
+        set(posixpath.dirname(remote_file_path) for _, remote_file_path in files)
+    )
+    base_dir = posixpath.commonpath(remote_dirs)
+    arcnames = [
+        posixpath.relpath(remote_file_path, base_dir)
+        for _, remote_file_path in files
+    ]
+    remote_command = "mkdir -m 2770 -p %s && cd %s && tar -x -f - && chmod 660 %s" % (
+        " ".join(OpenSSH.double_quote_remote_path(path) for path in remote_dirs),
+        OpenSSH.double_quote_remote_path(base_dir),
+        " ".join(OpenSSH.double_quote_remote_path(path) for path in arcnames),
+    )
+    tar_cmd_and_args = [
+        OPENSSH.ssh,
+        "-p",
+        port,
+        "-c",
+        settings.miscellaneous.cipher,
+        "-i",
+        private_key_path,
+        "-l",
+        username,
+        host,
+        remote_command,
+    ]
+    tar_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
+        settings.miscellaneous.connection_timeout
+    ) + get_control_master_options(username, private_key_path, host, port)
+    logger.debug(" ".join(tar_cmd_and_args))
+
+    with tempfile.TemporaryFile() as output:
+        tar_process = subprocess.Popen(
+            tar_cmd_and_args,
+            stdin=subprocess.PIPE,
+            stdout=output,
+            stderr=output,
+            startupinfo=DEFAULT_STARTUP_INFO,
+            creationflags=DEFAULT_CREATION_FLAGS,
+        )
+        error = None
+        try:
+            # Like scp, follow symbolic links to data files, rather than
+            # adding them to the bundle as links:
+            with tarfile.open(
+                fileobj=tar_process.stdin, mode="w|", dereference=True
+            ) as tar:
+                for index, (file_path, _) in enumerate(files):
+                    tarinfo = tar.gettarinfo(file_path, arcname=arcnames[index])
+                    tarinfo.uid = tarinfo.gid = 0
+                    tarinfo.uname = tarinfo.gname = ""
+                    tarinfo.mode = 0o660
+                    with open(file_path, "rb") as datafile:
+                        tar.addfile(tarinfo, datafile)
+                    if progress_callback:
+                        progress_callback(index)
+        except (IOError, OSError) as err:
+            # e.g. a broken pipe if the remote command failed:
+            error = err
+        try:
+            tar_process.stdin.close()
+        except (IOError, OSError):
+            pass
+        tar_process.wait()
+        if tar_process.returncode != 0 or error:
+            output.seek(0)
+            message = output.read().decode()
+            if error:
+                message = "%s\n%s" % (error, message)
+            raise SshException(message, tar_process.returncode)
+    for remote_dir in remote_dirs:
+        REMOTE_DIRS_CREATED[remote_dir] = True
+
+
 def scp_upload(upload, scp_command_list):
     """
     Perfom an SCP upload using subprocess.Popen
@@ -419,7 +749,7 @@ def set_remote_file_permissions(
     ]
     chmod_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
         settings.miscellaneous.connection_timeout
-    )
+    ) + get_control_master_options(username, private_key_path, host, port)
     logger.debug(" ".join(chmod_cmd_and_args))
     chmod_process = subprocess.Popen(
         chmod_cmd_and_args,
@@ -468,7 +798,7 @@ def create_remote_dir(remote_dir, username, private_key_path, host, port):
         ]
         mkdir_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
             settings.miscellaneous.connection_timeout
-        )
+        ) + get_control_master_options(username, private_key_path, host, port)
         logger.debug(" ".join(mkdir_cmd_and_args))
 
         mkdir_process = subprocess.Popen(
@@ -485,6 +815,127 @@ def create_remote_dir(remote_dir, username, private_key_path, host, port):
         REMOTE_DIRS_CREATED[remote_dir] = True
 
 
+def get_control_master_options(username, private_key_path, host, port):
+    """
+    Return SSH options for reusing a master connection to the staging host,
+    starting the master connection if necessary, so that each SSH/SCP
+    command doesn't need to make its own connection (with key exchange
+    and authentication).
+
+    Return an empty list if SSH multiplexing is disabled or if the master
+    connection couldn't be started.
+    """
+    if not settings.miscellaneous.use_ssh_control_master:
+        return []
+    key = (username, host, str(port))
+    with LOCKS.ssh_control_masters:  # pylint: disable=no-member
+        if key not in CONTROL_MASTERS:
+            CONTROL_MASTERS[key] = start_control_master(
+                username, private_key_path, host, port
+            )
+        control_path = CONTROL_MASTERS[key]
+    if not control_path:
+        return []
+    # If the master connection has gone away, ssh will fall back to
+    # making its own connection:
+    return ["-oControlMaster=no", "-oControlPath=%s" % control_path]
+
+
+def start_control_master(username, private_key_path, host, port):
+    """
+    Start a master SSH connection running in the background,
+    and return its ControlPath, or None if it couldn't be started.
+
+    The backgrounded ssh process keeps its stdout/stderr open, so its output
+    is written to a temporary file, rather than to a pipe which we would
+    need to wait to be closed.
+    """
+    global CONTROL_DIR  # pylint: disable=global-statement
+    if not CONTROL_DIR:
+        # Unix domain socket paths are limited to around 100 characters,
+        # so we use a short temporary directory path and OpenSSH's %C hash:
+        CONTROL_DIR = tempfile.mkdtemp(
+            prefix="mydata-", dir="/tmp" if os.path.isdir("/tmp") else None
+        )
+    control_path = os.path.join(CONTROL_DIR, "%C")
+    master_cmd_and_args = [
+        OPENSSH.ssh,
+        "-p",
+        port,
+        "-c",
+        settings.miscellaneous.cipher,
+        "-i",
+        private_key_path,
+        "-l",
+        username,
+        "-oControlMaster=yes",
+        "-oControlPath=%s" % control_path,
+        "-oControlPersist=%s" % CONTROL_PERSIST,
+        "-N",
+        "-f",
+        host,
+    ]
+    master_cmd_and_args[1:1] = OpenSSH.default_ssh_options(
+        settings.miscellaneous.connection_timeout
+    )
+    logger.debug(" ".join(master_cmd_and_args))
+    with tempfile.TemporaryFile() as output:
+        master_process = subprocess.Popen(
+            master_cmd_and_args,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=output,
+            startupinfo=DEFAULT_STARTUP_INFO,
+            creationflags=DEFAULT_CREATION_FLAGS,
+        )
+        master_process.wait()
+        if master_process.returncode != 0:
+            output.seek(0)
+            logger.warning(
+                "Couldn't start SSH master connection to %s, "
+                "so each SSH command will connect separately: %s"
+                % (host, output.read().decode())
+            )
+            return None
+    return control_path
+
+
+def stop_control_masters():
+    """
+    Ask each SSH master connection to exit, and remove
+    the directory containing their ControlPath sockets.
+    """
+    global CONTROL_DIR  # pylint: disable=global-statement
+    with LOCKS.ssh_control_masters:  # pylint: disable=no-member
+        for (username, host, port), control_path in CONTROL_MASTERS.items():
+            if not control_path:
+                continue
+            exit_cmd_and_args = [
+                OPENSSH.ssh,
+                "-p",
+                port,
+                "-l",
+                username,
+                "-oControlPath=%s" % control_path,
+                "-O",
+                "exit",
+                host,
+            ]
+            logger.debug(" ".join(exit_cmd_and_args))
+            subprocess.call(
+                exit_cmd_and_args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                startupinfo=DEFAULT_STARTUP_INFO,
+                creationflags=DEFAULT_CREATION_FLAGS,
+            )
+        CONTROL_MASTERS.clear()
+        if CONTROL_DIR:
+            shutil.rmtree(CONTROL_DIR, ignore_errors=True)
+            CONTROL_DIR = None
+
+
 def get_cygwin_path(path):
     """
     Converts "C:\\path\\to\\file" to "/cygdrive/C/path/to/file".
@@ -505,13 +956,17 @@ def clean_up_scp_and_ssh_processes():
     check that the absolute path of the SSH executable to be terminated
     matches MyData's SSH path.  On other platforms, we can use proc.cmdline()
     to ensure that the SSH process we're killing uses MyData's private key.
+
+    SSH master connections (see get_control_master_options) are
+    asked to exit before any remaining processes are killed.
     """
+    stop_control_masters()
     if not settings.uploader:
         return
     try:
-        private_key_path = settings.uploader.sshKeyPair.private_key_path
+        private_key_path = settings.uploader.ssh_key_pair.private_key_path
     except AttributeError:
-        # If sshKeyPair or private_key_path hasn't been defined yet,
+        # If ssh_key_pair or private_key_path hasn't been defined yet,
         # then there won't be any SCP or SSH processes to kill.
         return
     for proc in psutil.process_iter():
@@ -2,11 +2,17 @@
 Queues used for consuming tasks for multi-threaded works
 """
 import threading
+import traceback
 from queue import Queue
 
+from ..logs import logger
+
 LOOKUPS_QUEUE = Queue()
 LOOKUP_THREADS = []
 
+UPLOADS_QUEUE = Queue()
+UPLOAD_THREADS = []
+
 
 def lookup_worker():
     """Consume file lookup task(s) from the Lookups queue
@@ -15,22 +21,118 @@ def lookup_worker():
 
     By default, up to 4 lookup threads can run concurrently
     for looking up local files on the MyTardis server
+
+    A None task is used as a sentinel, telling the worker to exit.
+    Every task (including the sentinel) is marked as done, so that
+    LOOKUPS_QUEUE.join() can be used as a completion barrier.
     """
     while True:
         lookup_runnable = LOOKUPS_QUEUE.get()
-        if not lookup_runnable:
-            break
-        lookup_runnable.lookup_datafile()
+        try:
+            if not lookup_runnable:
+                break
+            lookup_runnable.lookup_datafile()
+        except Exception:  # pylint: disable=broad-except
+            logger.error(traceback.format_exc())
+        finally:
+            LOOKUPS_QUEUE.task_done()
 
 
 def init_lookup_threads():
     """Initialize lookup worker threads
+
+    The Lookups queue is bounded, so that folder scanning will block
+    instead of queueing up lookups for every file in the data directory
+    ahead of the lookup threads.
     """
     from mydata.conf import settings
 
+    LOOKUPS_QUEUE.maxsize = 100 * settings.advanced.max_lookup_threads
     for i in range(settings.advanced.max_lookup_threads):
         thread = threading.Thread(
             name="LookupThread-%d" % (i + 1), target=lookup_worker, daemon=True
         )
         LOOKUP_THREADS.append(thread)
         thread.start()
+
+
+def wait_for_lookups():
+    """Block until every lookup task put onto the Lookups queue has been processed
+    """
+    LOOKUPS_QUEUE.join()
+
+
+def shutdown_lookup_threads():
+    """Tell each lookup worker thread to exit, and wait for them to finish
+
+    After shutting down, FolderLookup will fall back to looking up
+    files in the calling thread.
+    """
+    for _ in LOOKUP_THREADS:
+        LOOKUPS_QUEUE.put(None)
+    for thread in LOOKUP_THREADS:
+        thread.join()
+    del LOOKUP_THREADS[:]
+
+
+def upload_worker():
+    """Consume file upload task(s) from the Uploads queue
+
+    One worker per thread.
+
+    Up to settings.advanced.max_upload_threads upload threads can run
+    concurrently, so a slow upload doesn't hold up lookups or other uploads.
+
+    A None task is used as a sentinel, telling the worker to exit.
+    Every task (including the sentinel) is marked as done, so that
+    UPLOADS_QUEUE.join() can be used as a completion barrier.
+    """
+    while True:
+        upload_runnable = UPLOADS_QUEUE.get()
+        try:
+            if not upload_runnable:
+                break
+            upload_runnable.upload_file()
+        except Exception:  # pylint: disable=broad-except
+            logger.error(traceback.format_exc())
+        finally:
+            UPLOADS_QUEUE.task_done()
+
+
+def init_upload_threads():
+    """Initialize upload worker threads
+
+    The Uploads queue is bounded, so that threads producing upload tasks
+    (lookups) will block instead of queueing up an unlimited
+    number of uploads ahead of the upload threads.
+    """
+    from mydata.conf import settings
+
+    UPLOADS_QUEUE.maxsize = 2 * settings.advanced.max_upload_threads
+    for i in range(settings.advanced.max_upload_threads):
+        thread = threading.Thread(
+            name="UploadThread-%d" % (i + 1), target=upload_worker, daemon=True
+        )
+        UPLOAD_THREADS.append(thread)
+        thread.start()
+
+
+def wait_for_uploads():
+    """Block until every upload task put onto the Uploads queue has been processed
+
+    Uploads are queued by lookups, so wait_for_lookups should be called first.
+    """
+    UPLOADS_QUEUE.join()
+
+
+def shutdown_upload_threads():
+    """Tell each upload worker thread to exit, and wait for them to finish
+
+    After shutting down, files will be uploaded in the thread
+    which looked them up.
+    """
+    for _ in UPLOAD_THREADS:
+        UPLOADS_QUEUE.put(None)
+    for thread in UPLOAD_THREADS:
+        thread.join()
+    del UPLOAD_THREADS[:]
@@ -2,17 +2,25 @@
 Automatically retry API requests after a server error
 """
 import requests
-from requests.adapters import HTTPAdapter
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry  # pylint: disable=import-error
 
 
 def requests_retry_session(
-    retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None,
+    retries=3,
+    backoff_factor=0.3,
+    status_forcelist=(500, 502, 504),
+    session=None,
+    pool_maxsize=DEFAULT_POOLSIZE,
+    raise_on_status=True,
 ):
     """
     Use requests_retry_session().get(...) instead of requests.get(...)
     or session.get(...) to automatically retry after a server error.
 
+    See also mydata.utils.sessions.get_session, which reuses one
+    session (and its connection pool) for each MyTardis URL.
+
     Thanks to https://www.peterbe.com/plog/best-practice-with-retries-with-requests
     """
     session = session or requests.Session()
@@ -22,8 +30,9 @@ def requests_retry_session(
         connect=retries,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
+        raise_on_status=raise_on_status,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
@@ -0,0 +1,62 @@
+"""
+Shared HTTP sessions for MyTardis API requests
+
+Creating a new requests.Session for each API request means that each
+request needs a new TCP connection (and TLS handshake).  Instead, one
+connection-pooled session is shared (between threads) for each MyTardis URL,
+so that connections can be kept alive and reused.
+"""
+import requests
+
+from ..threads.locks import LOCKS
+from .retries import requests_retry_session
+
+SESSIONS = dict()
+
+
+def get_session(base_url=None, pool_maxsize=None):
+    """
+    Return the shared session for a MyTardis URL, creating it if necessary.
+
+    Use get_session().get(...) instead of requests.get(...).
+
+    Like requests_retry_session, the session retries requests which
+    fail with a server error, but after the final retry the error response
+    is returned, rather than raising an exception, so callers can still
+    check the response's status code.
+
+    :param base_url: the MyTardis URL, defaulting to
+        settings.general.mytardis_url
+    :param pool_maxsize: the maximum number of connections to keep alive,
+        defaulting to one for each thread which can make API requests
+    """
+    if base_url is None:
+        from ..conf import settings
+
+        base_url = settings.general.mytardis_url
+    with LOCKS.create_session:  # pylint: disable=no-member
+        if base_url not in SESSIONS:
+            if pool_maxsize is None:
+                pool_maxsize = get_pool_maxsize()
+            SESSIONS[base_url] = requests_retry_session(
+                session=requests.Session(),
+                pool_maxsize=pool_maxsize,
+                raise_on_status=False,
+            )
+        return SESSIONS[base_url]
+
+
+def get_pool_maxsize():
+    """
+    Return the number of connections which could be in use concurrently,
+    i.e. one for each lookup thread and each upload thread, plus one
+    for the main thread.
+    """
+    from ..conf import settings
+
+    return (
+        settings.advanced.max_lookup_threads
+        + settings.advanced.max_upload_threads
+        + 1
+    )
+
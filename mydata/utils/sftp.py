@@ -0,0 +1,276 @@
+"""
+Methods for uploading files to staging using SFTP from within MyData's
+process (using paramiko), rather than running an scp subprocess per file.
+
+One SSH connection is kept open for each staging host, and each thread
+uploading files opens its own SFTP session (channel) over that connection.
+
+paramiko is an optional dependency, which can be installed with:
+
+    pip install mydata[sftp]
+"""
+import posixpath
+import socket
+import stat
+import threading
+from datetime import datetime
+
+from ..conf import settings
+from ..logs import logger
+from ..threads.locks import LOCKS
+from .exceptions import SshException
+from .openssh import (
+    RESUME_CHUNK_SIZE,
+    can_resume_upload,
+    get_remote_file_size_and_md5_command,
+    parse_remote_file_size_and_md5,
+)
+
+# SSH client for each staging host, keyed by (username, host, port):
+SSH_CLIENTS = dict()
+
+# Each thread's SFTP sessions, keyed by (username, host, port):
+THREAD_LOCAL = threading.local()
+
+# Remote directories which have been created (or found to exist):
+REMOTE_DIRS_CREATED = dict()
+
+
+def upload_with_sftp(
+    file_path, username, private_key_path, host, port, remote_file_path, upload,
+):
+    """
+    Upload a file to staging using SFTP, updating upload.bytes_uploaded
+    as the upload progresses.
+
+    :raises SshException:
+    """
+    import paramiko  # pylint: disable=import-outside-toplevel
+
+    upload.start_time = datetime.now()
+
+    def progress_callback(bytes_uploaded, _):
+        upload.bytes_uploaded = bytes_uploaded
+        upload.set_latest_time(datetime.now())
+
+    try:
+        sftp = get_sftp_client(username, private_key_path, host, port)
+        create_remote_dir(sftp, posixpath.dirname(remote_file_path))
+        sftp.put(file_path, remote_file_path, callback=progress_callback)
+        # Ensure that the mytardis account (via the mytardis group) has read
+        # and write access to the uploaded data (see set_remote_file_permissions
+        # in mydata.utils.openssh):
+        sftp.chmod(remote_file_path, 0o660)
+    except (paramiko.SSHException, socket.error, EOFError) as err:
+        # Includes IOError / OSError raised for SFTP status errors.
+        # Discard this thread's SFTP session, so a retry will start a new one:
+        close_sftp_client(username, host, port)
+        raise SshException("SFTP upload of %s failed: %s" % (file_path, err))
+
+    upload.set_latest_time(datetime.now())
+    upload.bytes_uploaded = upload.file_size
+
+
+def resume_upload_with_sftp(
+    file_path, username, private_key_path, host, port, remote_file_path, upload,
+):
+    """
+    Resume a partial upload to staging, by writing the missing bytes to
+    the end of the partially uploaded file, after checking that its MD5
+    checksum (calculated on the staging host) matches the corresponding
+    prefix of the local file.
+
+    Return True if the upload was resumed (or the file was already complete
+    on staging), or False if the file needs to be uploaded from the start.
+
+    :raises SshException:
+    """
+    import paramiko  # pylint: disable=import-outside-toplevel
+
+    upload.start_time = datetime.now()
+
+    try:
+        remote_size, remote_md5 = get_remote_file_size_and_md5_with_sftp(
+            remote_file_path, username, private_key_path, host, port
+        )
+    except SshException as err:
+        # e.g. md5sum isn't available on the staging host, which only
+        # means that the upload can't be resumed:
+        logger.warning(
+            "Couldn't check partial upload of %s on staging, "
+            "so it will be uploaded from the start: %s" % (file_path, err)
+        )
+        return False
+    if not can_resume_upload(file_path, remote_size, remote_md5):
+        return False
+
+    logger.info(
+        "Resuming upload of %s from byte %s of %s"
+        % (file_path, remote_size, upload.file_size)
+    )
+    upload.bytes_uploaded = remote_size
+    try:
+        if remote_size < upload.file_size:
+            sftp = get_sftp_client(username, private_key_path, host, port)
+            with open(file_path, "rb") as file_handle, sftp.open(
+                remote_file_path, "r+b"
+            ) as remote_file:
+                remote_file.set_pipelined(True)
+                file_handle.seek(remote_size)
+                remote_file.seek(remote_size)
+                for chunk in iter(lambda: file_handle.read(RESUME_CHUNK_SIZE), b""):
+                    remote_file.write(chunk)
+                    upload.bytes_uploaded += len(chunk)
+                    upload.set_latest_time(datetime.now())
+        # The upload may have been interrupted before its permissions were
+        # set, even if all of its bytes were uploaded:
+        sftp = get_sftp_client(username, private_key_path, host, port)
+        sftp.chmod(remote_file_path, 0o660)
+    except (paramiko.SSHException, socket.error, EOFError, ValueError) as err:
+        # Discard this thread's SFTP session, so a retry will start a new one:
+        close_sftp_client(username, host, port)
+        raise SshException("Resuming SFTP upload of %s failed: %s" % (file_path, err))
+
+    upload.set_latest_time(datetime.now())
+    upload.bytes_uploaded = upload.file_size
+    return True
+
+
+def get_remote_file_size_and_md5_with_sftp(
+    remote_file_path, username, private_key_path, host, port
+):
+    """
+    Return the size and MD5 checksum of a (partially uploaded) file on
+    staging, or (0, None) if the file doesn't exist, using this thread's
+    connection to the staging host.
+
+    :raises SshException:
+    """
+    import paramiko  # pylint: disable=import-outside-toplevel
+
+    try:
+        ssh_client = get_ssh_client(username, private_key_path, host, port)
+        stdin, stdout, stderr = ssh_client.exec_command(
+            get_remote_file_size_and_md5_command(remote_file_path)
+        )
+        stdin.channel.shutdown_write()
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() != 0:
+            raise SshException(stderr.read().decode())
+        return parse_remote_file_size_and_md5(output)
+    except (paramiko.SSHException, socket.error, EOFError, ValueError) as err:
+        # Discard this thread's SFTP session, so the upload will start a new one:
+        close_sftp_client(username, host, port)
+        raise SshException(
+            "Checking partial upload of %s failed: %s" % (remote_file_path, err)
+        )
+
+
+def get_sftp_client(username, private_key_path, host, port):
+    """
+    Return this thread's SFTP session for the staging host, opening a new
+    session (and connecting to the host) if necessary.
+    """
+    key = (username, host, str(port))
+    sftp_clients = get_thread_sftp_clients()
+    sftp = sftp_clients.get(key)
+    if sftp and not sftp.get_channel().closed:
+        return sftp
+    ssh_client = get_ssh_client(username, private_key_path, host, port)
+    sftp = ssh_client.open_sftp()
+    sftp_clients[key] = sftp
+    return sftp
+
+
+def get_thread_sftp_clients():
+    """
+    Return a dictionary of the current thread's SFTP sessions
+    """
+    if not hasattr(THREAD_LOCAL, "sftp_clients"):
+        THREAD_LOCAL.sftp_clients = dict()
+    return THREAD_LOCAL.sftp_clients
+
+
+def close_sftp_client(username, host, port):
+    """
+    Close this thread's SFTP session for the staging host.
+    """
+    key = (username, host, str(port))
+    sftp = get_thread_sftp_clients().pop(key, None)
+    if sftp:
+        try:
+            sftp.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+def get_ssh_client(username, private_key_path, host, port):
+    """
+    Return the connected SSH client for the staging host,
+    connecting (or reconnecting) if necessary.
+    """
+    import paramiko  # pylint: disable=import-outside-toplevel
+
+    key = (username, host, str(port))
+    with LOCKS.sftp_connections:  # pylint: disable=no-member
+        ssh_client = SSH_CLIENTS.get(key)
+        if ssh_client:
+            transport = ssh_client.get_transport()
+            if transport and transport.is_active():
+                return ssh_client
+            ssh_client.close()
+        logger.debug("Opening SFTP connection to %s@%s:%s" % (username, host, port))
+        ssh_client = paramiko.SSHClient()
+        # Equivalent to the "-oStrictHostKeyChecking=no" option
+        # used for scp uploads (see OpenSSH.default_ssh_options):
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(
+            host,
+            port=int(port),
+            username=username,
+            key_filename=private_key_path,
+            timeout=settings.miscellaneous.connection_timeout,
+            allow_agent=False,
+            look_for_keys=False,
+        )
+        SSH_CLIENTS[key] = ssh_client
+        return ssh_client
+
+
+def create_remote_dir(sftp, remote_dir):
+    """
+    Create a remote directory and any missing parent directories
+    (like "mkdir -m 2770 -p") over SFTP.
+    """
+    if remote_dir in REMOTE_DIRS_CREATED:
+        return
+    missing_dirs = []
+    path = remote_dir
+    while path and path != posixpath.dirname(path):
+        try:
+            if not stat.S_ISDIR(sftp.stat(path).st_mode):
+                raise SshException("%s exists, but is not a directory" % path)
+            break
+        except FileNotFoundError:
+            missing_dirs.insert(0, path)
+            path = posixpath.dirname(path)
+    for path in missing_dirs:
+        try:
+            sftp.mkdir(path)
+        except IOError:
+            # Another thread might have created it:
+            if not stat.S_ISDIR(sftp.stat(path).st_mode):
+                raise
+    if missing_dirs:
+        sftp.chmod(remote_dir, 0o2770)
+    REMOTE_DIRS_CREATED[remote_dir] = True
+
+
+def close_sftp_connections():
+    """
+    Close the SSH connection to each staging host
+    """
+    with LOCKS.sftp_connections:  # pylint: disable=no-member
+        for ssh_client in SSH_CLIENTS.values():
+            ssh_client.close()
+        SSH_CLIENTS.clear()
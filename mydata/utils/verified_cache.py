@@ -0,0 +1,164 @@
+"""
+On-disk cache of DataFile lookup results, recording which files have
+been found to be verified on a MyTardis server, so they don't need to be
+looked up again.
+
+The cache is an SQLite database, so lookups don't require loading the
+whole cache into memory, and each verified file is written to disk as soon
+as it is found, so results aren't lost if MyData doesn't exit cleanly.
+
+It can be used like the dictionary it replaces:
+
+    cache_key = verified_datafile_cache_key(dataset_id, datafile_path)
+    if cache_key in settings.verified_datafiles_cache: ...
+    settings.verified_datafiles_cache[cache_key] = True
+
+Each cache key is a (dataset ID, 64-bit path hash) tuple of integers,
+rather than a "dataset_id,path" string, so each entry only needs a few
+bytes, however long its path is.  With a million files in one dataset,
+the chance of any two paths' hashes colliding is around 1 in 40 million.
+
+The cache also records a fingerprint of each folder whose files have all
+been verified (see mydata.models.folder.Folder.fingerprint), so if
+the folder hasn't changed since, it doesn't need to be looked up file
+by file.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+
+from ..logs import logger
+
+
+class VerifiedDatafilesCache:
+    """
+    SQLite-backed set of verified DataFile cache keys
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS verified_datafiles "
+            "(dataset_id INTEGER, path_hash INTEGER, "
+            "PRIMARY KEY (dataset_id, path_hash)) WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS verified_folders "
+            "(dataset_id INTEGER PRIMARY KEY, fingerprint BLOB)"
+        )
+
+    def __contains__(self, cache_key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM verified_datafiles "
+                "WHERE dataset_id = ? AND path_hash = ?",
+                cache_key,
+            ).fetchone()
+        return row is not None
+
+    def __setitem__(self, cache_key, verified):
+        with self.lock:
+            if verified:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO verified_datafiles VALUES (?, ?)", cache_key
+                )
+            else:
+                self.connection.execute(
+                    "DELETE FROM verified_datafiles "
+                    "WHERE dataset_id = ? AND path_hash = ?",
+                    cache_key,
+                )
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM verified_datafiles"
+            ).fetchone()[0]
+
+    def folder_is_verified(self, dataset_id, fingerprint):
+        """
+        Return True if all of the files in a dataset's folder were verified
+        when the folder's fingerprint matched the one supplied
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM verified_folders "
+                "WHERE dataset_id = ? AND fingerprint = ?",
+                (int(dataset_id), fingerprint),
+            ).fetchone()
+        return row is not None
+
+    def set_folder_verified(self, dataset_id, fingerprint):
+        """
+        Record the fingerprint of a dataset's folder whose files
+        have all been verified, replacing any previous fingerprint
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO verified_folders VALUES (?, ?)",
+                (int(dataset_id), fingerprint),
+            )
+
+    def import_pickled_cache(self, pickle_path):
+        """
+        Import the cache keys from a pickled dictionary (the format used by
+        previous versions of MyData, with "dataset_id,path" keys), and remove
+        the pickle file
+        """
+        with open(pickle_path, "rb") as cache_file:
+            verified_datafiles = pickle.load(cache_file)
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO verified_datafiles VALUES (?, ?)",
+                (
+                    verified_datafile_cache_key(*cache_key.split(",", 1))
+                    for cache_key in verified_datafiles
+                ),
+            )
+            self.connection.execute("COMMIT")
+        os.remove(pickle_path)
+        logger.info(
+            "Imported %s verified datafiles from %s into %s"
+            % (len(verified_datafiles), pickle_path, self.path)
+        )
+
+    def compact(self):
+        """
+        Checkpoint the write-ahead log, and rebuild the database file
+        if more than a quarter of its pages are unused
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages * 4 > page_count:
+                self.connection.execute("VACUUM")
+
+    def close(self):
+        """
+        Compact and close the cache
+        """
+        try:
+            self.compact()
+        except sqlite3.Error as err:
+            logger.warning("Couldn't compact %s: %s" % (self.path, err))
+        with self.lock:
+            self.connection.close()
+
+
+def verified_datafile_cache_key(dataset_id, datafile_path):
+    """
+    Return the cache key for a datafile, i.e. the dataset ID and
+    a signed 64-bit hash of the datafile's path within the dataset
+    """
+    path_hash = hashlib.blake2b(datafile_path.encode("utf-8"), digest_size=8)
+    return int(dataset_id), int.from_bytes(path_hash.digest(), "big", signed=True)
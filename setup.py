@@ -21,6 +21,11 @@ REQUIRED = [
     "requests-toolbelt>=0.9",
 ]
 
+EXTRAS = {
+    # Required for the SFTP upload method (use_sftp = True in MyData.cfg):
+    "sftp": ["paramiko>=2.6"],
+}
+
 TEST_REQUIRED = [
     "coverage>=4.5",
     "paramiko>=2.6",
@@ -50,7 +55,7 @@ setup(
     url=ABOUT["__url__"],
     packages=find_packages(),
     install_requires=REQUIRED,
-    extras_require={},
+    extras_require=EXTRAS,
     include_package_data=True,
     license=ABOUT["__license__"],
     zip_safe=False,
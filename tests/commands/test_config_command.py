@@ -47,6 +47,7 @@ def test_config_list_command(set_exp_dataset_config):
         max_upload_retries
         validate_folder_structure
         cache_datafile_lookups
+        cache_md5_sums
         ignore_new_files
         """
     )
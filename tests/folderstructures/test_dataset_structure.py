@@ -37,3 +37,23 @@ def test_scan_dataset_folders(set_dataset_config):
 
     assert sorted([folder.name for folder in folders]) == ["Birds", "Flowers"]
     assert sum([folder.num_files for folder in folders]) == 5
+
+
+def test_iter_dataset_folders(set_dataset_config):
+    """Test that dataset folders are yielded as they are found,
+    and their files are only listed on demand.
+    """
+    from mydata.conf import settings
+    from mydata.tasks.folders import iter_folders
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, settings.general.mytardis_url)
+        mock_test_facility_response(mocker, settings.general.mytardis_url)
+        mock_test_instrument_response(mocker, settings.general.mytardis_url)
+
+        folders = iter_folders(None, None, None)
+        folder = next(folders)
+        assert folder.name in ("Birds", "Flowers")
+        assert folder._local_files is None  # pylint: disable=protected-access
+        assert folder.num_files > 0
+        assert len(list(folders)) == 1
@@ -13,8 +13,12 @@ import requests_mock
 from click.testing import CliRunner
 
 from tests.mocks import (
+    build_list_response,
+    VERIFIED_DATAFILE_RESPONSE,
     mock_testfacility_user_response,
+    mock_birds_flowers_datafile_listings,
     mock_birds_flowers_datafile_lookups,
+    mock_datafile_schema,
     created_dataset_response,
     EMPTY_LIST_RESPONSE,
     FLOWERS_DATASET_ID,
@@ -49,6 +53,7 @@ def test_indexing():
     with requests_mock.Mocker() as mocker:
         mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
         mock_birds_flowers_datafile_lookups(mocker)
+        mock_datafile_schema(mocker)
         for folder_name in ("Birds", "Flowers"):
             folder_path = os.path.join(env["MYTARDIS_STORAGE_BOX_PATH"], folder_name)
 
@@ -150,6 +155,434 @@ def test_indexing():
             )
 
 
+def test_indexing_folders_concurrently():
+    """
+    Test indexing several folders at once, sharing one indexing pipeline
+    """
+    from mydata.commands.index import index_cmd
+
+    env = dict(
+        MYTARDIS_URL="https://www.example.com",
+        MYTARDIS_USERNAME="testfacility",
+        MYTARDIS_API_KEY="mock_api_key",
+        MYTARDIS_STORAGE_BOX_PATH=os.path.abspath(
+            os.path.join(".", "tests", "testdata", "testdata-dataset")
+        ),
+        MYTARDIS_STORAGE_BOX_NAME="storage-box1",
+        MYTARDIS_SRC_PATH=os.path.abspath(
+            os.path.join(".", "tests", "testdata", "testdata-dataset")
+        ),
+        MYTARDIS_EXP_ID="123",
+        MYDATA_INDEX_LOOKUP_THREADS="2",
+        MYDATA_INDEX_FOLDER_THREADS="2",
+    )
+
+    runner = CliRunner()
+
+    dataset_ids = dict(Birds=BIRDS_DATASET_ID, Flowers=FLOWERS_DATASET_ID)
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
+        mock_birds_flowers_datafile_lookups(mocker)
+        mock_birds_flowers_datafile_listings(mocker)
+        mock_datafile_schema(mocker)
+        for folder_name in ("Birds", "Flowers"):
+            get_dataset_url = (
+                "%s/api/v1/dataset/?format=json&experiments__id=123" "&description=%s"
+            ) % (env["MYTARDIS_URL"], quote(folder_name))
+            mocker.get(
+                get_dataset_url,
+                text=build_list_response(
+                    [dict(id=dataset_ids[folder_name], description=folder_name)]
+                ),
+            )
+        mocker.post(
+            "%s/api/v1/dataset_file/" % env["MYTARDIS_URL"],
+            status_code=201,
+            headers=dict(Location="/api/v1/dataset_file/123456"),
+        )
+
+        folder_paths = [
+            os.path.join(env["MYTARDIS_STORAGE_BOX_PATH"], folder_name)
+            for folder_name in ("Birds", "Flowers")
+        ]
+        result = runner.invoke(index_cmd, folder_paths, env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "4 of 5 files have been indexed by MyTardis." in result.output
+        assert "2 of 5 files have been verified by MyTardis." in result.output
+        assert "2 of 5 files were newly indexed in this session." in result.output
+
+        # The Flowers dataset's existing datafiles were listed (in two pages),
+        # so they didn't need to be looked up individually:
+        assert [
+            request for request in mocker.request_history if "offset=2" in request.url
+        ]
+        assert not [
+            request
+            for request in mocker.request_history
+            if "dataset__id=%s&filename=" % FLOWERS_DATASET_ID in request.url
+        ]
+
+
+def test_indexing_in_bulk():
+    """
+    Test creating DataFile records in bulk, when the MyTardis server
+    supports it
+    """
+    from mydata.commands.index import index_cmd
+
+    env = dict(
+        MYTARDIS_URL="https://www.example.com",
+        MYTARDIS_USERNAME="testfacility",
+        MYTARDIS_API_KEY="mock_api_key",
+        MYTARDIS_STORAGE_BOX_PATH=os.path.abspath(
+            os.path.join(".", "tests", "testdata", "testdata-dataset")
+        ),
+        MYTARDIS_STORAGE_BOX_NAME="storage-box1",
+        MYTARDIS_SRC_PATH=os.path.abspath(
+            os.path.join(".", "tests", "testdata", "testdata-dataset")
+        ),
+        MYTARDIS_EXP_ID="123",
+    )
+
+    runner = CliRunner()
+
+    dataset_ids = dict(Birds=BIRDS_DATASET_ID, Flowers=FLOWERS_DATASET_ID)
+
+    def created_datafiles(request, context):
+        context.status_code = 202
+        return dict(
+            objects=[
+                dict(resource_uri="/api/v1/dataset_file/%s/" % datafile["filename"])
+                for datafile in request.json()["objects"]
+            ]
+        )
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
+        mock_birds_flowers_datafile_lookups(mocker)
+        mock_birds_flowers_datafile_listings(mocker)
+        mock_datafile_schema(mocker, bulk_create=True)
+        for folder_name in ("Birds", "Flowers"):
+            get_dataset_url = (
+                "%s/api/v1/dataset/?format=json&experiments__id=123" "&description=%s"
+            ) % (env["MYTARDIS_URL"], quote(folder_name))
+            mocker.get(
+                get_dataset_url,
+                text=build_list_response(
+                    [dict(id=dataset_ids[folder_name], description=folder_name)]
+                ),
+            )
+        datafile_url = "%s/api/v1/dataset_file/" % env["MYTARDIS_URL"]
+        patch_datafiles = mocker.patch(datafile_url, json=created_datafiles)
+        post_datafile = mocker.post(datafile_url, status_code=201)
+
+        folder_paths = [
+            os.path.join(env["MYTARDIS_STORAGE_BOX_PATH"], folder_name)
+            for folder_name in ("Birds", "Flowers")
+        ]
+        result = runner.invoke(index_cmd, folder_paths, env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert not post_datafile.called
+        created = [
+            datafile["filename"]
+            for request in patch_datafiles.request_history
+            for datafile in request.json()["objects"]
+        ]
+        assert sorted(created) == [
+            "1024px-Australian_Birds_@_Jurong_Bird_Park_(4374195521).jpg",
+            "Pond_Water_Hyacinth_Flowers.jpg",
+        ]
+        resource_uri = "/api/v1/dataset_file/Pond_Water_Hyacinth_Flowers.jpg/"
+        assert "Created DataFile record: %s\n" % resource_uri in result.output
+        assert "2 of 5 files were newly indexed in this session." in result.output
+
+        # The created records aren't returned unless the server's DataFile
+        # resource is configured with always_return_data:
+        mocker.patch(datafile_url, status_code=202)
+        result = runner.invoke(index_cmd, folder_paths, env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Created DataFile record.\n" in result.output
+        assert "2 of 5 files were newly indexed in this session." in result.output
+
+        # If the bulk request is rejected, the records are created individually:
+        mocker.patch(datafile_url, status_code=400)
+        post_datafile = mocker.post(
+            datafile_url,
+            status_code=201,
+            headers=dict(Location="/api/v1/dataset_file/123456"),
+        )
+        result = runner.invoke(index_cmd, folder_paths, env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert post_datafile.call_count == 2
+        assert "Created DataFile record: /api/v1/dataset_file/123456\n" in result.output
+        assert "2 of 5 files were newly indexed in this session." in result.output
+
+        mocker.post(datafile_url, status_code=400)
+        result = runner.invoke(index_cmd, folder_paths, env=env, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Failed to create DataFile record.  Skipping for now." in result.output
+        assert "0 of 5 files were newly indexed in this session." in result.output
+
+
+def test_indexing_after_partial_bulk_creation(monkeypatch):
+    """
+    Test that if a bulk request fails after creating some of its DataFile
+    records, only the records which weren't created are created individually
+    """
+    from concurrent.futures import Future
+
+    from mydata.indexing.models.datafile import DataFileCreationStatus
+    from mydata.indexing.models.lookup import Lookup, LookupStatus
+    from mydata.tasks.indexing import IndexingPipeline
+
+    monkeypatch.setenv("MYTARDIS_URL", "https://www.example.com")
+
+    filenames = ["file%s.txt" % index for index in range(4)]
+    batch = [
+        (
+            Future(),
+            Lookup(FLOWERS_DATASET_ID, "", filename, LookupStatus.NOT_FOUND),
+            FLOWERS_DATASET_ID,
+            dict(
+                dataset="/api/v1/dataset/%s/" % FLOWERS_DATASET_ID,
+                filename=filename,
+                directory="",
+            ),
+        )
+        for filename in filenames
+    ]
+
+    def lookup_url(filename):
+        return "/api/v1/dataset_file/?format=json&dataset__id=%s&filename=%s" % (
+            FLOWERS_DATASET_ID,
+            filename,
+        )
+
+    with requests_mock.Mocker() as mocker:
+        for filename in filenames:
+            mocker.get(lookup_url(filename), text=EMPTY_LIST_RESPONSE)
+
+        def partially_created(request, context):
+            # Tastypie doesn't roll back the records created before an error:
+            for datafile in request.json()["objects"][:2]:
+                mocker.get(
+                    lookup_url(datafile["filename"]),
+                    text=VERIFIED_DATAFILE_RESPONSE.replace(
+                        "Verified File", datafile["filename"]
+                    ),
+                )
+            context.status_code = 500
+            return ""
+
+        datafile_url = "https://www.example.com/api/v1/dataset_file/"
+        mocker.patch(datafile_url, text=partially_created)
+        post_datafile = mocker.post(
+            datafile_url,
+            status_code=201,
+            headers=dict(Location="/api/v1/dataset_file/123456"),
+        )
+
+        pipeline = IndexingPipeline()
+        pipeline.create_batch(batch)
+        results = [result.result() for result, _, _, _ in batch]
+        pipeline.shutdown()
+
+    posted = [request.json()["filename"] for request in post_datafile.request_history]
+    assert sorted(posted) == filenames[2:]
+    for lookup, datafile_dict, datafile_creation in results[:2]:
+        assert lookup.status == LookupStatus.FOUND_VERIFIED
+        assert datafile_dict is None and datafile_creation is None
+    for lookup, datafile_dict, datafile_creation in results[2:]:
+        assert lookup.status == LookupStatus.NOT_FOUND
+        assert datafile_creation.status == DataFileCreationStatus.COMPLETED
+
+
+def test_indexing_incrementally():
+    """
+    Test skipping files which were recorded in the index manifest as verified,
+    unless they have changed since
+    """
+    import json
+    import shutil
+    import sqlite3
+    import tempfile
+
+    from mydata.commands.index import index_cmd
+
+    temp_dir = tempfile.mkdtemp()
+    storage_box_path = os.path.join(temp_dir, "storage-box1")
+    shutil.copytree(
+        os.path.join(".", "tests", "testdata", "testdata-dataset", "Flowers"),
+        os.path.join(storage_box_path, "Flowers"),
+    )
+    folder_path = os.path.join(storage_box_path, "Flowers")
+    env = dict(
+        MYTARDIS_URL="https://www.example.com",
+        MYTARDIS_USERNAME="testfacility",
+        MYTARDIS_API_KEY="mock_api_key",
+        MYTARDIS_STORAGE_BOX_PATH=storage_box_path,
+        MYTARDIS_STORAGE_BOX_NAME="storage-box1",
+        MYTARDIS_SRC_PATH=storage_box_path,
+        MYTARDIS_EXP_ID="123",
+        MYDATA_INDEX_MANIFEST_PATH=os.path.join(temp_dir, "index-manifest.db"),
+    )
+
+    runner = CliRunner()
+
+    def datafile_requests(mocker):
+        return [
+            request
+            for request in mocker.request_history
+            if "/api/v1/dataset_file/" in request.url
+        ]
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
+        mock_birds_flowers_datafile_lookups(mocker)
+        mock_birds_flowers_datafile_listings(mocker)
+        mock_datafile_schema(mocker)
+        get_dataset_url = (
+            "%s/api/v1/dataset/?format=json&experiments__id=123&description=Flowers"
+            % env["MYTARDIS_URL"]
+        )
+        mocker.get(
+            get_dataset_url,
+            text=build_list_response(
+                [dict(id=FLOWERS_DATASET_ID, description="Flowers")]
+            ),
+        )
+        mocker.post(
+            "%s/api/v1/dataset_file/" % env["MYTARDIS_URL"],
+            status_code=201,
+            headers=dict(Location="/api/v1/dataset_file/123456"),
+        )
+
+        # Two of the files are verified, so they are recorded in the manifest:
+        result = runner.invoke(
+            index_cmd, [folder_path], env=env, catch_exceptions=False
+        )
+        assert result.exit_code == 0
+        assert "1 of 3 files were newly indexed in this session." in result.output
+
+        # Now all of the files have been verified:
+        listing = json.loads(
+            build_list_response(
+                [
+                    dict(
+                        json.loads(VERIFIED_DATAFILE_RESPONSE)["objects"][0],
+                        filename=filename,
+                    )
+                    for filename in sorted(os.listdir(folder_path))
+                ]
+            )
+        )
+        mocker.get(
+            "/api/v1/dataset_file/?format=json&dataset__id=%s&limit=1000"
+            % FLOWERS_DATASET_ID,
+            text=json.dumps(listing),
+        )
+        result = runner.invoke(
+            index_cmd, [folder_path], env=env, catch_exceptions=False
+        )
+        assert result.exit_code == 0
+        assert result.output.count("File path:") == 1
+        assert "3 of 3 files have been verified by MyTardis." in result.output
+
+        # The files haven't changed since they were verified,
+        # so no datafile lookups are needed:
+        mocker.reset_mock()
+        result = runner.invoke(
+            index_cmd, [folder_path], env=env, catch_exceptions=False
+        )
+        assert result.exit_code == 0
+        assert "File path:" not in result.output
+        assert "3 of 3 files have been verified by MyTardis." in result.output
+        assert not datafile_requests(mocker)
+
+        # A modified file needs to be looked up again, individually if the
+        # dataset's datafiles can't be listed:
+        modified_file = os.path.join(folder_path, "Pond_Water_Hyacinth_Flowers.jpg")
+        with open(modified_file, "ab") as datafile:
+            datafile.write(b"modified")
+        mocker.get(
+            "/api/v1/dataset_file/?format=json&dataset__id=%s&limit=1000"
+            % FLOWERS_DATASET_ID,
+            status_code=500,
+        )
+        mocker.get(
+            "/api/v1/dataset_file/?format=json&dataset__id=%s&filename=%s"
+            % (FLOWERS_DATASET_ID, quote("Pond_Water_Hyacinth_Flowers.jpg")),
+            text=VERIFIED_DATAFILE_RESPONSE.replace(
+                "Verified File", "Pond_Water_Hyacinth_Flowers.jpg"
+            ),
+        )
+        mocker.reset_mock()
+        result = runner.invoke(
+            index_cmd, [folder_path], env=env, catch_exceptions=False
+        )
+        assert result.exit_code == 0
+        assert result.output.count("File path:") == 1
+        assert "File path: %s" % modified_file in result.output
+        assert "3 of 3 files have been verified by MyTardis." in result.output
+        assert datafile_requests(mocker)
+
+    # The DataFile ID found by the individual lookup is recorded:
+    connection = sqlite3.connect(env["MYDATA_INDEX_MANIFEST_PATH"])
+    assert connection.execute(
+        "SELECT datafile_id FROM indexed_files WHERE relpath = ?",
+        ("Pond_Water_Hyacinth_Flowers.jpg",),
+    ).fetchone() == (290386,)
+    connection.close()
+
+    shutil.rmtree(temp_dir)
+
+
+def test_indexing_closes_databases_on_error():
+    """
+    Test that the index manifest is closed if indexing a folder fails
+    """
+    import shutil
+    import tempfile
+
+    from requests.exceptions import HTTPError
+
+    from mydata.commands.index import index_cmd
+    from mydata.indexing.manifest import INDEX_MANIFESTS
+
+    temp_dir = tempfile.mkdtemp()
+    storage_box_path = os.path.abspath(
+        os.path.join(".", "tests", "testdata", "testdata-dataset")
+    )
+    env = dict(
+        MYTARDIS_URL="https://www.example.com",
+        MYTARDIS_USERNAME="testfacility",
+        MYTARDIS_API_KEY="mock_api_key",
+        MYTARDIS_STORAGE_BOX_PATH=storage_box_path,
+        MYTARDIS_STORAGE_BOX_NAME="storage-box1",
+        MYTARDIS_SRC_PATH=storage_box_path,
+        MYTARDIS_EXP_ID="123",
+        MYDATA_INDEX_MANIFEST_PATH=os.path.join(temp_dir, "index-manifest.db"),
+    )
+
+    runner = CliRunner()
+
+    with requests_mock.Mocker() as mocker:
+        mock_testfacility_user_response(mocker, env["MYTARDIS_URL"])
+        get_dataset_url = (
+            "%s/api/v1/dataset/?format=json&experiments__id=123&description=Flowers"
+            % env["MYTARDIS_URL"]
+        )
+        mocker.get(get_dataset_url, status_code=500)
+        result = runner.invoke(
+            index_cmd, [os.path.join(storage_box_path, "Flowers")], env=env
+        )
+        assert isinstance(result.exception, HTTPError)
+        assert not INDEX_MANIFESTS
+
+    shutil.rmtree(temp_dir)
+
+
 def test_indexing_missing_settings():
     """
     Test attempt to run indexing without providing settings
@@ -185,3 +618,55 @@ def test_indexing_missing_settings():
         Set a data source path with MYTARDIS_SRC_PATH
     """
     )
+
+
+def test_indexing_checksums(monkeypatch):
+    """
+    Test calculating checksums in-process for indexing, with and without
+    memory-mapping the files
+    """
+    import hashlib
+
+    from mydata.tasks.indexing import calculate_md5sum
+
+    monkeypatch.delenv("MYDATA_FILE_STATES_PATH", raising=False)
+    folder_path = os.path.join(".", "tests", "testdata", "testdata-dataset", "Birds")
+    filepath = os.path.join(folder_path, "Black-beaked-sea-bird-close-up.jpg")
+    with open(filepath, "rb") as datafile:
+        expected_md5sum = hashlib.md5(datafile.read()).hexdigest()
+
+    monkeypatch.delenv("MYDATA_HASH_WITH_MMAP", raising=False)
+    assert calculate_md5sum(filepath) == expected_md5sum
+    monkeypatch.setenv("MYDATA_HASH_WITH_MMAP", "1")
+    assert calculate_md5sum(filepath) == expected_md5sum
+
+
+def test_indexing_invalid_thread_counts():
+    """
+    Test attempt to run indexing with an invalid number of threads
+    """
+    from mydata.commands.index import index_cmd
+
+    env = dict(
+        MYTARDIS_URL="https://www.example.com",
+        MYTARDIS_USERNAME="testfacility",
+        MYTARDIS_API_KEY="mock_api_key",
+        MYTARDIS_STORAGE_BOX_PATH=os.path.abspath("."),
+        MYTARDIS_STORAGE_BOX_NAME="storage-box1",
+        MYTARDIS_SRC_PATH=os.path.abspath("."),
+        MYTARDIS_EXP_ID="123",
+        MYDATA_INDEX_LOOKUP_THREADS="0",
+        MYDATA_INDEX_HASHING_THREADS="four",
+    )
+    runner = CliRunner()
+    result = runner.invoke(index_cmd, ["."], env=env, catch_exceptions=False)
+    assert result.exit_code == 1
+    assert result.output.endswith(
+        textwrap.dedent(
+            """\
+        Invalid parameter(s):
+        MYDATA_INDEX_LOOKUP_THREADS should be a positive integer
+        MYDATA_INDEX_HASHING_THREADS should be a positive integer
+    """
+        )
+    )
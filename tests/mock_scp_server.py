@@ -36,6 +36,7 @@ using a Cygwin build of scp from a Windows command prompt:
 import base64
 import socketserver
 import sys
+import threading
 import traceback
 import subprocess
 import time
@@ -51,6 +52,8 @@ from paramiko.common import cMSG_CHANNEL_WINDOW_ADJUST
 
 import mydata.utils.openssh as OpenSSH
 
+from tests.mock_sftp_server import StubSftpServer
+
 # setup logging
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 logger.setLevel(logging.INFO)
@@ -81,7 +84,11 @@ class SshServerInterface(paramiko.ServerInterface):
     """
 
     def __init__(self):
-        self.command = None
+        # Remote commands, keyed by channel ID.  An OpenSSH client using
+        # ControlMaster can open multiple channels over one transport:
+        self.commands = dict()
+        # IDs of channels running a subsystem (SFTP), rather than a command:
+        self.subsystem_channels = set()
         key_pair = OpenSSH.find_key_pair("MyDataTest")
         # Remove "ssh-rsa " and "MyDataTest key":
         data = key_pair.public_key.split(" ")[1]
@@ -99,9 +106,16 @@ class SshServerInterface(paramiko.ServerInterface):
         """
         See http://docs.paramiko.org/en/1.15/api/server.html
         """
-        self.command = command
+        self.commands[channel.get_id()] = command
         return True
 
+    def check_channel_subsystem_request(self, channel, name):
+        """
+        See http://docs.paramiko.org/en/1.15/api/server.html
+        """
+        self.subsystem_channels.add(channel.get_id())
+        return super().check_channel_subsystem_request(channel, name)
+
     def check_auth_password(self, username, password):
         """
         See http://docs.paramiko.org/en/1.15/api/server.html
@@ -175,6 +189,30 @@ DEFAULT_HOST_KEY = paramiko.RSAKey.from_private_key(
 )
 
 
+class ScpState:
+    """
+    Details of a file being received by SCP on one channel.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.verbose = True
+        # modified: Only populated if scp client uses "-p".
+        self.modified = None
+        # accessed: Only populated if scp client uses "-p".
+        self.accessed = None
+        # transfer_type: C for single file copy or
+        #                D for recursive directory copy.
+        self.transfer_type = None
+        # file_mode: POSIX permissions, e.g. 0644
+        self.file_mode = None
+        # file_size: File size in bytes
+        self.file_size = None
+        # file_name: File name
+        self.file_name = None
+
+
 class SshRequestHandler(socketserver.BaseRequestHandler):
     """
     Handles a client address and creates a paramiko
@@ -196,42 +234,30 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
         self.timeout = 60
         self.auth_timeout = 60
 
-        self.chan = None
         self.server_instance = None
         self.client = None
         self.transport = None
 
-        # These are used for SCP only:
-        self.verbose = True
-        # modified: Only populated if scp client uses "-p".
-        self.modified = None
-        # accessed: Only populated if scp client uses "-p".
-        self.accessed = None
-        # transfer_type: C for single file copy or
-        #                D for recursive directory copy.
-        self.transfer_type = None
-        # file_mode: POSIX permissions, e.g. 0644
-        self.file_mode = None
-        # file_size: File size in bytes
-        self.file_size = None
-        # file_name: File name
-        self.file_name = None
-
     def setup(self):
         """
         Creates the SSH transport. Sets security options.
         """
         self.transport = paramiko.Transport(self.request)
         self.transport.add_server_key(self.server.host_key)
+        self.transport.set_subsystem_handler(
+            "sftp", paramiko.SFTPServer, StubSftpServer
+        )
 
     def handle(self):
         """
         Start the paramiko server, this will start a thread to handle
         the connection.
+
+        An OpenSSH client using ControlMaster can run multiple remote
+        commands concurrently over one connection, each with its own
+        channel, so each channel is handled in a separate thread, until
+        the client closes the connection.
         """
-        # pylint: disable=too-many-statements
-        # pylint: disable=too-many-branches
-        # pylint: disable=too-many-return-statements
         if SshRequestHandler.NEED_TO_ABORT:
             return
 
@@ -248,21 +274,40 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
 
         logger.debug("Got a connection!")
 
-        try:
-            # wait for auth
-            self.chan = self.transport.accept(20)
-            if self.chan is None:
-                logger.error("*** No channel.")
-                self.close_transport(success=False)
+        channel_threads = []
+        while self.transport.is_active():
+            if SshRequestHandler.NEED_TO_ABORT:
                 return
+            chan = self.transport.accept(0.1)
+            if chan is None:
+                continue
             logger.info("Authenticated!")
+            thread = threading.Thread(
+                target=self.handle_channel, args=(chan,), daemon=True
+            )
+            channel_threads.append(thread)
+            thread.start()
+        for thread in channel_threads:
+            thread.join()
 
+    def handle_channel(self, chan):
+        """
+        Run the remote command requested for one channel.
+        """
+        # pylint: disable=too-many-statements
+        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-return-statements
+        scp = ScpState()
+        try:
             # Wait for the SSH/SCP client to provide a "remote" command.
             # (to be run locally when running a test server on 127.0.0.1).
             count = 0
-            while not self.server_instance.command:
+            while not self.server_instance.commands.get(chan.get_id()):
                 if SshRequestHandler.NEED_TO_ABORT:
                     return
+                if chan.get_id() in self.server_instance.subsystem_channels:
+                    # Handled by the subsystem's own thread (see setup):
+                    return
                 time.sleep(0.01)
                 count += 1
                 if count > 100:
@@ -271,21 +316,20 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                         "Please provide a command to be executed.\n\n"
                     )
                     logger.error(message)
-                    self.chan.send_stderr(message)
-                    self.chan.send_exit_status(1)
-                    self.chan.close()
-                    self.close_transport(success=False)
+                    chan.send_stderr(message)
+                    chan.send_exit_status(1)
+                    chan.close()
                     return
 
-            command = self.server_instance.command.decode()
+            command = self.server_instance.commands[chan.get_id()].decode()
             if sys.platform.startswith("win"):
                 # Use bundled Cygwin binaries for these commands:
                 if command.startswith("mkdir") and sys.platform.startswith("win"):
                     command = command.replace("mkdir", OpenSSH.OPENSSH.mkdir)
                 if command.startswith("chmod") and sys.platform.startswith("win"):
                     logger.warning("Ignoring chmod request on Windows.")
-                    self.chan.send_exit_status(0)
-                    self.chan.close()
+                    chan.send_exit_status(0)
+                    chan.close()
                     return
 
                 if command.startswith("cat"):
@@ -298,23 +342,31 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                 logger.info("Executing: %s", command)
                 proc = subprocess.Popen(
                     command,
+                    stdin=subprocess.PIPE,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.STDOUT,
                     shell=True,
                 )
+                # Pass any input (e.g. a tar stream) to the command,
+                # until the client sends EOF:
+                while True:
+                    data = chan.recv(32768)
+                    if not data:
+                        break
+                    proc.stdin.write(data)
                 stdout, _ = proc.communicate()
-                self.chan.send(stdout)
+                chan.send(stdout)
                 logger.info("Closing channel.")
-                # self.chan.send_exit_status(proc.returncode)
-                self.chan.send_exit_status(0)
-                self.chan.close()
+                # chan.send_exit_status(proc.returncode)
+                chan.send_exit_status(0)
+                chan.close()
                 return
 
             if "scp" in command:
-                self.verbose = "-v" in command.split(" ")
-                if self.verbose:
+                scp.verbose = "-v" in command.split(" ")
+                if scp.verbose:
                     logger.info("Executing: %s", command)
-                stderr_handle = subprocess.PIPE if self.verbose else None
+                stderr_handle = subprocess.PIPE if scp.verbose else None
                 proc = subprocess.Popen(
                     command,
                     stdin=subprocess.PIPE,
@@ -329,7 +381,7 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                 )
                 response = proc.stdout.read(1)
                 assert response == b"\0"
-                self.chan.send(response)
+                chan.send(response)
 
                 def read_protocol_messages():
                     """
@@ -349,16 +401,16 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                     using proc.stdin.write().
                     """
                     # pylint: disable=too-many-statements
-                    while not self.chan.recv_ready():
+                    while not chan.recv_ready():
                         if SshRequestHandler.NEED_TO_ABORT:
                             return
                         time.sleep(0.01)
                     try:
                         buf = ""
-                        while self.chan.recv_ready():
+                        while chan.recv_ready():
                             if SshRequestHandler.NEED_TO_ABORT:
                                 return
-                            char = self.chan.recv(1)
+                            char = chan.recv(1)
                             proc.stdin.write(char)
                             proc.stdin.flush()
                             if char == b"\n":
@@ -368,14 +420,14 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                         if match1:
                             logger.info("Received timestamps string: %s", buf)
                             # Acknowledge receipt of timestamps.
-                            self.chan.send(b"\0")
-                            self.modified = match1.group(1)
-                            self.accessed = match1.group(2)
+                            chan.send(b"\0")
+                            scp.modified = match1.group(1)
+                            scp.accessed = match1.group(2)
                             buf = ""
-                            while self.chan.recv_ready():
+                            while chan.recv_ready():
                                 if SshRequestHandler.NEED_TO_ABORT:
                                     return
-                                char = self.chan.recv(1)
+                                char = chan.recv(1)
                                 proc.stdin.write(char)
                                 proc.stdin.flush()
                                 if char == b"\n":
@@ -389,17 +441,17 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                             logger.info(
                                 "Received file mode/size/filename " "string: %s", buf
                             )
-                            self.transfer_type = match2.group(1)
-                            self.file_mode = match2.group(2)
-                            self.file_size = int(match2.group(3))
-                            self.file_name = match2.group(4)
+                            scp.transfer_type = match2.group(1)
+                            scp.file_mode = match2.group(2)
+                            scp.file_size = int(match2.group(3))
+                            scp.file_name = match2.group(4)
                             logger.info(
                                 "Waiting for the 'scp -t' process "
                                 "to acknowledge protocol messages."
                             )
                             response = proc.stdout.read(1)
                             assert response == b"\0"
-                            self.chan.send(response)
+                            chan.send(response)
                         else:
                             raise Exception("Unknown message format: %s" % buf)
                     except Exception:  # pylint: disable=broad-except
@@ -421,9 +473,9 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                     """
                     msg = Message()
                     msg.add_byte(cMSG_CHANNEL_WINDOW_ADJUST)
-                    msg.add_int(self.chan.get_id())
+                    msg.add_int(chan.get_id())
                     # This is a bit arbitrary:
-                    window_size = min(2 * self.file_size, 10000000)
+                    window_size = min(2 * scp.file_size, 10000000)
                     msg.add_int(window_size)
                     # pylint: disable=protected-access
                     self.transport._send_user_message(msg)
@@ -434,20 +486,25 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                     and write it into the "scp -t" subprocess
                     """
                     try:
-                        while not self.chan.recv_ready():
+                        while not chan.recv_ready():
                             if SshRequestHandler.NEED_TO_ABORT:
                                 return
                             time.sleep(0.01)
 
+                        # The file content is followed by a null byte,
+                        # so we read exactly file_size + 1 bytes, rather
+                        # than relying on the size of each chunk received.
                         chunk_size = 1024
-                        while True:
+                        remaining = scp.file_size + 1
+                        while remaining > 0:
                             if SshRequestHandler.NEED_TO_ABORT:
                                 return
-                            chunk = self.chan.recv(chunk_size)
+                            chunk = chan.recv(min(chunk_size, remaining))
+                            if not chunk:
+                                break
                             proc.stdin.write(chunk)
                             proc.stdin.flush()
-                            if len(chunk) < chunk_size:
-                                break
+                            remaining -= len(chunk)
                     except Exception:  # pylint: disable=broad-except
                         logger.error("read_file_content error.")
                         logger.error(traceback.format_exc())
@@ -482,36 +539,33 @@ class SshRequestHandler(socketserver.BaseRequestHandler):
                 if SshRequestHandler.NEED_TO_ABORT:
                     return
                 assert response == b"\0"
-                self.chan.send(response)
-
-                if SshRequestHandler.NEED_TO_ABORT:
-                    return
-                # Tell the SCP client that the progress meter has been stopped,
-                # so it can report the output to the user.
-                self.chan.send(b"\n")
-                if SshRequestHandler.NEED_TO_ABORT:
-                    return
+                chan.send(response)
 
+                # The SCP client doesn't expect anything else on the channel
+                # after that acknowledgement, just the exit status.  Sending
+                # anything else can cause the client to close the channel
+                # before receiving the exit status:
                 if not proc.returncode:
                     logger.info("Waiting for 'scp -t' process to finish running.")
                     stdout, _ = proc.communicate()
                 logger.info("scp -t exit code = %s", str(proc.returncode))
                 if SshRequestHandler.NEED_TO_ABORT:
                     return
-                # 'E' means 'end' in the SCP protocol:
-                self.chan.send(b"E\n\0")
-                if SshRequestHandler.NEED_TO_ABORT:
-                    return
-                self.chan.send_exit_status(proc.returncode)
+                chan.send_exit_status(proc.returncode)
                 if SshRequestHandler.NEED_TO_ABORT:
                     return
                 # Closing channel too quickly after sending exit status can
                 # sometimes lead to "Connection reset by peer" errors.
                 time.sleep(0.05)
-                self.chan.close()
+                chan.close()
                 logger.info("")
-                self.close_transport(success=True)
         except Exception as err:  # pylint: disable=broad-except
+            if chan.closed and self.transport.is_active():
+                # The client closed this channel before we finished with it,
+                # but other channels (multiplexed over the same connection)
+                # could still be in use, so don't close the transport:
+                logger.info("Channel closed by client: %s", str(err))
+                return
             # pylint: disable=logging-not-lazy
             logger.error(
                 "*** Caught exception: " + str(err.__class__) + ": " + str(err)
@@ -561,6 +615,10 @@ class ThreadedSshServer(ThreadedTCPServer):
     # "port in use" error.
     allow_reuse_address = True
 
+    # Don't wait for connections which are being kept open by
+    # an SSH ControlMaster when shutting down:
+    daemon_threads = True
+
     def __init__(self, address):
         self.host_key = DEFAULT_HOST_KEY
         # pylint: disable=non-parent-init-called
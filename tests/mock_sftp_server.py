@@ -0,0 +1,166 @@
+"""
+mock_sftp_server.py
+
+SFTP subsystem for the local SSH/SCP server used for testing
+(see tests/mock_scp_server.py), serving the local filesystem.
+
+Based on the stub SFTP server in paramiko's test suite.
+"""
+# pylint: disable=unused-argument
+import os
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+
+class StubSftpHandle(SFTPHandle):
+    """
+    Handle for an open local file
+    """
+
+    def stat(self):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def chattr(self, attr):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return paramiko.SFTP_OK
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+
+class StubSftpServer(SFTPServerInterface):
+    """
+    SFTP server interface which serves the local filesystem
+    """
+
+    def list_folder(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            attrs = []
+            for filename in os.listdir(path):
+                attr = SFTPAttributes.from_stat(
+                    os.stat(os.path.join(path, filename))
+                )
+                attr.filename = filename
+                attrs.append(attr)
+            return attrs
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def stat(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def lstat(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def open(self, path, flags, attr):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            binary_flag = getattr(os, "O_BINARY", 0)
+            flags |= binary_flag
+            mode = getattr(attr, "st_mode", None) or 0o666
+            fd = os.open(path, flags, mode)  # pylint: disable=invalid-name
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        if (flags & os.O_CREAT) and (attr is not None):
+            attr._flags &= ~attr.FLAG_PERMISSIONS  # pylint: disable=protected-access
+            SFTPServer.set_file_attr(path, attr)
+        if flags & os.O_WRONLY:
+            fstr = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fstr = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fstr = "rb"
+        try:
+            local_file = os.fdopen(fd, fstr)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        handle = StubSftpHandle(flags)
+        handle.filename = path
+        handle.readfile = local_file
+        handle.writefile = local_file
+        return handle
+
+    def remove(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            os.remove(path)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            os.mkdir(path)
+            if attr is not None:
+                SFTPServer.set_file_attr(path, attr)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            os.rmdir(path)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        try:
+            SFTPServer.set_file_attr(path, attr)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def canonicalize(self, path):
+        """
+        See http://docs.paramiko.org/en/stable/api/sftp.html
+        """
+        return os.path.normpath(os.path.realpath(path))
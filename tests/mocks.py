@@ -466,6 +466,47 @@ def mock_birds_flowers_datafile_lookups(mocker, api_prefix=""):
     mocker.post(post_datafile_url, status_code=201)
 
 
+def mock_birds_flowers_datafile_listings(mocker):
+    """Mock the paginated lists of the Birds and Flowers datasets' existing
+    datafiles, used by the index command
+    """
+    flowers_datafiles = []
+    for filename in (
+        "1024px-Colourful_flowers.JPG",
+        "Flowers_growing_on_the_campus_of_Cebu_City_National_Science_High_School.jpg",
+    ):
+        datafile = json.loads(VERIFIED_DATAFILE_RESPONSE)["objects"][0]
+        flowers_datafiles.append(dict(datafile, filename=filename))
+    datafile = json.loads(UNVERIFIED_DATAFILE_NO_DFOS_RESPONSE)["objects"][0]
+    flowers_datafiles.append(dict(datafile, filename="Pond_Water_Hyacinth_Flowers.jpg"))
+
+    list_datafiles_url = "/api/v1/dataset_file/?format=json&dataset__id=%s&limit=1000"
+    first_page = json.loads(build_list_response(flowers_datafiles[:2]))
+    first_page["meta"]["total_count"] = 3
+    first_page["meta"]["next"] = "%s&offset=2" % (
+        list_datafiles_url % FLOWERS_DATASET_ID
+    )
+    mocker.get(list_datafiles_url % FLOWERS_DATASET_ID, text=json.dumps(first_page))
+    mocker.get(
+        "%s&offset=2" % (list_datafiles_url % FLOWERS_DATASET_ID),
+        text=build_list_response(flowers_datafiles[2:]),
+    )
+    mocker.get(list_datafiles_url % BIRDS_DATASET_ID, text=EMPTY_LIST_RESPONSE)
+
+
+def mock_datafile_schema(mocker, bulk_create=False):
+    """Mock the schema of the DataFile resource, which determines whether
+    DataFile records can be created in bulk by the index command
+    """
+    allowed_list_http_methods = ["get", "post"]
+    if bulk_create:
+        allowed_list_http_methods.append("patch")
+    mocker.get(
+        "/api/v1/dataset_file/schema/",
+        text=json.dumps(dict(allowed_list_http_methods=allowed_list_http_methods)),
+    )
+
+
 def mock_exp_creation(mocker, settings, title, user_folder_name):
     """Mock the creation of experiments and their ObjectACLs
     """
@@ -0,0 +1,125 @@
+"""
+Test ability to look up a dataset's datafiles in bulk.
+"""
+import copy
+import json
+
+import pytest
+import requests_mock
+
+from tests.fixtures import set_exp_dataset_config
+
+from tests.mocks import VERIFIED_DATAFILE_RESPONSE
+
+
+@pytest.mark.parametrize("path_prefix", ["", "/mytardis"])
+def test_get_datafiles_index(set_exp_dataset_config, path_prefix):
+    """Test paging through a dataset's datafiles to build a datafiles index,
+    including when MyTardis is served under a path prefix
+    """
+    from mydata.conf import settings
+    from mydata.models.dataset import Dataset
+    from mydata.models.datafile import DataFile
+
+    old_mytardis_url = settings.general.mytardis_url
+    settings.general.mytardis_url = old_mytardis_url.rstrip("/") + path_prefix
+
+    dataset = Dataset(dataset_dict=dict(id=1, description="Flowers"))
+
+    datafile_dict = json.loads(VERIFIED_DATAFILE_RESPONSE)["objects"][0]
+    pages = []
+    for page_number, (directory, filename) in enumerate(
+        [("", "file1.txt"), ("subdir", "file1.txt"), ("subdir", "file1.txt")]
+    ):
+        page_dict = json.loads(VERIFIED_DATAFILE_RESPONSE)
+        page_datafile_dict = copy.deepcopy(datafile_dict)
+        page_datafile_dict["id"] = page_number + 1
+        page_datafile_dict["directory"] = directory
+        page_datafile_dict["filename"] = filename
+        page_dict["objects"] = [page_datafile_dict]
+        page_dict["meta"]["limit"] = 1
+        page_dict["meta"]["offset"] = page_number
+        page_dict["meta"]["total_count"] = 3
+        if page_number < 2:
+            page_dict["meta"]["next"] = (
+                "%s/api/v1/mydata_dataset_file/?format=json&dataset__id=1"
+                "&limit=1&offset=%s" % (path_prefix, page_number + 1)
+            )
+        pages.append(page_dict)
+
+    with requests_mock.Mocker() as mocker:
+        get_datafiles_url = (
+            "%s/api/v1/mydata_dataset_file/?format=json&dataset__id=1&limit=1"
+            % settings.general.mytardis_url
+        )
+        mocker.get(get_datafiles_url, text=json.dumps(pages[0]))
+        for offset in (1, 2):
+            mocker.get(
+                "%s&offset=%s" % (get_datafiles_url, offset),
+                text=json.dumps(pages[offset]),
+            )
+        datafiles_index = DataFile.get_datafiles_index(dataset, page_size=1)
+
+    settings.general.mytardis_url = old_mytardis_url
+
+    assert sorted(datafiles_index.keys()) == [
+        ("", "file1.txt"),
+        ("subdir", "file1.txt"),
+    ]
+    assert [datafile.id for datafile in datafiles_index[("", "file1.txt")]] == [1]
+    assert [
+        datafile.id for datafile in datafiles_index[("subdir", "file1.txt")]
+    ] == [2, 3]
+    assert datafiles_index[("", "file1.txt")][0].dataset == dataset
+    assert datafiles_index[("", "file1.txt")][0].replicas[0].verified
+
+
+def test_upload_datafile_with_post(set_exp_dataset_config):
+    """Test calculating a datafile's checksums while uploading it via POST
+    """
+    import hashlib
+    import os
+    import tempfile
+
+    from mydata.conf import settings
+    from mydata.models.datafile import DataFile
+
+    class MockUpload:
+        """Just the Upload attributes used by upload_datafile_with_post
+        """
+
+        filename = "file1.txt"
+        buffered_reader = None
+
+    content = os.urandom(3 * 1024 * 1024 + 123)
+    with tempfile.NamedTemporaryFile() as datafile:
+        datafile.write(content)
+        datafile.flush()
+        upload = MockUpload()
+        upload.file_size = len(content)
+        datafile_dict = dict(
+            dataset="/api/v1/dataset/1/",
+            filename="file1.txt",
+            md5sum=None,
+            sha512sum=None,
+        )
+        with requests_mock.Mocker() as mocker:
+            post_datafile_url = (
+                "%s/api/v1/mydata_dataset_file/" % settings.general.mytardis_url
+            )
+            mocker.post(post_datafile_url, status_code=201)
+            response = DataFile.upload_datafile_with_post(
+                datafile.name, datafile_dict, upload
+            )
+            # requests_mock doesn't read the streamed request body:
+            multipart = mocker.last_request.body
+            body = b"".join(iter(lambda: multipart.read(1024 * 1024), b""))
+        upload.buffered_reader.close()
+
+    assert response.status_code == 201
+    md5sum = hashlib.md5(content).hexdigest()
+    assert datafile_dict["md5sum"] == md5sum
+    assert datafile_dict["sha512sum"] == hashlib.sha512(content).hexdigest()
+    assert content in body
+    # The JSON data (including the checksum) is sent after the file content:
+    assert body.index(content) < body.index(json.dumps(datafile_dict).encode())
@@ -2,6 +2,7 @@
 Test folder model
 """
 import os
+import shutil
 import sys
 import tempfile
 
@@ -111,3 +112,247 @@ def test_folder_model(set_username_dataset_config):
         os.remove(includes_file_path)
     if os.path.exists(excludes_file_path):
         os.remove(excludes_file_path)
+
+
+def test_folder_md5_sums_cache(set_username_dataset_config):
+    """
+    Test that MD5 checksums are only calculated for files which have changed
+    """
+    import hashlib
+
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.user import User
+    from mydata.utils.file_states import close_file_state_indexes
+
+    temp_dir = tempfile.mkdtemp()
+    settings.config_path = os.path.join(temp_dir, "MyData.cfg")
+    settings["cache_md5_sums"] = True
+
+    testuser1 = User(username="testuser1")
+    location = os.path.join(settings.general.data_directory, "testuser1")
+    folder = Folder("Flowers", location, "testuser1", None, testuser1)
+    dfi = [localfile.filename for localfile in folder.local_files].index(
+        "Pond_Water_Hyacinth_Flowers.jpg"
+    )
+    with open(folder.get_datafile_path(dfi), "rb") as datafile:
+        expected_md5sum = hashlib.md5(datafile.read()).hexdigest()
+
+    chunks_hashed = []
+
+    def canceled_cb():
+        chunks_hashed.append(True)
+        return False
+
+    assert folder.calculate_md5_sum(dfi, canceled_cb) == expected_md5sum
+    assert chunks_hashed
+    del chunks_hashed[:]
+    assert folder.calculate_md5_sum(dfi, canceled_cb) == expected_md5sum
+    assert not chunks_hashed
+
+    close_file_state_indexes()
+    assert os.path.exists(settings.file_states_path)
+    os.remove(settings.file_states_path)
+    os.rmdir(temp_dir)
+
+
+def test_folder_stat_results(set_username_dataset_config):
+    """
+    Test that the stat results captured while listing a folder's files
+    (including files in subdirectories) are reused for later queries
+    """
+    from unittest.mock import patch
+
+    from mydata.models.folder import Folder
+    from mydata.models.user import User
+
+    temp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(temp_dir, "Dataset1", "subdir", "subsubdir"))
+    for filename in ("b.txt", "a.txt", "subdir/c.txt", "subdir/subsubdir/d.txt"):
+        with open(os.path.join(temp_dir, "Dataset1", filename), "w") as datafile:
+            datafile.write(filename)
+
+    testuser1 = User(username="testuser1")
+    folder = Folder("Dataset1", temp_dir, "testuser1", None, testuser1)
+    assert [
+        (localfile.directory, localfile.filename) for localfile in folder.local_files
+    ] == [
+        ("", "a.txt"),
+        ("", "b.txt"),
+        ("subdir", "c.txt"),
+        ("subdir/subsubdir", "d.txt"),
+    ]
+    assert not hasattr(folder.local_files[0], "__dict__")
+    assert folder.local_files[0].dirname is folder.local_files[1].dirname
+    assert folder.get_datafile_path(3) == os.path.join(
+        temp_dir, "Dataset1", "subdir", "subsubdir", "d.txt"
+    )
+
+    with patch("os.stat", side_effect=AssertionError("os.stat called")):
+        assert folder.get_datafile_created_time(2)
+        assert folder.get_datafile_modified_time(2)
+        assert not folder.file_is_too_new_to_upload(2)
+
+    # A file's size is checked again before it's uploaded,
+    # in case it has grown since the folder was scanned:
+    with open(folder.get_datafile_path(2), "a") as datafile:
+        datafile.write("more")
+    assert folder.get_datafile_size(2) == len("subdir/c.txtmore")
+
+    shutil.rmtree(temp_dir)
+
+
+def test_pattern_matcher_cache(set_username_dataset_config):
+    """
+    Test that compiled includes / excludes patterns are reused until
+    the patterns file is modified
+    """
+    from mydata.models.folder import get_pattern_matcher
+
+    with tempfile.NamedTemporaryFile("w", delete=False) as patterns_file:
+        patterns_file.write("# Comment\n*.jpg\nzero*\n")
+    patterns_path = patterns_file.name
+
+    matcher = get_pattern_matcher(patterns_path)
+    assert matcher("image.jpg")
+    assert matcher("zero_sized_file.txt")
+    assert not matcher("image.jpg.bak")
+    assert get_pattern_matcher(patterns_path) is matcher
+
+    with open(patterns_path, "w") as patterns_file:
+        patterns_file.write("; Comment\n")
+    stat_result = os.stat(patterns_path)
+    os.utime(patterns_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1))
+    matcher = get_pattern_matcher(patterns_path)
+    assert not matcher("image.jpg")
+
+    os.remove(patterns_path)
+
+
+def test_folder_upload_counts(set_username_dataset_config):
+    """
+    Test that upload and cache hit counts are kept consistent
+    when they are updated concurrently
+    """
+    import threading
+
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.user import User
+
+    testuser1 = User(username="testuser1")
+    location = os.path.join(settings.general.data_directory, "testuser1")
+    folder = Folder("Flowers", location, "testuser1", None, testuser1)
+    assert folder.status == "0 of %d files uploaded" % folder.num_files
+
+    def set_uploaded():
+        for dfi in range(folder.num_files):
+            folder.set_datafile_uploaded(dfi, True)
+            folder.add_cache_hits()
+
+    threads = [threading.Thread(target=set_uploaded) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert folder.num_files_uploaded == folder.num_files
+    assert folder.num_cache_hits == 4 * folder.num_files
+    assert folder.status == "%d of %d files uploaded" % (
+        folder.num_files,
+        folder.num_files,
+    )
+
+    folder.set_datafile_uploaded(0, False)
+    folder.set_datafile_uploaded(0, False)
+    assert folder.num_files_uploaded == folder.num_files - 1
+
+    folder.reset_counts()
+    assert folder.num_files_uploaded == 0
+    assert folder.num_cache_hits == 0
+
+
+def test_prefetch_checksums(set_username_dataset_config):
+    """
+    Test calculating checksums ahead of uploads in hashing threads
+    """
+    import hashlib
+
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.user import User
+    from mydata.utils.hashing import (
+        init_hashing_threads,
+        prefetch_checksums,
+        shutdown_hashing_threads,
+    )
+
+    testuser1 = User(username="testuser1")
+    location = os.path.join(settings.general.data_directory, "testuser1")
+    folder = Folder("Flowers", location, "testuser1", None, testuser1)
+
+    assert prefetch_checksums(folder, 0) is None
+
+    settings["max_hashing_threads"] = 4
+    init_hashing_threads()
+    futures = [prefetch_checksums(folder, dfi) for dfi in range(folder.num_files)]
+    for dfi, future in enumerate(futures):
+        with open(folder.get_datafile_path(dfi), "rb") as datafile:
+            assert future.result() == dict(
+                md5sum=hashlib.md5(datafile.read()).hexdigest()
+            )
+    shutdown_hashing_threads()
+
+    assert prefetch_checksums(folder, 0) is None
+
+
+def test_folder_checksums(set_username_dataset_config):
+    """
+    Test calculating MD5 and SHA-512 checksums in one pass,
+    and caching them in the file state index
+    """
+    import hashlib
+
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.user import User
+    from mydata.utils.file_states import close_file_state_indexes
+    from mydata.utils.hashing import get_hashing_throughput
+
+    temp_dir = tempfile.mkdtemp()
+    settings.config_path = os.path.join(temp_dir, "MyData.cfg")
+    settings["cache_md5_sums"] = True
+    settings["checksum_algorithms"] = "md5, SHA512"
+
+    testuser1 = User(username="testuser1")
+    location = os.path.join(settings.general.data_directory, "testuser1")
+    folder = Folder("Flowers", location, "testuser1", None, testuser1)
+    dfi = [localfile.filename for localfile in folder.local_files].index(
+        "Pond_Water_Hyacinth_Flowers.jpg"
+    )
+    with open(folder.get_datafile_path(dfi), "rb") as datafile:
+        content = datafile.read()
+    expected_checksums = dict(
+        md5sum=hashlib.md5(content).hexdigest(),
+        sha512sum=hashlib.sha512(content).hexdigest(),
+    )
+
+    # The MD5 checksum is cached, but the SHA-512 checksum isn't yet:
+    assert folder.calculate_md5_sum(dfi) == expected_checksums["md5sum"]
+    chunks_hashed = []
+
+    def canceled_cb():
+        chunks_hashed.append(True)
+        return False
+
+    assert folder.calculate_checksums(dfi, canceled_cb) == expected_checksums
+    assert chunks_hashed
+    del chunks_hashed[:]
+    assert folder.calculate_checksums(dfi, canceled_cb) == expected_checksums
+    assert not chunks_hashed
+
+    throughput = get_hashing_throughput()
+    assert throughput["md5"][0] >= 2 * len(content)
+    assert throughput["sha512"][0] >= len(content)
+
+    close_file_state_indexes()
+    shutil.rmtree(temp_dir)
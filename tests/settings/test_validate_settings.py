@@ -55,6 +55,12 @@ def test_validate_settings(set_exp_dataset_config):
         assert "doesn't exist" in str(excinfo.value)
         settings.general.data_directory = old_value
 
+        settings.miscellaneous.checksum_algorithms = "md5,sha1"
+        with pytest.raises(InvalidSettings) as excinfo:
+            validate_settings()
+        assert 'Unsupported checksum algorithm: "sha1"' in str(excinfo.value)
+        settings.miscellaneous.checksum_algorithms = "md5"
+
         old_value = settings.general.instrument_name
         old_value = settings.general.instrument_name
         settings.general.instrument_name = ""
@@ -0,0 +1,106 @@
+"""
+test_verified_datafiles_cache.py
+
+Tests for caching DataFile lookup results on disk
+"""
+import os
+import pickle
+import shutil
+import tempfile
+
+from tests.fixtures import set_exp_dataset_config
+
+
+def test_verified_datafiles_cache(set_exp_dataset_config):
+    """Test importing a pickled cache and persisting new cache keys
+    """
+    from mydata.conf import settings
+    from mydata.utils.verified_cache import verified_datafile_cache_key
+
+    temp_dir = tempfile.mkdtemp()
+    settings.config_path = os.path.join(temp_dir, "MyData.cfg")
+
+    with open(settings.pickled_verified_datafiles_cache_path, "wb") as cache_file:
+        pickle.dump({"1,file1.txt": True, "1,subdir/file2.txt": True}, cache_file)
+
+    settings.initialize_verified_datafiles_cache()
+    assert not os.path.exists(settings.pickled_verified_datafiles_cache_path)
+    assert len(settings.verified_datafiles_cache) == 2
+    cache = settings.verified_datafiles_cache
+    assert verified_datafile_cache_key(1, "file1.txt") in cache
+    assert verified_datafile_cache_key(1, "subdir/file2.txt") in cache
+    assert verified_datafile_cache_key(2, "file1.txt") not in cache
+    assert verified_datafile_cache_key(1, "file2.txt") not in cache
+
+    cache[verified_datafile_cache_key(2, "file1.txt")] = True
+    settings.save_verified_datafiles_cache()
+
+    settings.initialize_verified_datafiles_cache()
+    cache = settings.verified_datafiles_cache
+    assert len(cache) == 3
+    assert verified_datafile_cache_key(2, "file1.txt") in cache
+    settings.save_verified_datafiles_cache()
+
+    shutil.rmtree(temp_dir)
+
+
+def test_verified_folder_fingerprint(set_exp_dataset_config):
+    """Test skipping per-file lookups for a folder whose files were all
+    verified, unless the folder has changed since
+    """
+    from mydata.conf import settings
+    from mydata.models.folder import Folder
+    from mydata.models.lookup import LookupStatus
+    from mydata.tasks.lookups import FolderLookup
+    from mydata.utils.verified_cache import verified_datafile_cache_key
+
+    class MockDataset:
+        """Just the Dataset attributes used by lookups
+        """
+
+        id = dataset_id = 1
+
+    temp_dir = tempfile.mkdtemp()
+    settings.config_path = os.path.join(temp_dir, "MyData.cfg")
+    settings.miscellaneous.cache_datafile_lookups = True
+    location = os.path.join(temp_dir, "data")
+    os.makedirs(os.path.join(location, "Dataset1", "subdir"))
+    for filename in ("file1.txt", os.path.join("subdir", "file2.txt")):
+        with open(os.path.join(location, "Dataset1", filename), "w") as datafile:
+            datafile.write(filename)
+
+    def lookup_folder():
+        folder = Folder("Dataset1", location, None, None, None)
+        folder.dataset = MockDataset()
+        lookups = []
+        FolderLookup(folder, lookups.append, None).lookup_datafiles()
+        assert [lookup.status for lookup in lookups] == [
+            LookupStatus.FOUND_VERIFIED
+        ] * 2
+        return folder, lookups
+
+    settings.initialize_verified_datafiles_cache()
+    cache = settings.verified_datafiles_cache
+    cache[verified_datafile_cache_key(1, "file1.txt")] = True
+    cache[verified_datafile_cache_key(1, "subdir/file2.txt")] = True
+
+    # Both files are found in the cache, so the folder's fingerprint is recorded:
+    folder, _ = lookup_folder()
+    assert cache.folder_is_verified(1, folder.fingerprint())
+
+    # The fingerprint matches, so the files don't need to be looked up:
+    folder, lookups = lookup_folder()
+    assert folder.num_files_uploaded == 2
+    assert folder.num_cache_hits == 2
+    assert lookups[0].message == "Found folder fingerprint in verified files cache."
+
+    # Modifying a file changes the folder's fingerprint:
+    with open(os.path.join(location, "Dataset1", "file1.txt"), "a") as datafile:
+        datafile.write("modified")
+    folder, lookups = lookup_folder()
+    assert lookups[0].message != "Found folder fingerprint in verified files cache."
+    assert cache.folder_is_verified(1, folder.fingerprint())
+    assert not cache.folder_is_verified(2, folder.fingerprint())
+
+    settings.save_verified_datafiles_cache()
+    shutil.rmtree(temp_dir)
@@ -6,6 +6,7 @@ import os
 from string import Template
 from urllib.parse import quote
 
+import pytest
 import requests_mock
 
 from tests.fixtures import set_username_dataset_config
@@ -22,15 +23,42 @@ from tests.mocks import (
 )
 
 
-def test_post_uploads(set_username_dataset_config):
+@pytest.mark.parametrize("bulk_datafile_lookups", [False, True])
+@pytest.mark.parametrize(
+    "max_lookup_threads,max_upload_threads", [(1, 1), (4, 1), (1, 4), (4, 4)]
+)
+def test_post_uploads(
+    set_username_dataset_config,
+    max_lookup_threads,
+    max_upload_threads,
+    bulk_datafile_lookups,
+):
     """
-    Test POST uploads
+    Test POST uploads, looking up and uploading files in the calling thread
+    and in pools of lookup and upload worker threads, looking up files
+    either one at a time or from a per-dataset index of datafiles
     """
     from mydata.conf import settings
     from mydata.tasks.folders import scan_folders
     from mydata.tasks.uploads import upload_folder
     from mydata.models.lookup import LookupStatus
     from mydata.models.upload import UploadStatus, UploadMethod
+    from mydata.utils.queues import (
+        init_lookup_threads,
+        init_upload_threads,
+        wait_for_lookups,
+        wait_for_uploads,
+        shutdown_lookup_threads,
+        shutdown_upload_threads,
+    )
+
+    settings["max_lookup_threads"] = max_lookup_threads
+    settings["max_upload_threads"] = max_upload_threads
+    settings["bulk_datafile_lookups"] = bulk_datafile_lookups
+    if max_lookup_threads > 1:
+        init_lookup_threads()
+    if max_upload_threads > 1:
+        init_upload_threads()
 
     users = []
     folders = []
@@ -85,6 +113,13 @@ def test_post_uploads(set_username_dataset_config):
             ) % (settings.general.mytardis_url, quote(folder.name))
             mocker.get(get_dataset_url, text=EMPTY_LIST_RESPONSE)
 
+            if bulk_datafile_lookups:
+                get_datafiles_url = (
+                    "%s/api/v1/mydata_dataset_file/?format=json&dataset__id=1&limit=1000"
+                ) % settings.general.mytardis_url
+                mocker.get(get_datafiles_url, text=EMPTY_LIST_RESPONSE)
+                continue
+
             get_df_url_template = Template(
                 (
                     "%s/api/v1/mydata_dataset_file/?format=json&dataset__id=1&filename=$filename&directory="
@@ -126,15 +161,36 @@ def test_post_uploads(set_username_dataset_config):
             assert upload.status == UploadStatus.COMPLETED, msg
             uploads.append(upload)
 
+        done_folders = dict()
+
+        def folder_done_callback(folder):
+            done_folders[folder.name] = folder.num_files_uploaded
+
         for folder in folders:
             mock_dataset_response = created_dataset_response(1, folder.name)
             mocker.post(post_dataset_url, text=mock_dataset_response)
             upload_folder(
-                folder, lookup_callback, upload_callback, UploadMethod.MULTIPART_POST
+                folder,
+                lookup_callback,
+                upload_callback,
+                UploadMethod.MULTIPART_POST,
+                folder_done_callback=folder_done_callback,
             )
 
+        wait_for_lookups()
+        wait_for_uploads()
+        shutdown_lookup_threads()
+        shutdown_upload_threads()
+
         # Ensure that all 12 files were looked up:
         assert len(lookups) == 12
 
         # Ensure that all 12 files were uploaded:
         assert len(uploads) == 12
+
+        # Ensure that each folder was reported as done, with its counts,
+        # and that its list of files was released:
+        assert sorted(done_folders) == sorted([folder.name for folder in folders])
+        assert sum(done_folders.values()) == 12
+        for folder in folders:
+            assert folder._local_files is None  # pylint: disable=protected-access
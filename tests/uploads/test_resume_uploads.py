@@ -0,0 +1,155 @@
+"""
+Test ability to resume partial uploads to staging.
+"""
+import os
+import stat
+
+import pytest
+
+from tests.fixtures import (
+    set_username_dataset_config,
+    mock_scp_server,
+    mock_key_pair,
+    mock_staging_path,
+)
+
+
+class MockUpload:
+    """Just the Upload attributes used by the resume methods
+    """
+
+    def __init__(self, file_size):
+        self.file_size = file_size
+        self.bytes_uploaded = 0
+        self.start_time = None
+        self.latest_time = None
+
+    def set_latest_time(self, latest_time):
+        """Record the time of the latest progress update
+        """
+        self.latest_time = latest_time
+
+
+@pytest.mark.parametrize("method", ["ssh", "sftp"])
+def test_resume_upload(
+    set_username_dataset_config,
+    mock_scp_server,
+    mock_key_pair,
+    mock_staging_path,
+    method,
+):
+    """Test resuming a partial upload, and refusing to resume
+    an upload whose partial content doesn't match the local file
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+    from mydata.utils.openssh import resume_upload_with_ssh
+    from mydata.utils.sftp import resume_upload_with_sftp, close_sftp_connections
+
+    if method == "sftp":
+        resume_with_method = resume_upload_with_sftp
+    else:
+        resume_with_method = resume_upload_with_ssh
+
+    content = os.urandom(3 * 1024 * 1024 + 123)
+    file_path = os.path.join(mock_staging_path, "local.bin")
+    with open(file_path, "wb") as local_file:
+        local_file.write(content)
+    remote_file_path = os.path.join(mock_staging_path, "DatasetDescription-1", "file")
+    os.makedirs(os.path.dirname(remote_file_path))
+    with open(remote_file_path, "wb") as remote_file:
+        remote_file.write(content[: 1024 * 1024 + 7])
+    os.chmod(remote_file_path, 0o600)
+
+    _, scp_port = mock_scp_server.server_address
+    args = (
+        file_path,
+        "mydata",
+        mock_key_pair.private_key_path,
+        "127.0.0.1",
+        str(scp_port),
+        remote_file_path,
+    )
+
+    upload = MockUpload(len(content))
+    assert resume_with_method(*(args + (upload,)))
+    assert upload.bytes_uploaded == len(content)
+    with open(remote_file_path, "rb") as remote_file:
+        assert remote_file.read() == content
+    assert stat.S_IMODE(os.stat(remote_file_path).st_mode) == 0o660
+
+    # A complete file on staging doesn't need any more bytes,
+    # but its permissions may not have been set yet:
+    os.chmod(remote_file_path, 0o600)
+    upload = MockUpload(len(content))
+    assert resume_with_method(*(args + (upload,)))
+    assert upload.bytes_uploaded == len(content)
+    assert stat.S_IMODE(os.stat(remote_file_path).st_mode) == 0o660
+
+    # If the partial upload doesn't match, the file must be uploaded again:
+    with open(remote_file_path, "wb") as remote_file:
+        remote_file.write(b"x" * 1024)
+    upload = MockUpload(len(content))
+    assert not resume_with_method(*(args + (upload,)))
+
+    # Nothing to resume if the file isn't on staging:
+    os.remove(remote_file_path)
+    upload = MockUpload(len(content))
+    assert not resume_with_method(*(args + (upload,)))
+
+    close_sftp_connections()
+
+
+@pytest.mark.parametrize("method", ["ssh", "sftp"])
+def test_resume_upload_check_fails(
+    set_username_dataset_config,
+    mock_scp_server,
+    mock_key_pair,
+    mock_staging_path,
+    method,
+    monkeypatch,
+):
+    """Test that if a partial upload can't be checked on staging,
+    e.g. because md5sum isn't available, the upload isn't resumed,
+    so it can be uploaded from the start
+    """
+    # pylint: disable=redefined-outer-name,unused-argument,too-many-arguments
+    from mydata.utils import openssh, sftp
+
+    def failing_command(remote_file_path):
+        return "echo 'md5sum: command not found' >&2; exit 127"
+
+    monkeypatch.setattr(
+        openssh, "get_remote_file_size_and_md5_command", failing_command
+    )
+    monkeypatch.setattr(sftp, "get_remote_file_size_and_md5_command", failing_command)
+
+    if method == "sftp":
+        resume_with_method = sftp.resume_upload_with_sftp
+    else:
+        resume_with_method = openssh.resume_upload_with_ssh
+
+    content = os.urandom(1024 * 1024)
+    file_path = os.path.join(mock_staging_path, "local.bin")
+    with open(file_path, "wb") as local_file:
+        local_file.write(content)
+    remote_file_path = os.path.join(mock_staging_path, "DatasetDescription-1", "file")
+    os.makedirs(os.path.dirname(remote_file_path))
+    with open(remote_file_path, "wb") as remote_file:
+        remote_file.write(content[:1024])
+
+    _, scp_port = mock_scp_server.server_address
+    upload = MockUpload(len(content))
+    assert not resume_with_method(
+        file_path,
+        "mydata",
+        mock_key_pair.private_key_path,
+        "127.0.0.1",
+        str(scp_port),
+        remote_file_path,
+        upload,
+    )
+    assert upload.bytes_uploaded == 0
+    with open(remote_file_path, "rb") as remote_file:
+        assert remote_file.read() == content[:1024]
+
+    sftp.close_sftp_connections()
@@ -0,0 +1,66 @@
+"""
+Test uploading small files to staging in a tar bundle.
+"""
+import os
+import stat
+
+import pytest
+
+from tests.fixtures import (
+    set_username_dataset_config,
+    mock_scp_server,
+    mock_key_pair,
+    mock_staging_path,
+)
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="requires symlinks")
+def test_tar_bundle_with_symlink(
+    set_username_dataset_config, mock_scp_server, mock_key_pair, mock_staging_path,
+):
+    """Test that a symbolic link to a data file is bundled as the file it
+    points to, like scp would upload it, rather than as a link
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+    from mydata.utils.openssh import (
+        upload_tar_bundle_with_ssh,
+        clean_up_scp_and_ssh_processes,
+    )
+
+    local_dir = os.path.join(mock_staging_path, "local")
+    os.makedirs(local_dir)
+    contents = [b"regular file\n", b"linked file\n"]
+    file_path = os.path.join(local_dir, "regular.txt")
+    with open(file_path, "wb") as local_file:
+        local_file.write(contents[0])
+    target_path = os.path.join(local_dir, "target.txt")
+    with open(target_path, "wb") as local_file:
+        local_file.write(contents[1])
+    link_path = os.path.join(local_dir, "link.txt")
+    os.symlink(target_path, link_path)
+
+    remote_dir = os.path.join(mock_staging_path, "DatasetDescription-1")
+    remote_file_paths = [
+        os.path.join(remote_dir, "regular.txt"),
+        os.path.join(remote_dir, "link.txt"),
+    ]
+
+    _, scp_port = mock_scp_server.server_address
+    indexes = []
+    upload_tar_bundle_with_ssh(
+        list(zip([file_path, link_path], remote_file_paths)),
+        "mydata",
+        mock_key_pair.private_key_path,
+        "127.0.0.1",
+        str(scp_port),
+        progress_callback=indexes.append,
+    )
+    assert indexes == [0, 1]
+
+    for remote_file_path, content in zip(remote_file_paths, contents):
+        assert not os.path.islink(remote_file_path)
+        with open(remote_file_path, "rb") as remote_file:
+            assert remote_file.read() == content
+        assert stat.S_IMODE(os.stat(remote_file_path).st_mode) == 0o660
+
+    clean_up_scp_and_ssh_processes()
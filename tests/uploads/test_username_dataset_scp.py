@@ -1,6 +1,6 @@
 """
 Test ability to scan the Username / Dataset folder structure
-and upload using the SCP protocol.
+and upload using the SCP (or SFTP) protocol.
 
 This module provides the "test_scan_username_dataset_folders" function,
 preceded by a series of helper functions.
@@ -10,6 +10,7 @@ preceded by a series of helper functions.
 from string import Template
 from urllib.parse import quote
 
+import pytest
 import requests_mock
 
 from tests.fixtures import (
@@ -308,10 +309,11 @@ def assert_scan_folders_success(settings):
 
 
 def assert_upload_folders_success(
-    folders, settings, mock_scp_server, mock_staging_path
+    folders, settings, mock_scp_server, mock_staging_path, upload_method=None
 ):
     """Test uploading folders in the Username / Dataset folder structure
-    using the SCP upload method and assert that the results look OK.
+    using the SCP (or specified) upload method and assert that the results
+    look OK.
 
     This is a helper function for test_scan_username_dataset_folders
     """
@@ -320,6 +322,9 @@ def assert_upload_folders_success(
     from mydata.tasks.uploads import upload_folder
     from mydata.models.upload import UploadMethod
 
+    if upload_method is None:
+        upload_method = UploadMethod.SCP
+
     with requests_mock.Mocker() as mocker:
         mock_responses_for_upload_folders(
             folders, mocker, settings, mock_staging_path, mock_scp_server
@@ -336,24 +341,99 @@ def assert_upload_folders_success(
 
         for folder in folders:
             upload_folder(
-                folder, lookup_callback, upload_callback, upload_method=UploadMethod.SCP
+                folder, lookup_callback, upload_callback, upload_method=upload_method
             )
 
         assert_expected_datafile_lookups(lookups)
         assert_expected_datafile_uploads(uploads)
 
 
+@pytest.mark.parametrize("use_ssh_control_master", [False, True])
 def test_scan_username_dataset_folders(
-    set_username_dataset_config, mock_scp_server, mock_key_pair, mock_staging_path
+    set_username_dataset_config,
+    mock_scp_server,
+    mock_key_pair,
+    mock_staging_path,
+    use_ssh_control_master,
 ):
-    """Test ability to scan the Username / Dataset folder structure.
+    """Test ability to scan the Username / Dataset folder structure,
+    and upload with or without a multiplexed SSH master connection.
     """
     # pylint: disable=redefined-outer-name,unused-argument
 
     from mydata.conf import settings
+    from mydata.utils.openssh import CONTROL_MASTERS, clean_up_scp_and_ssh_processes
+
+    settings["use_ssh_control_master"] = use_ssh_control_master
 
     upload_uploader_info(settings, mock_key_pair)
 
     folders = assert_scan_folders_success(settings)
 
     assert_upload_folders_success(folders, settings, mock_scp_server, mock_staging_path)
+
+    if use_ssh_control_master:
+        assert len(CONTROL_MASTERS) == 1
+        assert all(CONTROL_MASTERS.values())
+    else:
+        assert not CONTROL_MASTERS
+
+    clean_up_scp_and_ssh_processes()
+    assert not CONTROL_MASTERS
+
+
+def test_scan_username_dataset_folders_sftp(
+    set_username_dataset_config, mock_scp_server, mock_key_pair, mock_staging_path,
+):
+    """Test ability to scan the Username / Dataset folder structure,
+    and upload using the SFTP upload method.
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+
+    from mydata.conf import settings
+    from mydata.models.upload import UploadMethod
+    from mydata.utils.sftp import SSH_CLIENTS, close_sftp_connections
+
+    upload_uploader_info(settings, mock_key_pair)
+
+    folders = assert_scan_folders_success(settings)
+
+    assert_upload_folders_success(
+        folders,
+        settings,
+        mock_scp_server,
+        mock_staging_path,
+        upload_method=UploadMethod.SFTP,
+    )
+
+    # All of the uploads should have shared one connection:
+    assert len(SSH_CLIENTS) == 1
+
+    close_sftp_connections()
+    assert not SSH_CLIENTS
+
+
+def test_scan_username_dataset_folders_tar_bundles(
+    set_username_dataset_config, mock_scp_server, mock_key_pair, mock_staging_path,
+):
+    """Test ability to scan the Username / Dataset folder structure,
+    and upload small files in tar bundles over SSH.
+    """
+    # pylint: disable=redefined-outer-name,unused-argument
+
+    from mydata.conf import settings
+    from mydata.tasks.uploads import TAR_BUNDLES
+    from mydata.utils.openssh import clean_up_scp_and_ssh_processes
+
+    settings["max_bundled_file_size"] = 1024 * 1024
+    settings["max_files_per_bundle"] = 2
+
+    upload_uploader_info(settings, mock_key_pair)
+
+    folders = assert_scan_folders_success(settings)
+
+    assert_upload_folders_success(folders, settings, mock_scp_server, mock_staging_path)
+
+    assert not TAR_BUNDLES
+
+    clean_up_scp_and_ssh_processes()